@@ -1,51 +1,45 @@
+import argparse
+
 import psycopg2
 
+from migrations import migrate
+from settings import DB_PARAMS
 
-def create_tables(conn):
+
+def drop_tables(conn):
     conn.cursor().execute("""
     DROP TABLE IF EXISTS e_r_words CASCADE;
     DROP TABLE IF EXISTS e_words CASCADE;
     DROP TABLE IF EXISTS r_words CASCADE;
+    DROP TABLE IF EXISTS answers;
+    DROP TABLE IF EXISTS reviews;
     DROP TABLE IF EXISTS user_words;
     DROP TABLE IF EXISTS users;
+    DROP TABLE IF EXISTS sessions;
+    DROP TABLE IF EXISTS schema_migrations;
     """)
     conn.commit()
 
-    conn.cursor().execute("""
-        CREATE TABLE IF NOT EXISTS e_words(
-            id SERIAL PRIMARY KEY,
-            word VARCHAR(40) NOT NULL UNIQUE
-        );
-        """)
-    conn.cursor().execute("""
-        CREATE TABLE IF NOT EXISTS r_words(
-            id SERIAL PRIMARY KEY,
-            word VARCHAR(40) NOT NULL UNIQUE
-        );
-        """)
-    conn.cursor().execute("""
-        CREATE TABLE IF NOT EXISTS e_r_words(
-            id SERIAL PRIMARY KEY,
-            e_word_id INTEGER NOT NULL REFERENCES e_words(id),
-            r_word_id INTEGER NOT NULL REFERENCES r_words(id)
-        );
-        """)
-    conn.cursor().execute("""
-        CREATE TABLE IF NOT EXISTS users(
-            user_id INTEGER PRIMARY KEY,
-            user_name VARCHAR(40) NOT NULL
-        );
-        """)
-    conn.cursor().execute("""
-        CREATE TABLE IF NOT EXISTS user_words(
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(user_id),
-            custom_word_id INTEGER NOT NULL REFERENCES e_r_words(id)       
-        );
-        """)
-    conn.commit()
+
+def create_tables(conn):
+    """
+    Function Purpose:
+
+    Brings the schema up to date by applying the pending migrations (see migrations.py).
+    Existing tables and data are kept, so this is safe to run against a live database.
+    """
+    migrate(conn)
 
 
-with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
-    with conn.cursor() as cur:
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create or upgrade the bot database schema.')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop all tables first (development only, deletes every word and user)')
+    args = parser.parse_args()
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        if args.reset:
+            drop_tables(conn)
         create_tables(conn)
+    finally:
+        conn.close()
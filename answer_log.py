@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+
+from metrics import registry
+
+
+class AnswerLog:
+    """
+    Class Purpose:
+
+    Write-behind buffer for answer events. record() only appends the event to an
+    in-process buffer, so a handler never waits on the database; a background thread
+    writes the buffer with one batched insert every flush_interval seconds, or sooner
+    once batch_size events are waiting, and close() writes what is left. If a write
+    fails, the events are kept and retried with the next flush; while the database stays
+    unavailable at most max_pending events are kept, the oldest ones are dropped first.
+    The buffer and the write counters are exported as the bot_answer_log gauges.
+
+    Parameters:
+
+    writer: Stores a list of (user_id, pair_id, answer, correct, answered_at) rows and
+    returns the number of rows stored, or None on failure (storage.record_answers).
+    batch_size: The number of waiting events that triggers an early write, and the
+    largest number of rows written by one insert.
+    flush_interval: Seconds between writes.
+    max_pending: How many events are kept while they cannot be written.
+    """
+
+    def __init__(self, writer, batch_size=500, flush_interval=0.2, max_pending=100000):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._stats = {'recorded': 0, 'written': 0, 'batches': 0, 'failed_batches': 0, 'dropped': 0}
+        self._flusher = threading.Thread(target=self._flush_loop, name='answer-log-flush', daemon=True)
+        self._flusher.start()
+        registry.register_gauges('bot_answer_log', self.stats, 'Answer events buffered and written.')
+
+    def record(self, user_id, pair_id, answer, correct):
+        """Queues one answer event, timestamped now."""
+        row = (user_id, pair_id, answer, correct, time.time())
+        with self._lock:
+            full = len(self._pending) == self.max_pending
+            # A full deque drops its oldest event on append.
+            self._pending.append(row)
+            self._stats['recorded'] += 1
+            if full:
+                self._stats['dropped'] += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        return stats
+
+    def flush(self):
+        """
+        Function Purpose:
+
+        Writes all buffered events, batch_size rows per insert. If an insert fails (the
+        writer returns None or raises), its events and the ones after them are put back
+        in front of the events recorded meanwhile.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = list(self._pending)
+                self._pending.clear()
+            failed = []
+            for start in range(0, len(pending), self.batch_size):
+                try:
+                    written = self.writer(pending[start:start + self.batch_size])
+                except Exception as ex:
+                    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                    message = template.format(type(ex).__name__, ex.args)
+                    print(message)
+                    written = None
+                with self._lock:
+                    if written is None:
+                        # The database is likely unavailable; the rest waits for the next flush.
+                        self._stats['failed_batches'] += 1
+                        failed = pending[start:]
+                        break
+                    self._stats['written'] += written
+                    self._stats['batches'] += 1
+            if failed:
+                with self._lock:
+                    excess = len(failed) + len(self._pending) - self.max_pending
+                    if excess > 0:
+                        self._stats['dropped'] += excess
+                    # Prepending to a full deque drops from the newer end, so the oldest
+                    # events are cut from the failed ones instead.
+                    self._pending.extendleft(reversed(failed[max(0, excess):]))
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
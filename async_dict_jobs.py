@@ -0,0 +1,394 @@
+"""
+Asyncio counterpart of dict_jobs for the AsyncTeleBot entry point (main_async.py).
+
+The functions mirror the dict_jobs API and semantics but are coroutines running on
+an asyncpg connection pool, so a slow query only suspends the handler that made it.
+The SQL of the hot queries is shared with dict_jobs and translated from psycopg2's
+placeholders to asyncpg's numbered ones.
+"""
+import re
+
+import asyncpg
+
+from dict_jobs import ADD_WORD
+from dict_jobs import DELETE_WORDS
+from dict_jobs import LEASE_REVIEWS
+from dict_jobs import INTRODUCE_REVIEWS
+from dict_jobs import REVIEW_STATE
+from dict_jobs import SAVE_REVIEW
+from dict_jobs import SAMPLE_PAIRS
+from dict_jobs import SAMPLE_WORDS
+from dict_jobs import FULL_SCAN_WORDS
+from dict_jobs import RANDOM_CARDS
+from dict_jobs import SHARED_WORD_PAIRS
+from dict_jobs import USER_WORD_PAIRS
+from metrics import log_slow_query
+from metrics import record_error
+from metrics import timed
+from settings import DB_PARAMS
+from settings import DB_POOL_MIN
+from settings import DB_POOL_MAX
+from settings import DB_POOL_TIMEOUT
+from settings import REVIEW_LEASE
+from settings import SLOW_QUERY_MS
+from settings import VOCAB_CACHE_USERS
+from settings import VOCAB_CACHE_TTL
+from settings import SIMILAR_DISTRACTORS
+from spaced_repetition import NEW_CARD
+from spaced_repetition import ReviewState
+from spaced_repetition import next_review
+from storage_types import Card
+from storage_types import AddWordResult
+from storage_types import DeleteWordsResult
+from storage_types import WORD_ALREADY_OWNED
+from storage_types import DISTRACTOR_OVERSAMPLING
+from vocab_cache import VocabularyCache
+from vocab_cache import WordCountCache
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s')
+
+_pool = None
+
+# This process' own vocabulary cache. Its loaders never query: the snapshot and the
+# overlays are loaded with awaited queries and stored with put_shared/put_user, and an
+# expired snapshot is served stale until then, so the cache never blocks the event loop.
+vocabulary = VocabularyCache(lambda: None, lambda user_id: None,
+                             max_users=VOCAB_CACHE_USERS, shared_ttl=VOCAB_CACHE_TTL,
+                             similar_distractors=SIMILAR_DISTRACTORS)
+word_counts = WordCountCache(max_users=VOCAB_CACHE_USERS)
+
+
+def _query(sql, params=()):
+    """
+    Translates a psycopg2 query with %s or %(name)s placeholders into asyncpg's
+    $1, $2, ... form and returns it with the matching list of arguments.
+    """
+    args = []
+    numbers = {}
+    positional = iter(params) if not isinstance(params, dict) else None
+
+    def number(match):
+        name = match.group(1)
+        if name is None:
+            args.append(next(positional))
+            return f'${len(args)}'
+        if name not in numbers:
+            args.append(params[name])
+            numbers[name] = len(args)
+        return f'${numbers[name]}'
+
+    return _PLACEHOLDER.sub(number, sql), args
+
+
+def _log_slow_query(record):
+    if record.elapsed * 1000 >= SLOW_QUERY_MS:
+        log_slow_query(record.query, record.args, record.elapsed)
+
+
+async def _init_connection(conn):
+    if SLOW_QUERY_MS > 0:
+        conn.add_query_logger(_log_slow_query)
+
+
+async def open_pool():
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                                          init=_init_connection, **DB_PARAMS)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_connection():
+    """Borrows a connection from the asyncpg pool: "async with get_connection() as conn"."""
+    return _pool.acquire(timeout=DB_POOL_TIMEOUT)
+
+
+def _print_exception(ex):
+    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+    message = template.format(type(ex).__name__, ex.args)
+    print(message)
+    record_error()
+
+
+async def _random_words_full_scan(conn, user_id, eng_rus, word_to_avoid, count):
+    word_column = 'rw.word' if eng_rus else 'ew.word'
+    sql, args = _query(FULL_SCAN_WORDS.format(word=word_column),
+                       {'uid': user_id, 'avoid': word_to_avoid, 'count': count})
+    return [row[0] for row in await conn.fetch(sql, *args)]
+
+
+async def _sample_words(conn, user_id, eng_rus, word_to_avoid, count):
+    word_column = 'r_w' if eng_rus else 'e_w'
+    sql, args = _query(SAMPLE_WORDS.format(word=word_column),
+                       {'uid': user_id, 'avoid': word_to_avoid, 'count': count,
+                        'probes': count * DISTRACTOR_OVERSAMPLING})
+    words = [row[0] for row in await conn.fetch(sql, *args)]
+    if len(words) < count:
+        words = await _random_words_full_scan(conn, user_id, eng_rus, word_to_avoid, count)
+    return words
+
+
+@timed('query')
+async def random_word_from_base(user_id):
+    """See dict_jobs.random_word_from_base."""
+    async with get_connection() as conn:
+        try:
+            sql, args = _query("with" + SAMPLE_PAIRS + "select r_w, e_w from sample;",
+                               {'uid': user_id, 'probes': 1})
+            row = await conn.fetchrow(sql, *args)
+            return tuple(row) if row is not None else None
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def random_engl_words(word_to_avoid, user_id):
+    """See dict_jobs.random_engl_words."""
+    async with get_connection() as conn:
+        try:
+            return await _sample_words(conn, user_id, False, word_to_avoid, 4)
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def random_rus_words(word_to_avoid, user_id):
+    """See dict_jobs.random_rus_words."""
+    async with get_connection() as conn:
+        try:
+            return await _sample_words(conn, user_id, True, word_to_avoid, 4)
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def random_cards(user_id, count, eng_rus=True, others_count=4):
+    """See dict_jobs.random_cards."""
+    word_column = 'r_w' if eng_rus else 'e_w'
+    per_card = others_count * DISTRACTOR_OVERSAMPLING
+    async with get_connection() as conn:
+        try:
+            sql, args = _query(RANDOM_CARDS.format(word=word_column),
+                               {'uid': user_id, 'count': count, 'others': others_count,
+                                'per_card': per_card, 'probes': count * (1 + per_card)})
+            cards = []
+            for pair_id, r_w, e_w, others in await conn.fetch(sql, *args):
+                others = list(others)
+                if len(others) < others_count:
+                    others = await _random_words_full_scan(conn, user_id, eng_rus,
+                                                           r_w if eng_rus else e_w, others_count)
+                if eng_rus:
+                    cards.append(Card(pair_id, r_w, e_w, others))
+                else:
+                    cards.append(Card(pair_id, e_w, r_w, others))
+            return cards
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def random_card(user_id, eng_rus=True, others_count=4):
+    """See dict_jobs.random_card."""
+    cards = await random_cards(user_id, 1, eng_rus, others_count)
+    return cards[0] if cards else None
+
+
+@timed('query')
+async def shared_word_pairs():
+    """See dict_jobs.shared_word_pairs."""
+    async with get_connection() as conn:
+        try:
+            return [tuple(row) for row in await conn.fetch(SHARED_WORD_PAIRS)]
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def user_word_pairs(uid):
+    """See dict_jobs.user_word_pairs."""
+    async with get_connection() as conn:
+        try:
+            sql, args = _query(USER_WORD_PAIRS, (uid,))
+            return [tuple(row) for row in await conn.fetch(sql, *args)]
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def cached_card(user_id, eng_rus=True, others_count=4):
+    """
+    Function Purpose:
+
+    See dict_jobs.cached_card. The shared snapshot and the user's overlay are loaded
+    into this module's vocabulary cache with awaited queries before the card is built
+    in memory, so the event loop is never blocked by the cache.
+    """
+    if vocabulary.needs_shared():
+        rows = await shared_word_pairs()
+        if rows is not None:
+            vocabulary.put_shared(rows)
+    if vocabulary.needs_user(user_id):
+        invalidations = vocabulary.invalidation_count()
+        rows = await user_word_pairs(user_id)
+        if rows is not None:
+            vocabulary.put_user(user_id, rows, invalidations)
+    card = vocabulary.card(user_id, eng_rus, others_count)
+    if card is None:
+        return await random_card(user_id, eng_rus, others_count)
+    return Card(*card)
+
+
+async def _review_card(user_id, row, eng_rus, others_count):
+    pair_id, e_word, r_word = row
+    target_word, translate_word = (r_word, e_word) if eng_rus else (e_word, r_word)
+    others = vocabulary.distractors(user_id, target_word, eng_rus, others_count, translate_word)
+    if others is None:
+        others = await (random_rus_words if eng_rus else random_engl_words)(target_word, user_id) or []
+    return Card(pair_id, target_word, translate_word, others)
+
+
+@timed('query')
+async def scheduled_card(user_id, eng_rus=True, others_count=4):
+    """See dict_jobs.scheduled_cards; picks a single card."""
+    params = {'uid': user_id, 'count': 1, 'ahead': False, 'lease': REVIEW_LEASE}
+    try:
+        async with get_connection() as conn:
+            sql, args = _query(LEASE_REVIEWS, params)
+            row = await conn.fetchrow(sql, *args)
+        if row is None:
+            card = await cached_card(user_id, eng_rus, others_count)
+            if card is None:
+                return None
+            async with get_connection() as conn:
+                sql, args = _query(INTRODUCE_REVIEWS, {'uid': user_id, 'pairs': [card.pair_id], 'count': 1})
+                if await conn.fetchval(sql, *args) is not None:
+                    return card
+                sql, args = _query(LEASE_REVIEWS, dict(params, ahead=True))
+                row = await conn.fetchrow(sql, *args)
+            if row is None:
+                return card
+        return await _review_card(user_id, tuple(row), eng_rus, others_count)
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+async def record_review(uid, pair_id, quality):
+    """See dict_jobs.record_review."""
+    async with get_connection() as conn:
+        try:
+            async with conn.transaction():
+                sql, args = _query(REVIEW_STATE, (uid, pair_id))
+                row = await conn.fetchrow(sql, *args)
+                state = next_review(ReviewState(*row) if row is not None else NEW_CARD, quality)
+                sql, args = _query(SAVE_REVIEW, {'uid': uid, 'pair': pair_id, 'repetitions': state.repetitions,
+                                                 'interval': state.interval_days, 'ease': state.ease})
+                await conn.execute(sql, *args)
+            return state
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def if_user_not_exist(user_id):
+    """See dict_jobs.if_user_not_exist."""
+    async with get_connection() as conn:
+        try:
+            row = await conn.fetchrow("select from users where user_id = $1", user_id)
+            if row is None:
+                return True
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def known_user_ids():
+    """See dict_jobs.known_user_ids."""
+    async with get_connection() as conn:
+        try:
+            return [row[0] for row in await conn.fetch("select user_id from users")]
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def add_user(user_id, user_name):
+    """See dict_jobs.add_user."""
+    async with get_connection() as conn:
+        try:
+            return await conn.fetchval("""
+                insert into users (user_id, user_name)
+                values ($1, $2)
+                on conflict (user_id) do nothing
+                RETURNING true
+                """, user_id, user_name) is not None
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def add_word_to_dict(uid, word_e, word_r):
+    """See dict_jobs.add_word_to_dict."""
+    async with get_connection() as conn:
+        try:
+            sql, args = _query(ADD_WORD, {'uid': uid, 'e': word_e, 'r': word_r})
+            row = None
+            for _ in range(2):
+                row = await conn.fetchrow(sql, *args)
+                if row is not None:
+                    break
+            if row is None:
+                return None
+            result = AddWordResult(row[1], row[0], row[2])
+            if result.status != WORD_ALREADY_OWNED:
+                vocabulary.invalidate_user(uid)
+            word_counts.put(uid, result.word_count)
+            return result
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def delete_words_from_dict(uid, words):
+    """See dict_jobs.delete_words_from_dict."""
+    async with get_connection() as conn:
+        try:
+            sql, args = _query(DELETE_WORDS, {'uid': uid, 'words': list(words)})
+            row = await conn.fetchrow(sql, *args)
+            result = DeleteWordsResult(row[0], row[3])
+            if result.removed:
+                vocabulary.invalidate_user(uid)
+            word_counts.put(uid, result.word_count)
+            return result
+        except Exception as ex:
+            _print_exception(ex)
+
+
+@timed('query')
+async def delete_word_from_dict(uid, word_e):
+    """See dict_jobs.delete_word_from_dict."""
+    result = await delete_words_from_dict(uid, [word_e])
+    return bool(result and result.removed)
+
+
+@timed('query')
+async def custom_words_user_count(uid):
+    """See dict_jobs.custom_words_user_count."""
+    count = word_counts.get(uid)
+    if count is not None:
+        return str(count)
+    async with get_connection() as conn:
+        try:
+            count = await conn.fetchval("select custom_words_count from users where user_id = $1", uid)
+            count = count if count is not None else 0
+            word_counts.put(uid, count)
+            return str(count)
+        except Exception as ex:
+            _print_exception(ex)
@@ -0,0 +1,189 @@
+"""
+Startup backlog drain for the polling bot (main.py).
+
+Telegram keeps the updates that arrive while the bot is down. Instead of skipping them,
+BacklogDrain fetches them all with getUpdates before polling starts, drops the card
+requests that a later card request of the same chat supersedes (e.g. NEXT pressed
+several times), and hands the rest to a ChatOrderedExecutor: updates of one chat are
+handled in order, different chats in parallel. An answer from a user who has no card
+to check it against (the card was lost with the session in the restart) gets a fresh
+card instead. Polling then goes on from the update after the last drained one, and the
+drain rate is printed and exported as bot_backlog.
+"""
+import time
+
+from telebot import util
+
+from bot_common import Command, update_chat_id
+from chat_executor import ChatOrderedExecutor
+from metrics import registry
+
+# Telegram returns at most this many updates per getUpdates call.
+MAX_BATCH = 100
+
+CARD_COMMANDS = ('start', 'cards')
+
+BUTTONS = (Command.NEXT, Command.ADD_WORD, Command.DELETE_WORD)
+
+
+def requests_card(update):
+    """True for an update that only asks for the next card: /start, /cards or the NEXT button."""
+    message = update.message
+    if message is None or message.text is None:
+        return False
+    return message.text == Command.NEXT or util.extract_command(message.text) in CARD_COMMANDS
+
+
+def is_answer(update):
+    """True for a plain text message: neither a command nor one of the card buttons."""
+    message = update.message
+    if message is None or message.text is None:
+        return False
+    return message.text not in BUTTONS and util.extract_command(message.text) is None
+
+
+def stale_answers(updates, needs_card):
+    """
+    Returns the update_ids of the answers that have no card to be checked against: the
+    answers of a user for whom needs_card(user_id) is true, sent before anything else
+    of the chat in the backlog (a card request or a button that changes the dialog).
+    """
+    stale = set()
+    settled = set()
+    for update in updates:
+        chat_id = update_chat_id(update)
+        if chat_id in settled:
+            continue
+        if is_answer(update) and needs_card(update.message.from_user.id):
+            stale.add(update.update_id)
+        else:
+            settled.add(chat_id)
+    return stale
+
+
+def collapse(updates, stale=()):
+    """
+    Returns the updates without the superseded ones, in their original order. A card
+    request directly followed by another card request of the same chat is dropped: its
+    card would be replaced by the next one before the user could answer it. The stale
+    answers (update_ids) count as card requests. Everything else, the answers in
+    particular, is kept.
+    """
+    def wants_card(update):
+        return update.update_id in stale or requests_card(update)
+
+    last_of_chat = {}
+    superseded = set()
+    for index, update in enumerate(updates):
+        chat_id = update_chat_id(update)
+        previous = last_of_chat.get(chat_id)
+        if previous is not None and wants_card(updates[previous]) and wants_card(update):
+            superseded.add(previous)
+        last_of_chat[chat_id] = index
+    return [update for index, update in enumerate(updates) if index not in superseded]
+
+
+class BacklogDrain:
+    """
+    Class Purpose:
+
+    Handles the updates that are pending when the bot starts, before polling takes over.
+
+    Parameters:
+
+    bot: The TeleBot whose handlers process the updates; its last_update_id is advanced
+    past the drained updates, so infinity_polling() continues after them.
+    workers: The number of threads handling chats in parallel.
+    batch_size: Updates fetched per getUpdates call (at most MAX_BATCH).
+    needs_card: Called with a user ID; true if the user's text message would be taken as
+    an answer, but they have no card to answer. None turns the check off.
+    send_card: Called with the message of a stale answer instead of the handlers; shows
+    the user a fresh card (main.create_cards).
+    """
+
+    def __init__(self, bot, workers=8, batch_size=MAX_BATCH, needs_card=None, send_card=None):
+        self.bot = bot
+        self.workers = workers
+        self.batch_size = max(1, min(batch_size, MAX_BATCH))
+        self.needs_card = needs_card
+        self.send_card = send_card
+        self._stale = set()
+        self._stats = {'fetched': 0, 'superseded': 0, 'stale_answers': 0, 'processed': 0, 'chats': 0,
+                       'fetch_seconds': 0.0, 'seconds': 0.0, 'updates_per_second': 0.0}
+        registry.register_gauges('bot_backlog', self.stats, 'Updates drained from the backlog at startup.')
+
+    def stats(self):
+        return dict(self._stats)
+
+    def _fetch(self, updates):
+        # A batch shorter than requested means the queue is empty; updates arriving
+        # after that are picked up by polling.
+        while True:
+            batch = self.bot.get_updates(offset=self.bot.last_update_id + 1, limit=self.batch_size,
+                                         long_polling_timeout=0)
+            updates.extend(batch)
+            if batch:
+                self.bot.last_update_id = max(update.update_id for update in batch)
+            if len(batch) < self.batch_size:
+                return
+
+    def _process(self, update):
+        if update.update_id in self._stale:
+            self.send_card(update.message)
+        else:
+            self.bot.process_new_updates([update])
+
+    def run(self):
+        """
+        Function Purpose:
+
+        Fetches, collapses and handles the pending updates, and returns the statistics
+        of the drain. If fetching fails, the updates fetched so far are still handled
+        (Telegram already counts them as delivered) and polling picks up the rest.
+
+        Return Value:
+
+        A dict with the number of updates fetched and superseded, of the answers that had
+        no card to check them against (stale_answers) and of the updates processed, the number
+        of chats, the time spent fetching and in total, and the processed updates per second.
+        """
+        started = time.monotonic()
+        updates = []
+        try:
+            self._fetch(updates)
+        except Exception as ex:
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            print(message)
+        fetched = time.monotonic()
+        if self.needs_card is not None and self.send_card is not None:
+            self._stale = stale_answers(updates, self.needs_card)
+        pending = collapse(updates, self._stale)
+        # Handlers must run in the executor's workers; TeleBot's own thread pool would
+        # hand them to arbitrary threads and lose the per-chat order.
+        threaded = self.bot.threaded
+        self.bot.threaded = False
+        executor = ChatOrderedExecutor(self._process, workers=self.workers, max_pending=len(pending) + 1)
+        try:
+            for update in pending:
+                executor.submit(update_chat_id(update), update)
+            executor.join()
+        finally:
+            executor.shutdown()
+            self.bot.threaded = threaded
+        seconds = time.monotonic() - started
+        self._stats = {
+            'fetched': len(updates),
+            'superseded': len(updates) - len(pending),
+            'stale_answers': len(self._stale),
+            'processed': len(pending),
+            'chats': len({update_chat_id(update) for update in pending}),
+            'fetch_seconds': round(fetched - started, 3),
+            'seconds': round(seconds, 3),
+            'updates_per_second': round(len(pending) / seconds, 1) if seconds > 0 else 0.0,
+        }
+        print(f"Backlog drained: {self._stats['processed']} of {self._stats['fetched']} updates "
+              f"({self._stats['superseded']} superseded, {self._stats['stale_answers']} stale answers) "
+              f"from {self._stats['chats']} chats in {seconds:.2f}s, "
+              f"{self._stats['updates_per_second']:.0f} updates/s")
+        return self.stats()
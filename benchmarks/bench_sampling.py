@@ -0,0 +1,136 @@
+"""
+Compares the id-range probing sampler in dict_jobs with the former ORDER BY random() queries.
+
+For every vocabulary size a throwaway schema is filled with synthetic word pairs
+(a share of them linked to custom users), then both variants are timed for the
+target pair and for the distractor list. Run from the project root:
+
+    python -m benchmarks.bench_sampling --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import statistics
+import time
+
+import psycopg2
+
+from settings import DB_PARAMS
+
+SCHEMA = 'bench_sampling'
+
+# Every pooled dict_jobs connection resolves the tables inside the benchmark schema.
+os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+
+import dict_jobs  # noqa: E402
+
+LEGACY_WORD_FROM_BASE = """
+    select rw.word as r_w, ew.word as e_w
+    from r_words rw
+    join e_r_words erw on erw.r_word_id = rw.id
+    join e_words ew on ew.id = erw.e_word_id
+    full outer join user_words uw on uw.custom_word_id = erw.id
+    where uw.user_id = %s or uw.user_id is null
+    ORDER BY random() LIMIT 1;
+"""
+
+LEGACY_RUS_WORDS = """
+    select rw.word
+    from r_words rw
+    join e_r_words erw on erw.r_word_id = rw.id
+    full outer join user_words uw on uw.custom_word_id = erw.id
+    where rw.word != %s and (uw.user_id = %s or uw.user_id is null)
+    ORDER BY random() LIMIT 4;
+"""
+
+
+def build_schema(conn, size, users, custom_share):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA};")
+        cur.execute(f"SET search_path = {SCHEMA}")
+        cur.execute("""
+            CREATE TABLE e_words(id SERIAL PRIMARY KEY, word VARCHAR(40) NOT NULL UNIQUE);
+            CREATE TABLE r_words(id SERIAL PRIMARY KEY, word VARCHAR(40) NOT NULL UNIQUE);
+            CREATE TABLE e_r_words(
+                id SERIAL PRIMARY KEY,
+                e_word_id INTEGER NOT NULL REFERENCES e_words(id),
+                r_word_id INTEGER NOT NULL REFERENCES r_words(id)
+            );
+            CREATE TABLE users(user_id INTEGER PRIMARY KEY, user_name VARCHAR(40) NOT NULL);
+            CREATE TABLE user_words(
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(user_id),
+                custom_word_id INTEGER NOT NULL REFERENCES e_r_words(id)
+            );
+            """)
+        cur.execute("""
+            insert into e_words (word) select 'e' || g from generate_series(1, %(size)s) g;
+            insert into r_words (word) select 'r' || g from generate_series(1, %(size)s) g;
+            insert into e_r_words (e_word_id, r_word_id) select g, g from generate_series(1, %(size)s) g;
+            insert into users (user_id, user_name) select g, 'user' || g from generate_series(1, %(users)s) g;
+            insert into user_words (user_id, custom_word_id)
+                select 1 + floor(random() * %(users)s)::integer, g
+                from generate_series(1, %(size)s) g
+                where random() < %(share)s;
+            create index user_words_custom_word_id_idx on user_words(custom_word_id);
+            analyze;
+            """, {'size': size, 'users': users, 'share': custom_share})
+    conn.commit()
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated numbers of word pairs')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--custom-share', type=float, default=0.1,
+                        help='share of pairs linked to some user')
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    print(f"{'pairs':>10} {'query':<22} {'legacy p50/p95 ms':>20} {'probing p50/p95 ms':>20}")
+    try:
+        for size in (int(s) for s in args.sizes.split(',')):
+            build_schema(conn, size, args.users, args.custom_share)
+            user_id = 1
+
+            def legacy(sql, params):
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    cur.fetchall()
+
+            rows = [
+                ('target pair',
+                 lambda: legacy(LEGACY_WORD_FROM_BASE, (user_id,)),
+                 lambda: dict_jobs.random_word_from_base(user_id)),
+                ('distractors',
+                 lambda: legacy(LEGACY_RUS_WORDS, ('r1', user_id)),
+                 lambda: dict_jobs.random_rus_words('r1', user_id)),
+                ('whole card',
+                 lambda: (legacy(LEGACY_WORD_FROM_BASE, (user_id,)),
+                          legacy(LEGACY_RUS_WORDS, ('r1', user_id))),
+                 lambda: dict_jobs.random_card(user_id)),
+            ]
+            for name, old, new in rows:
+                old_p50, old_p95 = timed(old, args.repeat)
+                new_p50, new_p95 = timed(new, args.repeat)
+                print(f"{size:>10} {name:<22} {old_p50:>9.2f}/{old_p95:<10.2f} {new_p50:>9.2f}/{new_p95:<10.2f}")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Load test of the bot: simulated learners drive the real main.py handlers against a local Postgres.
+
+Telegram is replaced by a fake transport (telebot.apihelper.CUSTOM_REQUEST_SENDER) that
+answers every Bot API call at once (or after --api-latency ms), so only the bot and the
+database are measured. A throwaway schema is migrated and filled with synthetic word pairs,
+then --concurrency worker threads feed the updates of --learners learners into
+bot.process_new_updates, one update of a learner at a time so every chat stays in order.
+Learners start with /start, then answer cards (right with probability --accuracy), skip
+cards, add words and delete them. At the end throughput and p50/p95/p99 latency are
+printed per handler and per dict_jobs function. Run from the project root:
+
+    python -m benchmarks.load_test --learners 1000 --concurrency 64 --duration 60
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from itertools import count
+
+import psycopg2
+
+from settings import DB_PARAMS
+
+SCHEMA = 'load_test'
+
+# Every connection (pool, migrations, loader) resolves the tables inside the load test schema.
+os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+
+from telebot import apihelper, types  # noqa: E402
+
+import dict_jobs  # noqa: E402
+from bot_common import Command  # noqa: E402
+from db_pool import pool_stats  # noqa: E402
+from load_words import load_word_pairs  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+# dict_jobs functions timed per call. Nested calls (scheduled_cards -> cached_cards)
+# are reported on their own lines as well.
+TIMED_QUERIES = [
+    'scheduled_cards', '_lease_reviews', '_introduce_reviews', 'record_review', 'record_answers',
+    'cached_cards', 'random_cards', 'random_rus_words', 'random_engl_words',
+    'shared_word_pairs', 'user_word_pairs', 'known_user_ids', 'add_user',
+    'add_word_to_dict', 'delete_words_from_dict', 'custom_words_user_count',
+]
+
+FIRST_LEARNER_ID = 1_000_000
+
+
+class LatencyStats:
+    """Thread-safe latency samples and error counts, grouped by name."""
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, failed=False):
+        with self._lock:
+            self._samples[name].append(seconds)
+            if failed:
+                self._errors[name] += 1
+
+    def total(self):
+        with self._lock:
+            return sum(len(samples) for samples in self._samples.values())
+
+    def report(self, title, elapsed):
+        print(f"\n{title:<26} {'calls':>8} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+        with self._lock:
+            items = sorted(self._samples.items())
+            errors = dict(self._errors)
+        for name, samples in items:
+            samples = sorted(samples)
+            print(f"{name:<26} {len(samples):>8} {len(samples) / elapsed:>9.1f} "
+                  f"{percentile(samples, 0.50) * 1000:>9.2f} {percentile(samples, 0.95) * 1000:>9.2f} "
+                  f"{percentile(samples, 0.99) * 1000:>9.2f} {samples[-1] * 1000:>9.2f} "
+                  f"{errors.get(name, 0):>7}")
+
+
+def percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+
+def timed(stats, name, func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = result is None
+            return result
+        finally:
+            stats.record(name, time.perf_counter() - started, failed)
+    return wrapper
+
+
+def instrument_queries(stats):
+    """Wraps the dict_jobs functions; must run before main imports them by name."""
+    for name in TIMED_QUERIES:
+        setattr(dict_jobs, name, timed(stats, name, getattr(dict_jobs, name)))
+    dict_jobs.vocabulary.shared_loader = dict_jobs.shared_word_pairs
+    dict_jobs.vocabulary.user_loader = dict_jobs.user_word_pairs
+
+
+class FakeResponse:
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, payload):
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeTelegram:
+    """
+    Bot API stand-in for CUSTOM_REQUEST_SENDER. Remembers the last reply keyboard sent
+    to every chat, so learners can press its buttons like a real user would.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.keyboards = {}
+        self.calls = defaultdict(int)
+        self._message_ids = count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        api_method = url.rsplit('/', 1)[-1]
+        params = params or {}
+        with self._lock:
+            self.calls[api_method] += 1
+        if api_method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            markup = params.get('reply_markup')
+            if markup:
+                keyboard = json.loads(markup).get('keyboard', [])
+                self.keyboards[chat_id] = [button['text'] for row in keyboard for button in row]
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        elif api_method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Load test', 'username': 'load_test_bot'}
+        else:
+            result = True
+        return FakeResponse({'ok': True, 'result': result})
+
+
+class Learner:
+    """One simulated user: a queue of (handler, text) steps refilled with random actions."""
+
+    def __init__(self, user_id, rng, accuracy):
+        self.user_id = user_id
+        self.rng = rng
+        self.accuracy = accuracy
+        self.steps = [('create_cards', '/start')]
+        self.own_words = []
+
+    def next_step(self, bot, telegram):
+        if not self.steps:
+            self._plan(bot, telegram)
+        return self.steps.pop(0)
+
+    def _plan(self, bot, telegram):
+        roll = self.rng.random()
+        if roll < 0.06:
+            number = self.rng.randrange(10 ** 9)
+            e_word, r_word = f'learner{number}', f'ученик{number}'
+            self.own_words.append(e_word)
+            self.steps = [('add_word', Command.ADD_WORD), ('message_reply', e_word), ('message_reply', r_word)]
+        elif roll < 0.10 and self.own_words:
+            word = self.own_words.pop(self.rng.randrange(len(self.own_words)))
+            self.steps = [('delete_word', Command.DELETE_WORD), ('message_reply', word)]
+        elif roll < 0.18:
+            self.steps = [('next_cards', Command.NEXT)]
+        else:
+            self.steps = [('message_reply', self._answer(bot, telegram))]
+
+    def _answer(self, bot, telegram):
+        target = bot.current_states.get_data(self.user_id, self.user_id).get('target_word')
+        if target is not None and self.rng.random() < self.accuracy:
+            return target
+        commands = (Command.NEXT, Command.ADD_WORD, Command.DELETE_WORD)
+        options = [text for text in telegram.keyboards.get(self.user_id, ())
+                   if text not in commands and text != target and not text.endswith('❌')]
+        return self.rng.choice(options) if options else 'не знаю'
+
+
+def make_update(update_id, user_id, text):
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': f'Learner{user_id}'}},
+    })
+
+
+def build_schema(pairs):
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA};")
+        conn.commit()
+        migrate(conn, verbose=False)
+        conn.autocommit = False
+        load_word_pairs(conn, ((f'word{n}', f'слово{n}') for n in range(pairs)))
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop_schema():
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def import_bot():
+    """Imports main with a placeholder token when credentials.py is absent: no request leaves the process."""
+    try:
+        import credentials  # noqa: F401
+    except ImportError:
+        module = type(sys)('credentials')
+        module.token_bot = '123456789:LOAD-TEST-TOKEN'
+        sys.modules['credentials'] = module
+    import main
+    # Handlers run in the worker thread that submitted the update, as in main_webhook.
+    main.bot.threaded = False
+    return main
+
+
+def run(args):
+    handler_stats = LatencyStats()
+    query_stats = LatencyStats()
+    instrument_queries(query_stats)
+    telegram = FakeTelegram(args.api_latency / 1000)
+    apihelper.CUSTOM_REQUEST_SENDER = telegram
+    main = import_bot()
+    main.warm_up()
+
+    rng = random.Random(args.seed)
+    learners = queue.Queue()
+    for number in range(args.learners):
+        learners.put(Learner(FIRST_LEARNER_ID + number, random.Random(rng.random()), args.accuracy))
+    update_ids = count(1)
+    deadline = time.monotonic() + args.duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            try:
+                learner = learners.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            handler, text = learner.next_step(main.bot, telegram)
+            update = make_update(next(update_ids), learner.user_id, text)
+            started = time.perf_counter()
+            failed = False
+            try:
+                main.bot.process_new_updates([update])
+            except Exception as ex:
+                failed = True
+                print(f"{handler}: {type(ex).__name__}: {ex}", file=sys.stderr)
+            finally:
+                handler_stats.record(handler, time.perf_counter() - started, failed)
+                learners.put(learner)
+
+    print(f"Running {args.learners} learners on {args.concurrency} threads for {args.duration}s...")
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    main.sessions.close()
+
+    total = handler_stats.total()
+    print(f"\n{total} updates in {elapsed:.1f}s: {total / elapsed:.1f} updates/s, "
+          f"{sum(telegram.calls.values())} Bot API calls")
+    handler_stats.report('handler', elapsed)
+    query_stats.report('dict_jobs function', elapsed)
+    print(f"\nconnection pool: {pool_stats()}")
+    print(f"outbound queue: {main.outbox.stats()}")
+    print(f"sessions: {main.sessions.stats()}")
+    print(f"answer log: {main.answers.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--learners', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32, help='worker threads')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--pairs', type=int, default=100000, help='shared word pairs to load')
+    parser.add_argument('--accuracy', type=float, default=0.7, help='share of right answers')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='fake Bot API latency, ms')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='keep the load test schema afterwards')
+    args = parser.parse_args()
+
+    build_schema(args.pairs)
+    try:
+        run(args)
+    finally:
+        if not args.keep:
+            drop_schema()
+
+
+if __name__ == '__main__':
+    main()
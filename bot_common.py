@@ -0,0 +1,54 @@
+import random
+
+from telebot import types
+from telebot.handler_backends import State, StatesGroup
+
+
+def show_hint(*lines):
+    return '\n'.join(lines)
+
+
+def show_target(data):
+    return f"{data['target_word']} -> {data['translate_word']}"
+
+
+class Command:
+    ADD_WORD = 'Добавить слово ➕'
+    DELETE_WORD = 'Удалить слово🔙'
+    NEXT = 'Дальше ⏭'
+
+
+class MyStates(StatesGroup):
+    target_word = State()
+    translate_word = State()
+    another_words = State()
+
+
+def card_buttons(target_word, others):
+    """
+    Builds the reply keyboard buttons of a card: the answer options in random order
+    followed by the "Next", "Add Word" and "Delete Word" buttons.
+    """
+    buttons = [types.KeyboardButton(target_word)]
+    buttons.extend(types.KeyboardButton(word) for word in others)
+    random.shuffle(buttons)
+    buttons.extend([types.KeyboardButton(Command.NEXT),
+                    types.KeyboardButton(Command.ADD_WORD),
+                    types.KeyboardButton(Command.DELETE_WORD)])
+    return buttons
+
+
+def update_chat_id(update):
+    """
+    Returns the chat an update belongs to, used to keep the updates of one chat in order.
+    Updates without a chat fall back to the sender, or to their own update_id.
+    """
+    for message in (update.message, update.edited_message,
+                    update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None:
+        if update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    return update.update_id
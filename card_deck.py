@@ -0,0 +1,129 @@
+import queue
+import threading
+from collections import OrderedDict, deque
+
+from metrics import registry
+
+
+class CardDeck:
+    """
+    Class Purpose:
+
+    Keeps a small queue of ready-made cards for every active user, so that showing
+    the next card never waits on the database. When a user's deck runs low it is
+    topped up in the background by worker threads, a whole batch at a time.
+
+    Parameters:
+
+    card_source: A callable taking (user_id, count) and returning a list of cards,
+    or None if the cards could not be built.
+    size: How many cards are kept ready per user.
+    refill_at: The deck is queued for a refill once it holds this many cards or fewer.
+    max_users: How many decks are kept; the least recently used ones are dropped.
+    workers: The number of background refill threads.
+    release: An optional callable taking (user_id, pair_ids), called by the workers
+    with the cards that are thrown away unseen (after an invalidation, with a stale
+    refill or an evicted deck), so the scheduler can hand them out again at once.
+    """
+
+    def __init__(self, card_source, size=5, refill_at=2, max_users=10000, workers=1, release=None):
+        self.card_source = card_source
+        self.release = release
+        self.size = size
+        self.refill_at = refill_at
+        self.max_users = max_users
+        self._decks = OrderedDict()
+        self._pending = set()
+        # Per-user invalidations, as in VocabularyCache: a counter value per changed user,
+        # kept for max_users users, older ones only as a floor.
+        self._invalidations = 0
+        self._invalidated = OrderedDict()
+        self._invalidated_floor = 0
+        self._lock = threading.Lock()
+        self._refills = queue.Queue()
+        for number in range(workers):
+            threading.Thread(target=self._refill_worker, name=f'card-deck-{number}',
+                             daemon=True).start()
+
+    def next_card(self, user_id):
+        """
+        Function Purpose:
+
+        Takes the next card from the user's deck and schedules a background refill
+        when the deck runs low. A user without ready cards (the first card after
+        a start or an invalidation) gets one built synchronously.
+
+        Return Value:
+
+        A card, or None if no card could be built.
+        """
+        with self._lock:
+            deck = self._decks.get(user_id)
+            card = deck.popleft() if deck else None
+            if deck is not None:
+                self._decks.move_to_end(user_id)
+            self._schedule_refill(user_id, len(deck) if deck is not None else 0)
+        if card is None:
+            cards = self.card_source(user_id, 1)
+            card = cards[0] if cards else None
+        return card
+
+    def invalidate(self, user_id):
+        """Drops the prefetched cards of a user, e.g. after their words changed."""
+        with self._lock:
+            self._invalidations += 1
+            self._invalidated[user_id] = self._invalidations
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > self.max_users:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._invalidated_floor = max(self._invalidated_floor, forgotten)
+            self._discard(user_id, self._decks.pop(user_id, None))
+
+    def _schedule_refill(self, user_id, ready):
+        if ready <= self.refill_at and user_id not in self._pending:
+            self._pending.add(user_id)
+            self._refills.put((user_id, None))
+
+    def _discard(self, user_id, cards):
+        # Called with the lock held; the release itself runs in a worker.
+        if cards and self.release is not None:
+            self._refills.put((user_id, list(cards)))
+
+    def _refill_worker(self):
+        while True:
+            user_id, discarded = self._refills.get()
+            try:
+                if discarded is not None:
+                    self.release(user_id, [card.pair_id for card in discarded])
+                else:
+                    self._refill(user_id)
+            except Exception as ex:
+                registry.record_error('deck', 'refill' if discarded is None else 'release')
+                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                message = template.format(type(ex).__name__, ex.args)
+                print(message)
+            finally:
+                if discarded is None:
+                    with self._lock:
+                        self._pending.discard(user_id)
+
+    def _refill(self, user_id):
+        with self._lock:
+            deck = self._decks.get(user_id)
+            missing = self.size - (len(deck) if deck is not None else 0)
+            invalidations = self._invalidations
+        cards = self.card_source(user_id, missing) if missing > 0 else None
+        with self._lock:
+            invalidated = self._invalidated.get(user_id, self._invalidated_floor) > invalidations
+            if not cards or invalidated:
+                # Nothing built, or the cards may show words the user has just changed.
+                self._discard(user_id, cards)
+                return
+            deck = self._decks.get(user_id)
+            if deck is None:
+                deck = self._decks[user_id] = deque()
+                while len(self._decks) > self.max_users:
+                    self._discard(*self._decks.popitem(last=False))
+            room = max(0, self.size - len(deck))
+            deck.extend(cards[:room])
+            self._discard(user_id, cards[room:])
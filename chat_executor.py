@@ -0,0 +1,81 @@
+import queue
+import threading
+from collections import deque
+
+
+class ChatOrderedExecutor:
+    """
+    Class Purpose:
+
+    A pool of worker threads that processes items (Telegram updates) so that items
+    of the same chat run one at a time in arrival order, while different chats run
+    in parallel. Every chat with pending items owns at most one place in the ready
+    queue; a worker takes one item of that chat and, if the chat has more, puts it
+    back at the end of the queue, so a busy chat cannot starve the others.
+
+    Parameters:
+
+    handler: A callable invoked with each submitted item.
+    workers: The number of worker threads.
+    max_pending: The bound on items accepted but not yet processed; submit waits
+    for a free place (up to its timeout) when the bound is reached.
+    """
+
+    def __init__(self, handler, workers=8, max_pending=1000):
+        self.handler = handler
+        self._pending = {}
+        self._ready = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker, name=f'chat-worker-{number}', daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, chat_id, item, timeout=None):
+        """
+        Queues an item of a chat. Returns False if no place became free within
+        timeout seconds, in which case the item is not queued.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            return False
+        with self._lock:
+            pending = self._pending.get(chat_id)
+            if pending is None:
+                self._pending[chat_id] = deque([item])
+                self._ready.put(chat_id)
+            else:
+                pending.append(item)
+        return True
+
+    def _worker(self):
+        while True:
+            chat_id = self._ready.get()
+            if chat_id is None:
+                return
+            with self._lock:
+                item = self._pending[chat_id].popleft()
+            try:
+                self.handler(item)
+            except Exception as ex:
+                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                message = template.format(type(ex).__name__, ex.args)
+                print(message)
+            finally:
+                self._slots.release()
+                with self._lock:
+                    if self._pending[chat_id]:
+                        self._ready.put(chat_id)
+                    else:
+                        del self._pending[chat_id]
+                self._ready.task_done()
+
+    def join(self):
+        """Blocks until every submitted item has been processed."""
+        self._ready.join()
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,290 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+from settings import DB_PARAMS
+from settings import DB_POOL_MIN
+from settings import DB_POOL_MAX
+from settings import DB_POOL_TIMEOUT
+from settings import DB_HEALTH_CHECK_INTERVAL
+from settings import DB_REPLICA_DSN
+from settings import DB_REPLICA_POOL_MAX
+from settings import DB_READ_YOUR_WRITES
+from settings import SLOW_QUERY_MS
+from metrics import log_slow_query
+from metrics import registry
+from prepared import PreparingConnection
+from prepared import original_query
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class TimedCursor(extensions.cursor):
+    """psycopg2 cursor that sends statements slower than SLOW_QUERY_MS to the slow-query log."""
+
+    def execute(self, query, vars=None):
+        if SLOW_QUERY_MS <= 0:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                # A prepared statement is logged as its SQL, not as EXECUTE name(...).
+                log_slow_query(*original_query(query if isinstance(query, str) else str(query), vars), elapsed)
+
+
+class ConnectionPool:
+    """
+    Class Purpose:
+
+    A process-wide pool of PostgreSQL connections shared by all threads of the bot.
+    It wraps psycopg2's ThreadedConnectionPool and adds what the bare pool lacks:
+    callers wait (up to a timeout) for a free connection instead of failing at once,
+    idle connections are health-checked before they are handed out, broken connections
+    are replaced, and wait times are counted so pool pressure can be observed.
+
+    Parameters:
+
+    minconn, maxconn: The number of connections kept open and the hard upper limit.
+    timeout: Seconds to wait for a free connection before PoolTimeout is raised.
+    health_check_interval: Connections idle for longer than this are pinged first.
+    connect_params: Keyword arguments passed to psycopg2.connect.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, health_check_interval, **connect_params):
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **connect_params)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'replaced': 0,
+        }
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"no free database connection within {self.timeout}s")
+        waited = time.monotonic() - started
+        try:
+            conn = self._healthy_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_seconds_total'] += waited
+            self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+        return conn
+
+    def putconn(self, conn):
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if broken:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=broken)
+        self._slots.release()
+
+    def _healthy_connection(self):
+        conn = self._pool.getconn()
+        last_used = self._last_used.get(id(conn))
+        idle = last_used is None or time.monotonic() - last_used > self.health_check_interval
+        if not conn.closed and not idle:
+            return conn
+        if not conn.closed:
+            with self._lock:
+                self._stats['health_checks'] += 1
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("select 1")
+                conn.rollback()
+                return conn
+            except psycopg2.Error:
+                pass
+        with self._lock:
+            self._stats['replaced'] += 1
+            self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+        return self._pool.getconn()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class ReadYourWrites:
+    """
+    Class Purpose:
+
+    Remembers the users who changed their data in the last window seconds. Their reads
+    go to the primary, because the replica may not have replayed the change yet; everybody
+    else reads from the replica. Entries are kept in the order of their deadlines and
+    dropped once expired, so only recent writers take memory.
+
+    Parameters:
+
+    window: Seconds after a write during which the user reads from the primary; it should
+    be longer than the usual replication lag.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._deadlines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def wrote(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            self._deadlines[user_id] = now + self.window
+            self._deadlines.move_to_end(user_id)
+            self._expire(now)
+
+    def recent(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            return user_id in self._deadlines
+
+    def _expire(self, now):
+        while self._deadlines:
+            user_id, deadline = next(iter(self._deadlines.items()))
+            if deadline > now:
+                break
+            del self._deadlines[user_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._deadlines)
+
+
+_pool = None
+_replica_pool = None
+_pool_lock = threading.Lock()
+recent_writers = ReadYourWrites(DB_READ_YOUR_WRITES)
+_routing = {'primary_reads': 0, 'replica_reads': 0, 'recent_writer_reads': 0}
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_HEALTH_CHECK_INTERVAL,
+                                       connection_factory=PreparingConnection, cursor_factory=TimedCursor,
+                                       **DB_PARAMS)
+    return _pool
+
+
+def get_replica_pool():
+    """The pool of the read replica (DB_REPLICA_DSN), or None if no replica is configured."""
+    global _replica_pool
+    if _replica_pool is None and DB_REPLICA_DSN:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(DB_POOL_MIN, DB_REPLICA_POOL_MAX, DB_POOL_TIMEOUT,
+                                               DB_HEALTH_CHECK_INTERVAL, dsn=DB_REPLICA_DSN,
+                                               connection_factory=PreparingConnection,
+                                               cursor_factory=TimedCursor)
+    return _replica_pool
+
+
+def _pool_for(read_only, user_id):
+    if not read_only:
+        return get_pool()
+    replica = get_replica_pool()
+    if replica is None:
+        key = 'primary_reads'
+    elif user_id is not None and recent_writers.recent(user_id):
+        key = 'recent_writer_reads'
+    else:
+        key = 'replica_reads'
+    with _pool_lock:
+        _routing[key] += 1
+    return replica if key == 'replica_reads' else get_pool()
+
+
+@contextmanager
+def get_connection(read_only=False, user_id=None):
+    """
+    Function Purpose:
+
+    Borrows a connection from the shared pool for the duration of a with-block.
+    Mirrors the transaction behaviour of "with psycopg2.connect(...) as conn":
+    the transaction is committed when the block exits normally and rolled back
+    when it raises. The connection is then returned to the pool instead of being closed.
+
+    Parameters:
+
+    read_only: The block only reads, so it may run on the replica if one is configured.
+    user_id: The user whose data is read; if they wrote recently (see ReadYourWrites),
+    the read goes to the primary so they see their own change.
+    """
+    pool = _pool_for(read_only, user_id)
+    conn = pool.getconn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def pool_stats():
+    return get_pool().stats() if _pool is not None else {}
+
+
+def replica_pool_stats():
+    return _replica_pool.stats() if _replica_pool is not None else {}
+
+
+def routing_stats():
+    with _pool_lock:
+        stats = dict(_routing)
+    stats['recent_writers'] = len(recent_writers)
+    return stats
+
+
+registry.register_gauges('bot_db_pool', pool_stats, 'Connection pool counters (see ConnectionPool.stats).')
+registry.register_gauges('bot_db_replica_pool', replica_pool_stats, 'Read replica connection pool counters.')
+registry.register_gauges('bot_db_routing', routing_stats, 'Reads sent to the primary and to the replica.')
+
+
+def close_pool():
+    global _pool, _replica_pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+        if _replica_pool is not None:
+            _replica_pool.closeall()
+            _replica_pool = None
@@ -1,6 +1,417 @@
-import psycopg2
+from psycopg2.extras import execute_values
+
+from db_pool import get_connection
+from db_pool import get_pool
+from db_pool import get_replica_pool
+from db_pool import recent_writers
+from metrics import record_error
+from metrics import timed
+from prepared import PreparedStatement
+from settings import DB_POOL_MIN
+from settings import VOCAB_CACHE_USERS
+from settings import VOCAB_CACHE_TTL
+from settings import SIMILAR_DISTRACTORS
+from settings import REVIEW_LEASE
+from spaced_repetition import NEW_CARD
+from spaced_repetition import ReviewState
+from spaced_repetition import next_review
+from storage_types import Card
+from storage_types import AddWordResult
+from storage_types import DeleteWordsResult
+from storage_types import WORD_CREATED
+from storage_types import WORD_LINKED_EXISTING
+from storage_types import WORD_ALREADY_OWNED
+from storage_types import DISTRACTOR_OVERSAMPLING
+from vocab_cache import VocabularyCache
+from vocab_cache import WordCountCache
+
+# A word pair is visible to a user if it is shared (not linked to any user)
+# or if it is linked to that user.
+VISIBLE_PAIR = """
+    (not exists (select 1 from user_words uw where uw.custom_word_id = erw.id)
+     or exists (select 1 from user_words uw
+                where uw.custom_word_id = erw.id and uw.user_id = %(uid)s))
+"""
+
+# Id-range probing: every probe jumps to a random point of the e_r_words id range and
+# walks the primary key index to the next pair visible to the user, wrapping around
+# to the start of the range. A probe costs one index descent instead of a sort of the
+# whole vocabulary, so sampling time does not grow with the dictionary size.
+SAMPLE_PAIRS = """
+    bounds as (
+        select min(id) as lo, max(id) as hi from e_r_words
+    ),
+    probes as (
+        select g as probe, lo + floor(random() * (hi - lo + 1))::integer as start
+        from bounds, generate_series(0, %(probes)s - 1) g
+        where lo is not null
+    ),
+    sample as (
+        select p.probe, hit.id, hit.r_w, hit.e_w
+        from probes p
+        cross join lateral (
+            select * from (
+                (select erw.id, rw.word as r_w, ew.word as e_w
+                 from e_r_words erw
+                 join r_words rw on rw.id = erw.r_word_id
+                 join e_words ew on ew.id = erw.e_word_id
+                 where erw.id >= p.start and """ + VISIBLE_PAIR + """
+                 order by erw.id limit 1)
+                union all
+                (select erw.id, rw.word, ew.word
+                 from e_r_words erw
+                 join r_words rw on rw.id = erw.r_word_id
+                 join e_words ew on ew.id = erw.e_word_id
+                 where erw.id < p.start and """ + VISIBLE_PAIR + """
+                 order by erw.id limit 1)
+            ) candidates
+            limit 1
+        ) hit
+    )
+"""
+
+
+# Distinct visible words of one language ({word} is r_w or e_w), excluding one word,
+# in the order the probes found them.
+SAMPLE_WORDS = "with" + SAMPLE_PAIRS + """
+    select w.word
+    from (select {word} as word, min(probe) as first_probe
+          from sample
+          where {word} != %(avoid)s
+          group by {word}) w
+    order by w.first_probe LIMIT %(count)s;
+"""
+
+# The same without probing ({word} is rw.word or ew.word), for small vocabularies.
+FULL_SCAN_WORDS = """
+    select w.word
+    from (select distinct {word} as word
+          from e_r_words erw
+          join r_words rw on rw.id = erw.r_word_id
+          join e_words ew on ew.id = erw.e_word_id
+          where {word} != %(avoid)s and """ + VISIBLE_PAIR + """) w
+    ORDER BY random() LIMIT %(count)s;
+"""
+
+# A batch of cards: the first %(count)s probes are the targets, the remaining probes
+# are split into one block of %(per_card)s per card for the distractors.
+RANDOM_CARDS = "with" + SAMPLE_PAIRS + """,
+    targets as (
+        select probe, id, r_w, e_w from sample where probe < %(count)s
+    )
+    select t.id, t.r_w, t.e_w,
+        array(select o.word
+              from (select s.{word} as word, min(s.probe) as first_probe
+                    from sample s
+                    where s.probe >= %(count)s + t.probe * %(per_card)s
+                      and s.probe < %(count)s + (t.probe + 1) * %(per_card)s
+                      and s.{word} != t.{word}
+                    group by s.{word}) o
+              order by o.first_probe LIMIT %(others)s)
+    from targets t
+    order by t.probe;
+"""
+
+SHARED_WORD_PAIRS = """
+    select erw.id, ew.word, rw.word
+    from e_r_words erw
+    join e_words ew on ew.id = erw.e_word_id
+    join r_words rw on rw.id = erw.r_word_id
+    where not exists (select 1 from user_words uw
+                      where uw.custom_word_id = erw.id)
+"""
+
+USER_WORD_PAIRS = """
+    select erw.id, ew.word, rw.word
+    from user_words uw
+    join e_r_words erw on erw.id = uw.custom_word_id
+    join e_words ew on ew.id = erw.e_word_id
+    join r_words rw on rw.id = erw.r_word_id
+    where uw.user_id = %s
+"""
+
+
+# Adds a word pair for a user in one statement. Existing words are reused
+# (on conflict do nothing + lookup), a link row is only created if the pair does not
+# exist yet, and the user is only linked to an existing pair owned by other users.
+# A shared pair (no owners) is already visible to everybody and is left alone.
+# users.custom_words_count is incremented in the same statement when the user is linked.
+ADD_WORD = """
+    with new_e as (
+        insert into e_words (word) values (%(e)s)
+        on conflict (word) do nothing
+        returning id
+    ),
+    e as (
+        select id from new_e
+        union all
+        select id from e_words where word = %(e)s
+    ),
+    new_r as (
+        insert into r_words (word) values (%(r)s)
+        on conflict (word) do nothing
+        returning id
+    ),
+    r as (
+        select id from new_r
+        union all
+        select id from r_words where word = %(r)s
+    ),
+    old_link as (
+        select erw.id from e_r_words erw
+        where erw.e_word_id = (select id from e limit 1)
+          and erw.r_word_id = (select id from r limit 1)
+        order by erw.id limit 1
+    ),
+    new_link as (
+        insert into e_r_words (e_word_id, r_word_id)
+        select (select id from e limit 1), (select id from r limit 1)
+        where not exists (select 1 from old_link)
+          and exists (select 1 from e) and exists (select 1 from r)
+        returning id
+    ),
+    link as (
+        select id, true as created from new_link
+        union all
+        select id, false from old_link
+    ),
+    owners as (
+        select count(*) as total, count(*) filter (where uw.user_id = %(uid)s) as mine
+        from user_words uw
+        where uw.custom_word_id = (select id from old_link)
+    ),
+    new_owner as (
+        insert into user_words (user_id, custom_word_id)
+        select %(uid)s, link.id
+        from link, owners
+        where link.created or (owners.total > 0 and owners.mine = 0)
+        returning custom_word_id
+    ),
+    counter as (
+        update users set custom_words_count = custom_words_count + 1
+        where user_id = %(uid)s and exists (select 1 from new_owner)
+        returning custom_words_count
+    )
+    select link.id,
+           case when link.created then 'created'
+                when exists (select 1 from new_owner) then 'linked-existing'
+                else 'already-owned' end,
+           coalesce((select custom_words_count from counter),
+                    (select custom_words_count from users where user_id = %(uid)s))
+    from link;
+"""
+
+
+# Removes the user's links to every pair matching one of the words (in either language)
+# and then the pairs and words nobody else uses, all in one statement. Every CTE sees
+# the rows as they were before the statement, so rows removed by an earlier CTE are
+# excluded explicitly when checking for remaining references. The user's
+# custom_words_count is decreased by the number of removed links, and their review
+# schedule of the removed pairs is dropped.
+DELETE_WORDS = """
+    with target as (
+        select uw.id as owner_id, erw.id as pair_id
+        from user_words uw
+        join e_r_words erw on erw.id = uw.custom_word_id
+        join e_words ew on ew.id = erw.e_word_id
+        join r_words rw on rw.id = erw.r_word_id
+        where uw.user_id = %(uid)s
+          and (ew.word = any(%(words)s) or rw.word = any(%(words)s))
+    ),
+    del_owner as (
+        delete from user_words uw
+        using target t
+        where uw.id = t.owner_id
+        returning uw.custom_word_id
+    ),
+    del_pair as (
+        delete from e_r_words erw
+        where erw.id in (select pair_id from target)
+          and not exists (select 1 from user_words uw
+                          where uw.custom_word_id = erw.id
+                            and uw.id not in (select owner_id from target))
+        returning erw.id, erw.e_word_id, erw.r_word_id
+    ),
+    del_e as (
+        delete from e_words ew
+        where ew.id in (select e_word_id from del_pair)
+          and not exists (select 1 from e_r_words erw
+                          where erw.e_word_id = ew.id
+                            and erw.id not in (select id from del_pair))
+        returning ew.id
+    ),
+    del_r as (
+        delete from r_words rw
+        where rw.id in (select r_word_id from del_pair)
+          and not exists (select 1 from e_r_words erw
+                          where erw.r_word_id = rw.id
+                            and erw.id not in (select id from del_pair))
+        returning rw.id
+    ),
+    counter as (
+        update users set custom_words_count = custom_words_count - (select count(*) from del_owner)
+        where user_id = %(uid)s and exists (select 1 from del_owner)
+        returning custom_words_count
+    ),
+    del_review as (
+        delete from reviews rv
+        where rv.user_id = %(uid)s and rv.pair_id in (select pair_id from target)
+    )
+    select (select count(*) from del_owner),
+           (select count(*) from del_e),
+           (select count(*) from del_r),
+           coalesce((select custom_words_count from counter),
+                    (select custom_words_count from users where user_id = %(uid)s));
+"""
+
+# The spaced repetition due queue: the user's reviews in due_at order, read from the
+# (user_id, due_at) index, skipping cards handed out less than %(lease)s seconds ago.
+# Unless %(ahead)s is true only cards that are already due are taken. The taken cards
+# are marked as shown in the same statement, so a concurrent refill skips them.
+LEASE_REVIEWS = """
+    with due as (
+        select rv.pair_id from reviews rv
+        where rv.user_id = %(uid)s
+          and (%(ahead)s or rv.due_at <= now())
+          and (rv.shown_at is null or rv.shown_at < now() - %(lease)s::float8 * interval '1 second')
+        order by rv.due_at
+        limit %(count)s
+        for update skip locked
+    ),
+    shown as (
+        update reviews rv set shown_at = now()
+        from due
+        where rv.user_id = %(uid)s and rv.pair_id = due.pair_id
+        returning rv.pair_id, rv.due_at
+    )
+    select s.pair_id, ew.word, rw.word
+    from shown s
+    join e_r_words erw on erw.id = s.pair_id
+    join e_words ew on ew.id = erw.e_word_id
+    join r_words rw on rw.id = erw.r_word_id
+    order by s.due_at;
+"""
+
+# Puts up to %(count)s of the candidate pairs the user has never seen into the queue,
+# already marked as shown, in candidate order. Returns the IDs of the introduced pairs.
+INTRODUCE_REVIEWS = """
+    insert into reviews (user_id, pair_id, shown_at)
+    select %(uid)s, p.pair_id, now()
+    from unnest(%(pairs)s::integer[]) with ordinality p(pair_id, n)
+    where not exists (select 1 from reviews rv
+                      where rv.user_id = %(uid)s and rv.pair_id = p.pair_id)
+    order by p.n
+    limit %(count)s
+    on conflict (user_id, pair_id) do nothing
+    returning pair_id;
+"""
+
+# Cards handed out by LEASE_REVIEWS or INTRODUCE_REVIEWS but never shown (e.g. dropped
+# from a prefetched deck) are made available again at once instead of after the lease.
+RELEASE_REVIEWS = """
+    update reviews set shown_at = null
+    where user_id = %(uid)s and pair_id = any(%(pairs)s::integer[]) and shown_at is not null
+"""
+
+REVIEW_STATE = """
+    select repetitions, interval_days, ease from reviews
+    where user_id = %s and pair_id = %s
+    for update
+"""
+
+SAVE_REVIEW = """
+    insert into reviews (user_id, pair_id, repetitions, interval_days, ease, due_at, reviewed_at)
+    values (%(uid)s, %(pair)s, %(repetitions)s, %(interval)s::float8, %(ease)s,
+            now() + %(interval)s::float8 * interval '1 day', now())
+    on conflict (user_id, pair_id) do update
+    set repetitions = excluded.repetitions,
+        interval_days = excluded.interval_days,
+        ease = excluded.ease,
+        due_at = excluded.due_at,
+        reviewed_at = excluded.reviewed_at,
+        shown_at = null;
+"""
+
+# answered_at is passed as Unix seconds, as taken by the handler.
+RECORD_ANSWERS = """
+    insert into answers (user_id, pair_id, answer, correct, answered_at)
+    values %s
+"""
+RECORD_ANSWERS_TEMPLATE = "(%s, %s, %s, %s, to_timestamp(%s))"
+
+USER_EXISTS = """
+    select from users
+    where user_id = %s
+"""
+
+USER_WORD_COUNT = """
+    select custom_words_count from users
+    where user_id = %s
+"""
+
+# The hot queries, executed as server-side prepared statements (see prepared.py).
+# The word column of the sampling queries is fixed per direction: True (eng_rus)
+# draws Russian words, False English ones.
+SAMPLE_PAIR_STATEMENT = PreparedStatement('sample_pair', "with" + SAMPLE_PAIRS + """
+    select r_w, e_w from sample;
+""")
+SAMPLE_WORDS_STATEMENTS = {
+    True: PreparedStatement('sample_rus_words', SAMPLE_WORDS.format(word='r_w')),
+    False: PreparedStatement('sample_engl_words', SAMPLE_WORDS.format(word='e_w')),
+}
+FULL_SCAN_WORDS_STATEMENTS = {
+    True: PreparedStatement('full_scan_rus_words', FULL_SCAN_WORDS.format(word='rw.word')),
+    False: PreparedStatement('full_scan_engl_words', FULL_SCAN_WORDS.format(word='ew.word')),
+}
+RANDOM_CARDS_STATEMENTS = {
+    True: PreparedStatement('random_rus_cards', RANDOM_CARDS.format(word='r_w')),
+    False: PreparedStatement('random_engl_cards', RANDOM_CARDS.format(word='e_w')),
+}
+USER_WORD_PAIRS_STATEMENT = PreparedStatement('user_word_pairs', USER_WORD_PAIRS)
+LEASE_REVIEWS_STATEMENT = PreparedStatement('lease_reviews', LEASE_REVIEWS)
+REVIEW_STATE_STATEMENT = PreparedStatement('review_state', REVIEW_STATE)
+SAVE_REVIEW_STATEMENT = PreparedStatement('save_review', SAVE_REVIEW)
+USER_EXISTS_STATEMENT = PreparedStatement('user_exists', USER_EXISTS)
+USER_WORD_COUNT_STATEMENT = PreparedStatement('user_word_count', USER_WORD_COUNT)
+
+HOT_STATEMENTS = [
+    SAMPLE_PAIR_STATEMENT, *SAMPLE_WORDS_STATEMENTS.values(), *FULL_SCAN_WORDS_STATEMENTS.values(),
+    *RANDOM_CARDS_STATEMENTS.values(), USER_WORD_PAIRS_STATEMENT, LEASE_REVIEWS_STATEMENT,
+    REVIEW_STATE_STATEMENT, SAVE_REVIEW_STATEMENT, USER_EXISTS_STATEMENT, USER_WORD_COUNT_STATEMENT,
+]
+
+
+def _print_exception(ex):
+    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+    message = template.format(type(ex).__name__, ex.args)
+    print(message)
+    record_error()
+
+
+def _random_words_full_scan(cur, user_id, eng_rus, word_to_avoid, count):
+    """
+    Fallback for _sample_words: picks distinct visible words with ORDER BY random().
+    Only used when probing could not find enough distinct words, which happens
+    on small vocabularies where a full sort is cheap anyway.
+    """
+    FULL_SCAN_WORDS_STATEMENTS[eng_rus].execute(cur, {'uid': user_id, 'avoid': word_to_avoid, 'count': count})
+    return [row[0] for row in cur.fetchall()]
+
+
+def _sample_words(cur, user_id, eng_rus, word_to_avoid, count):
+    """
+    Draws up to count distinct visible words of one language (Russian if eng_rus is True,
+    English otherwise), excluding word_to_avoid, in random order.
+    """
+    SAMPLE_WORDS_STATEMENTS[eng_rus].execute(cur, {'uid': user_id, 'avoid': word_to_avoid, 'count': count,
+                                                   'probes': count * DISTRACTOR_OVERSAMPLING})
+    words = [row[0] for row in cur.fetchall()]
+    if len(words) < count:
+        words = _random_words_full_scan(cur, user_id, eng_rus, word_to_avoid, count)
+    return words
 
 
+@timed('query')
 def random_word_from_base(user_id):
     """
     Function Purpose:
@@ -18,38 +429,26 @@ def random_word_from_base(user_id):
     Database Query Explanation:
 
     Select Statement:
-    Retrieves a pair of words, where rw.word represents the Russian word, and ew.word
-    represents the corresponding English word.
-    Joins the r_words table to establish associations with Russian words.
-    Joins the e_r_words table to link Russian words with their corresponding English words.
-    Joins the e_words table to get the actual English words.
-    Uses a full outer join with the user_words table to include words that
-    might not have associations with the given user.
-    Applies conditions to consider the specified user (uw.user_id = %s or uw.user_id is null).
-    Orders the results randomly (ORDER BY random()) and limits the result set to 1 word pair (LIMIT 1).
+    Uses the SAMPLE_PAIRS CTE with a single probe: a random point of the e_r_words id range
+    is chosen and the first word pair at or after it (wrapping around) that is visible
+    to the user is returned.
+    A pair is visible if it is not linked to any user in user_words or if it is linked
+    to the specified user.
+    Joins the r_words and e_words tables to get the actual Russian and English words.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection(read_only=True, user_id=user_id) as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                select rw.word as r_w, ew.word as e_w
-                from r_words rw
-                join e_r_words erw on erw.r_word_id = rw.id 
-                join e_words ew on ew.id = erw.e_word_id
-                full outer join user_words uw on uw.custom_word_id = erw.id
-                where uw.user_id = %s or uw.user_id is null
-                ORDER BY random() LIMIT 1;
-                """, (user_id,))
+                SAMPLE_PAIR_STATEMENT.execute(cur, {'uid': user_id, 'probes': 1})
                 return cur.fetchone()
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
+@timed('query')
 def random_engl_words(word_to_avoid, user_id):
     """
     Function Purpose:
@@ -63,43 +462,29 @@ def random_engl_words(word_to_avoid, user_id):
     user_id: The ID of the user for whom the word associations are considered.
     Return Value:
 
-    A list of English words (up to 4) that meet the specified criteria.
+    A list of distinct English words (up to 4) that meet the specified criteria.
     Database Query Explanation:
 
     Select Statement:
-    Retrieves English words (ew.word) from the e_words table.
-    Joins the e_r_words table to establish associations with Russian words.
-    Uses a full outer join with the user_words table to include words that might not
-    have associations with the given user.
-    Applies conditions to exclude a specific word (ew.word != %s) and consider
-    the specified user ((uw.user_id = %s or uw.user_id is null)).
-    Orders the results randomly (ORDER BY random()) and limits the result
-    set to 4 words (LIMIT 4).
+    Uses the SAMPLE_PAIRS CTE to probe several random points of the e_r_words id range,
+    keeping only pairs visible to the user.
+    Excludes the specific word (e_w != %s), removes duplicate words and keeps
+    the first 4 in probe order.
+    If probing yields fewer than 4 distinct words (a small vocabulary), falls back to
+    ORDER BY random() over all visible words.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    output = []
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection(read_only=True, user_id=user_id) as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                select ew.word
-                    from e_words ew
-                    join e_r_words erw on erw.e_word_id = ew.id 
-                    full outer join user_words uw on uw.custom_word_id = erw.id 
-                    where ew.word != %s and (uw.user_id = %s or uw.user_id is null)
-                    ORDER BY random() LIMIT 4;
-                """, (word_to_avoid, user_id))
-                for row in cur.fetchall():
-                    output.append(row[0])
-                return output
+                return _sample_words(cur, user_id, False, word_to_avoid, 4)
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
+@timed('query')
 def random_rus_words(word_to_avoid, user_id):
     """
     Function Purpose:
@@ -113,437 +498,673 @@ def random_rus_words(word_to_avoid, user_id):
     user_id: The ID of the user for whom the word associations are considered.
     Return Value:
 
-    A list of Russian words (up to 4) that meet the specified criteria.
+    A list of distinct Russian words (up to 4) that meet the specified criteria.
     Database Query Explanation:
 
     Select Statement:
-    Retrieves Russian words (rw.word) from the r_words table.
-    Joins the e_r_words table to establish associations with English words.
-    Uses a full outer join with the user_words table to include words that might
-    not have associations with the given user.
-    Applies conditions to exclude a specific word (rw.word != %s) and consider
-    the specified user ((uw.user_id = %s or uw.user_id is null)).
-    Orders the results randomly (ORDER BY random()) and limits the result
-    set to 4 words (LIMIT 4).
+    Uses the SAMPLE_PAIRS CTE to probe several random points of the e_r_words id range,
+    keeping only pairs visible to the user.
+    Excludes the specific word (r_w != %s), removes duplicate words and keeps
+    the first 4 in probe order.
+    If probing yields fewer than 4 distinct words (a small vocabulary), falls back to
+    ORDER BY random() over all visible words.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    output = []
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection(read_only=True, user_id=user_id) as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                select rw.word
-                    from r_words rw
-                    join e_r_words erw on erw.r_word_id = rw.id 
-                    full outer join user_words uw on uw.custom_word_id = erw.id 
-                    where rw.word != %s and (uw.user_id = %s or uw.user_id is null)
-                    ORDER BY random() LIMIT 4;
-                """, (word_to_avoid, user_id))
-                for row in cur.fetchall():
-                    output.append(row[0])
-                return output
+                return _sample_words(cur, user_id, True, word_to_avoid, 4)
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
-def if_user_not_exist(user_id):
+@timed('query')
+def random_cards(user_id, count, eng_rus=True, others_count=4):
     """
     Function Purpose:
 
-    This function is designed to check whether a user with the given ID exists in the database.
+    This function is designed to build a batch of vocabulary cards in a single database
+    round trip: random word pairs visible to the user, each with its own list of
+    distractor words in the requested direction.
 
     Parameters:
 
-    user_id: The ID of the user to check for existence.
+    user_id: The ID of the user for whom the word associations are considered.
+    count: The number of cards to build.
+    eng_rus: True if the user is shown the English word and picks the Russian one,
+    False for the opposite direction.
+    others_count: The number of distractor words per card.
     Return Value:
 
-    True if the user does not exist in the database, False otherwise.
+    A list of Card tuples (pair_id, target_word, translate_word, other_words), where
+    target_word is the correct answer, translate_word is the word shown to the user and
+    other_words is a list of distractors in the same language as target_word.
     Database Query Explanation:
 
     Select Statement:
-    Checks for the existence of a user in the users table based on the provided user_id.
-    Retrieves a row from the users table where user_id matches the input.
-    The function returns True if no matching user is found (result set is None),
-    indicating that the user does not exist.
+    Uses the SAMPLE_PAIRS CTE to probe random points of the e_r_words id range,
+    keeping only pairs visible to the user (shared pairs and the user's own pairs).
+    The first count probes become the target pairs.
+    The remaining probes are split into one consecutive block per card. The words of
+    the answer language found by a card's block, without duplicates and without the
+    card's target word, are aggregated into its distractor array.
+    If a block found too few distinct words (a small vocabulary), that card's distractors
+    are re-drawn with ORDER BY random() over all visible words.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    per_card = others_count * DISTRACTOR_OVERSAMPLING
+    with get_connection(read_only=True, user_id=user_id) as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                            select from users
-                            where user_id = %s
-                            """, (user_id,))
-                if cur.fetchone() is None:
-                    return True
+                RANDOM_CARDS_STATEMENTS[eng_rus].execute(cur, {'uid': user_id, 'count': count,
+                                                               'others': others_count, 'per_card': per_card,
+                                                               'probes': count * (1 + per_card)})
+                cards = []
+                for pair_id, r_w, e_w, others in cur.fetchall():
+                    others = list(others)
+                    if len(others) < others_count:
+                        others = _random_words_full_scan(cur, user_id, eng_rus,
+                                                         r_w if eng_rus else e_w, others_count)
+                    if eng_rus:
+                        cards.append(Card(pair_id, r_w, e_w, others))
+                    else:
+                        cards.append(Card(pair_id, e_w, r_w, others))
+                return cards
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
-def add_user(user_id, user_name):
+@timed('query')
+def random_card(user_id, eng_rus=True, others_count=4):
     """
     Function Purpose:
 
-    This function is designed to add a new user to the database with the provided user ID and username.
+    This function is designed to build a whole vocabulary card in a single database
+    round trip: a random word pair visible to the user plus a list of distractor words
+    in the requested direction. It is a batch of one built by random_cards.
 
     Parameters:
 
-    user_id: The ID of the user to be added.
-    user_name: The username of the user to be added.
+    user_id: The ID of the user for whom the word associations are considered.
+    eng_rus: True if the user is shown the English word and picks the Russian one,
+    False for the opposite direction.
+    others_count: The number of distractor words to return.
+    Return Value:
+
+    A Card tuple (pair_id, target_word, translate_word, other_words), or None if
+    there are no visible words or the query failed.
+    """
+    cards = random_cards(user_id, 1, eng_rus, others_count)
+    return cards[0] if cards else None
+
+
+@timed('query')
+def shared_word_pairs():
+    """
+    Function Purpose:
+
+    This function is designed to load every shared word pair, i.e. every pair that
+    is not linked to any user, for the in-process vocabulary cache.
+
     Return Value:
 
-    None (no explicit return value).
+    A list of tuples (pair_id, e_word, r_word), or None if the query failed.
     Database Query Explanation:
 
-    Insert Statement:
-    Inserts a new row into the users table with the specified user_id and user_name.
+    Select Statement:
+    Joins e_r_words with e_words and r_words and keeps the pairs that have no
+    row in user_words.
+    Exception Handling:
+    Catches any exceptions that might occur during the execution of the query.
+    Prints detailed information about the exception for debugging purposes.
+    """
+    with get_connection(read_only=True) as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(SHARED_WORD_PAIRS)
+                return cur.fetchall()
+            except Exception as ex:
+                _print_exception(ex)
+
+
+@timed('query')
+def user_word_pairs(uid):
+    """
+    Function Purpose:
+
+    This function is designed to load the custom word pairs of one user for the
+    per-user overlay of the vocabulary cache.
+
+    Parameters:
+
+    uid: The ID of the user whose word pairs are loaded.
+    Return Value:
+
+    A list of tuples (pair_id, e_word, r_word), or None if the query failed.
+    Database Query Explanation:
+
+    Select Statement:
+    Joins user_words with e_r_words, e_words and r_words, filtered by the user ID.
+    Exception Handling:
+    Catches any exceptions that might occur during the execution of the query.
+    Prints detailed information about the exception for debugging purposes.
+    """
+    with get_connection(read_only=True, user_id=uid) as conn:
+        with conn.cursor() as cur:
+            try:
+                USER_WORD_PAIRS_STATEMENT.execute(cur, (uid,))
+                return cur.fetchall()
+            except Exception as ex:
+                _print_exception(ex)
+
+
+vocabulary = VocabularyCache(shared_word_pairs, user_word_pairs,
+                             max_users=VOCAB_CACHE_USERS, shared_ttl=VOCAB_CACHE_TTL,
+                             similar_distractors=SIMILAR_DISTRACTORS)
+word_counts = WordCountCache(max_users=VOCAB_CACHE_USERS)
+
+
+@timed('query')
+def cached_card(user_id, eng_rus=True, others_count=4):
+    """
+    Function Purpose:
+
+    This function is designed to build a vocabulary card from the in-process vocabulary
+    cache, so in the common case no database query is made at all. The shared word pairs
+    and the user's own pairs are loaded into the cache on first use.
+
+    Parameters:
+
+    user_id: The ID of the user for whom the card is built.
+    eng_rus: The card direction, as in random_card.
+    others_count: The number of distractor words to return.
+    Return Value:
+
+    A Card tuple like the one returned by random_card. If the cache cannot be filled,
+    the card is built by random_card from the database instead.
+    """
+    card = vocabulary.card(user_id, eng_rus, others_count)
+    if card is None:
+        return random_card(user_id, eng_rus, others_count)
+    return Card(*card)
+
+
+@timed('query')
+def cached_cards(user_id, count, eng_rus=True, others_count=4):
+    """
+    Function Purpose:
+
+    This function is designed to build a batch of vocabulary cards for the card deck
+    prefetcher. Cards come from the in-process vocabulary cache; if the cache cannot be
+    filled, the whole batch is built by random_cards in one database query.
+
+    Parameters:
+
+    user_id: The ID of the user for whom the cards are built.
+    count: The number of cards to build.
+    eng_rus: The card direction, as in random_card.
+    others_count: The number of distractor words per card.
+    Return Value:
+
+    A list of Card tuples, or None if the database query failed.
+    """
+    cards = []
+    for _ in range(count):
+        card = vocabulary.card(user_id, eng_rus, others_count)
+        if card is None:
+            return random_cards(user_id, count, eng_rus, others_count)
+        cards.append(Card(*card))
+    return cards
+
+
+@timed('query')
+def _lease_reviews(user_id, count, ahead):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                LEASE_REVIEWS_STATEMENT.execute(cur, {'uid': user_id, 'count': count,
+                                                      'ahead': ahead, 'lease': REVIEW_LEASE})
+                return cur.fetchall()
+            except Exception as ex:
+                _print_exception(ex)
+
+
+@timed('query')
+def _introduce_reviews(user_id, pair_ids, count):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(INTRODUCE_REVIEWS, {'uid': user_id, 'pairs': list(pair_ids), 'count': count})
+                return {row[0] for row in cur.fetchall()}
+            except Exception as ex:
+                _print_exception(ex)
+
+
+def _review_card(user_id, row, eng_rus, others_count):
+    pair_id, e_word, r_word = row
+    target_word, translate_word = (r_word, e_word) if eng_rus else (e_word, r_word)
+    others = vocabulary.distractors(user_id, target_word, eng_rus, others_count, translate_word)
+    if others is None:
+        others = (random_rus_words if eng_rus else random_engl_words)(target_word, user_id) or []
+    return Card(pair_id, target_word, translate_word, others)
+
+
+@timed('query')
+def scheduled_cards(user_id, count, eng_rus=True, others_count=4):
+    """
+    Function Purpose:
+
+    This function is designed to pick the next cards of a user by their spaced repetition
+    schedule: first the cards that are due, then new pairs the user has never seen, and
+    only when the whole vocabulary is scheduled the cards that will be due soonest.
+    Every pick reads the head of the user's range of the (user_id, due_at) index, so it
+    stays cheap however many words the user has reviewed.
+
+    Parameters:
+
+    user_id: The ID of the user for whom the cards are picked.
+    count: The number of cards to pick.
+    eng_rus: The card direction, as in random_card.
+    others_count: The number of distractor words per card.
+    Return Value:
+
+    A list of Card tuples (possibly fewer than count), or None if the database query failed.
+    Database Query Explanation:
+
+    Update Statement (LEASE_REVIEWS):
+    Takes the first due reviews of the user in due_at order and marks them as shown,
+    so they are not handed out again until answered or until REVIEW_LEASE expires.
+    Insert Statement (INTRODUCE_REVIEWS):
+    Adds random visible pairs (from cached_cards) that have no review yet to the schedule.
+    Distractor words come from the in-process vocabulary cache.
+    """
+    rows = _lease_reviews(user_id, count, ahead=False)
+    if rows is None:
+        return None
+    cards = [_review_card(user_id, row, eng_rus, others_count) for row in rows]
+    missing = count - len(cards)
+    if missing > 0:
+        candidates = cached_cards(user_id, missing * DISTRACTOR_OVERSAMPLING, eng_rus, others_count) or []
+        candidates = list({card.pair_id: card for card in candidates}.values())
+        introduced = _introduce_reviews(user_id, [card.pair_id for card in candidates], missing) or set()
+        cards.extend(card for card in candidates if card.pair_id in introduced)
+        missing = count - len(cards)
+    if missing > 0:
+        rows = _lease_reviews(user_id, missing, ahead=True) or []
+        cards.extend(_review_card(user_id, row, eng_rus, others_count) for row in rows)
+    return cards
+
+
+@timed('query')
+def record_review(uid, pair_id, quality):
+    """
+    Function Purpose:
+
+    This function is designed to record the user's answer to a card and reschedule the
+    word pair with the SM-2 algorithm (see spaced_repetition.next_review).
+
+    Parameters:
+
+    uid: The ID of the user who answered.
+    pair_id: The ID of the word pair (Card.pair_id).
+    quality: The SM-2 grade of the answer, e.g. QUALITY_RECALLED or QUALITY_FORGOTTEN.
+    Return Value:
+
+    The new ReviewState of the pair, or None if the statement failed.
+    Database Query Explanation:
+
+    Select Statement (REVIEW_STATE):
+    Reads and locks the current repetitions, interval and ease of the pair.
+    Insert Statement (SAVE_REVIEW):
+    Stores the new state with due_at = now + interval, clearing the shown mark.
     Commit:
     Commits the transaction to persist the changes in the database.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                            insert into users (user_id, user_name)
-                            values (%s, %s)
-                            """, (user_id, user_name))
+                REVIEW_STATE_STATEMENT.execute(cur, (uid, pair_id))
+                row = cur.fetchone()
+                state = next_review(ReviewState(*row) if row is not None else NEW_CARD, quality)
+                SAVE_REVIEW_STATEMENT.execute(cur, {'uid': uid, 'pair': pair_id, 'repetitions': state.repetitions,
+                                                    'interval': state.interval_days, 'ease': state.ease})
                 conn.commit()
+                return state
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
-def add_word_to_dict(uid, word_e, word_r):
+@timed('query')
+def release_cards(uid, pair_ids):
     """
     Function Purpose:
 
-    This function is designed to add a new custom word pair to the user's
-    dictionary in the database. It includes the English word, Russian word, and their association.
+    This function is designed to end the lease of cards handed out by scheduled_cards
+    that will not be shown (called by CardDeck for the cards it throws away).
 
     Parameters:
 
-    uid: The ID of the user to whom the custom word pair is associated.
-    word_e: The English word to be added.
-    word_r: The corresponding Russian word to be added.
+    uid: The ID of the user the cards were handed out to.
+    pair_ids: The IDs of the word pairs (Card.pair_id); None entries are ignored.
     Return Value:
 
-    If the operation is successful, the function returns None.
-    If there's an attempt to insert a duplicate entry, the function returns the string 'Duplicate'.
+    The number of reviews released, or None if the statement failed.
     Database Query Explanation:
 
-    Insert Statements:
-    Inserts the provided English word (word_e) into the e_words table, returning
-    the generated ID (e_word_id).
-    Inserts the provided Russian word (word_r) into the r_words table, returning
-    the generated ID (r_word_id).
-    Inserts a row into the e_r_words table, establishing the association between
-    the English and Russian words, returning the generated ID (e_r_word_id).
-    Inserts a row into the user_words table, associating the custom word with
-    the specified user.
+    Update Statement (RELEASE_REVIEWS):
+    Clears shown_at of the user's reviews of these pairs, so LEASE_REVIEWS picks
+    them again as soon as they are due.
     Commit:
     Commits the transaction to persist the changes in the database.
-    Duplicate Entry Handling:
-    Checks if the exception has a PostgreSQL error code '23505', which indicates
-    a violation of a unique constraint (duplicate entry). In such cases, the function returns 'Duplicate'.
     Exception Handling:
-    Catches any exceptions that might occur during the execution of the queries.
+    Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    pair_ids = [pair_id for pair_id in pair_ids if pair_id is not None]
+    if not pair_ids:
+        return 0
+    with get_connection() as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                            insert into e_words (word)
-                            values (%s) RETURNING id
-                            """, (word_e,))
-                e_word_id = cur.fetchone()[0]
-                cur.execute("""
-                    insert into r_words (word)
-                            values (%s) RETURNING id
-                            """, (word_r,))
-                r_word_id = cur.fetchone()[0]
-                cur.execute("""
-                    insert into e_r_words (e_word_id, r_word_id)
-                    values (%s, %s) RETURNING id
-                    """, (e_word_id, r_word_id))
-                e_r_word_id = cur.fetchone()[0]
-                cur.execute("""
-                    insert into user_words (user_id, custom_word_id)
-                    values (%s, %s)
-                    """, (uid, e_r_word_id))
+                cur.execute(RELEASE_REVIEWS, {'uid': uid, 'pairs': pair_ids})
                 conn.commit()
+                return cur.rowcount
             except Exception as ex:
-                if ex.pgcode == '23505':
-                    return 'Duplicate'
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
-def delete_word_from_dict(uid, word_e):
-    try:
-        e_word_id = if_e_word_exists(uid, word_e)
-        r_word_id = if_r_word_exists(uid, word_e)
-        if e_word_id is not None:
-            word_ids = find_e_word_links(e_word_id[0])
-            r_word_id = word_ids[1]
-            e_r_word_id = word_ids[0]
-            delete_specific_word(e_r_word_id, e_word_id[0], r_word_id)
-            return True
-        elif r_word_id is not None and e_word_id is None:
-            word_ids = find_r_word_links(r_word_id[0])
-            e_word_id = word_ids[1]
-            e_r_word_id = word_ids[0]
-            delete_specific_word(e_r_word_id, e_word_id, r_word_id[0])
-            return True
-        else:
-            return False
-    except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        message = template.format(type(ex).__name__, ex.args)
-        print(message)
-
-def delete_specific_word(e_r_word_id, e_word_id, r_word_id):
+@timed('query')
+def record_answers(rows):
     """
     Function Purpose:
 
-    This function is designed to delete a custom word pair
-    (English word and its associated Russian word) from the user's dictionary in the database.
+    This function is designed to store a batch of card answers in the answers table
+    (called by answer_log.AnswerLog, not by the handlers).
 
     Parameters:
 
-    uid: The ID of the user from whom the custom word pair is to be deleted.
-    word_e: The English word for which the association is to be removed.
+    rows: A list of (user_id, pair_id, answer, correct, answered_at) tuples, answered_at
+    in Unix seconds.
     Return Value:
 
-    True if the deletion is successful.
-    False if no matching custom word pair is found for deletion.
+    The number of rows stored, or None if the insert failed.
     Database Query Explanation:
 
-    Check for Existing Words:
-    Calls two helper functions (if_e_word_exists and if_r_word_exists) to check
-    if the provided English word exists in the database.
-    Determines the IDs of the English word (e_word_id) and the corresponding
-    Russian word (r_word_id) if they exist.
-    Delete Operation:
-    If the English word exists (e_word_id is not None):
-    Finds the IDs of the associated English-Russian word links (e_r_word_id).
-    Calls the delete_specific_word function to delete the word associations from the database.
-    If only the Russian word exists (r_word_id is not None):
-    Finds the IDs of the associated Russian-English word links (e_r_word_id).
-    Calls the delete_specific_word function to delete the word associations from the database.
+    Insert Statement (RECORD_ANSWERS):
+    Inserts all rows with a single multi-row INSERT built by execute_values.
+    Commit:
+    Commits the transaction to persist the changes in the database.
     Exception Handling:
-    Catches any exceptions that might occur during the execution of the queries.
+    Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                    delete from user_words
-                    where custom_word_id = %s
-                    """, (e_r_word_id,))
-                cur.execute("""
-                    delete from e_r_words
-                    where id = %s
-                    """, (e_r_word_id,))
-                cur.execute("""
-                    delete from e_words
-                    where id = %s
-                    """, (e_word_id,))
-                cur.execute("""
-                    delete from r_words
-                    where id = %s
-                    """, (r_word_id,))
+                execute_values(cur, RECORD_ANSWERS, rows, template=RECORD_ANSWERS_TEMPLATE, page_size=len(rows))
                 conn.commit()
+                return len(rows)
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
-def if_e_word_exists(uid, word):
+@timed('query')
+def if_user_not_exist(user_id):
     """
     Function Purpose:
 
-    This function is designed to check if a specific English word associated
-     with a user exists in the database.
+    This function is designed to check whether a user with the given ID exists in the database.
 
     Parameters:
 
-    uid: The ID of the user for whom the association is checked.
-    word: The English word to check for existence.
+    user_id: The ID of the user to check for existence.
+    Return Value:
+
+    True if the user does not exist in the database, False otherwise.
+    Database Query Explanation:
+
+    Select Statement:
+    Checks for the existence of a user in the users table based on the provided user_id.
+    Retrieves a row from the users table where user_id matches the input.
+    The function returns True if no matching user is found (result set is None),
+    indicating that the user does not exist.
+    Exception Handling:
+    Catches any exceptions that might occur during the execution of the query.
+    Prints detailed information about the exception for debugging purposes.
+    """
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        with conn.cursor() as cur:
+            try:
+                USER_EXISTS_STATEMENT.execute(cur, (user_id,))
+                if cur.fetchone() is None:
+                    return True
+            except Exception as ex:
+                _print_exception(ex)
+
+
+@timed('query')
+def known_user_ids():
+    """
+    Function Purpose:
+
+    This function is designed to load the IDs of all registered users, used to warm up
+    the bot's in-process known-user cache at startup.
+
     Return Value:
 
-    If the English word exists, the function returns the ID of the word (ew.id).
-    If the word does not exist, the function returns None.
+    A list of user IDs, or None if the query failed.
     Database Query Explanation:
 
     Select Statement:
-    Retrieves the ID (ew.id) of the English word (e_words) associated with a user.
-    Joins the e_r_words table to establish associations with Russian words.
-    Joins the user_words table to get user-specific associations.
-    Applies conditions to check if the provided user ID and English word
-    match (uw.user_id = %s and ew.word = %s).
+    Retrieves user_id from every row of the users table.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection(read_only=True) as conn:
         with conn.cursor() as cur:
             try:
                 cur.execute("""
-                    select ew.id
-                    from e_words ew 
-                    join e_r_words erw on ew.id = erw.e_word_id 
-                    join user_words uw on uw.custom_word_id = erw.id 
-                    where uw.user_id = %s and ew.word = %s
-                        """, (uid, word))
-                return cur.fetchone()
+                            select user_id from users
+                            """)
+                return [row[0] for row in cur.fetchall()]
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
-def if_r_word_exists(uid, word):
+@timed('query')
+def add_user(user_id, user_name):
     """
     Function Purpose:
 
-    This function is designed to check if a specific Russian word associated
-    with a user exists in the database.
+    This function is designed to register a user with the provided user ID and username.
+    It is idempotent: registering a user that already exists changes nothing.
 
     Parameters:
 
-    uid: The ID of the user for whom the association is checked.
-    word: The Russian word to check for existence.
+    user_id: The ID of the user to be added.
+    user_name: The username of the user to be added.
     Return Value:
 
-    If the Russian word exists, the function returns the ID of the word (rw.id).
-    If the word does not exist, the function returns None.
+    True if the user was new, False if they were already registered,
+    None if the query failed.
     Database Query Explanation:
 
-    Select Statement:
-    Retrieves the ID (rw.id) of the Russian word (r_words) associated with a user.
-    Joins the e_r_words table to establish associations with English words.
-    Joins the user_words table to get user-specific associations.
-    Applies conditions to check if the provided user ID and Russian word match
-    (uw.user_id = %s and rw.word = %s).
+    Insert Statement:
+    Inserts a new row into the users table with the specified user_id and user_name.
+    On a conflict with an existing user_id nothing is written, so no row is returned.
+    Commit:
+    Commits the transaction to persist the changes in the database.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             try:
                 cur.execute("""
-                    select rw.id
-                    from r_words rw 
-                    join e_r_words erw on rw.id = erw.r_word_id 
-                    join user_words uw on uw.custom_word_id = erw.id 
-                    where uw.user_id = %s and rw.word = %s
-                        """, (uid, word))
-                return cur.fetchone()
+                            insert into users (user_id, user_name)
+                            values (%s, %s)
+                            on conflict (user_id) do nothing
+                            RETURNING true
+                            """, (user_id, user_name))
+                inserted = cur.fetchone() is not None
+                conn.commit()
+                if inserted:
+                    recent_writers.wrote(user_id)
+                return inserted
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
 
-def find_e_word_links(e_word_id):
+@timed('query')
+def add_word_to_dict(uid, word_e, word_r):
     """
     Function Purpose:
 
-    This function is designed to find the links (IDs) between an English word
-    and its associated Russian words in the e_r_words table.
+    This function is designed to add a custom word pair to the user's dictionary
+    in the database in a single atomic statement. Words that already exist (for example
+    "Apple" from the shared vocabulary) are reused instead of causing a duplicate error.
 
     Parameters:
 
-    e_word_id: The ID of the English word for which the links are to be found.
+    uid: The ID of the user to whom the custom word pair is associated.
+    word_e: The English word to be added.
+    word_r: The corresponding Russian word to be added.
     Return Value:
 
-    A tuple containing the ID of the English-Russian word link (e_r_word_id)
-     and the ID of the associated Russian word (r_word_id).
+    An AddWordResult tuple (status, pair_id, word_count), where status is one of:
+    WORD_CREATED - a new pair was created and linked to the user;
+    WORD_LINKED_EXISTING - the pair already existed for other users and is now linked to this user too;
+    WORD_ALREADY_OWNED - the user already has this pair (their own or a shared one), nothing changed.
+    word_count is the number of the user's custom pairs after the change.
+    None if the statement failed.
     Database Query Explanation:
 
-    Select Statement:
-    Retrieves the ID of the English-Russian word link (e_r_word_id) and the
-    ID of the associated Russian word (r_word_id).
-    Filters the results based on the provided e_word_id to find the associations
-    specific to that English word.
+    Insert Statement (ADD_WORD):
+    Inserts the English and Russian words with ON CONFLICT DO NOTHING and takes their IDs
+    either from the RETURNING clause or from the existing rows.
+    Looks up an e_r_words row linking the two words and inserts one only if there is none.
+    Inserts a user_words row if the pair is new, or if it belongs to other users but not
+    to this user. Shared pairs (without any user_words rows) are visible to everybody
+    and are not linked, so they stay shared.
+    Increments users.custom_words_count if a user_words row was inserted.
+    Returns the pair ID, the status and the user's custom word count.
+    If a concurrent transaction added one of the words after the statement started, the
+    statement cannot see it and returns no row; it is then executed once more.
+    Commit:
+    Commits the transaction to persist the changes in the database.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                    select id, r_word_id from e_r_words
-                    where e_word_id = %s
-                    """, (e_word_id,))
-                return cur.fetchone()
+                row = None
+                for _ in range(2):
+                    cur.execute(ADD_WORD, {'uid': uid, 'e': word_e, 'r': word_r})
+                    row = cur.fetchone()
+                    if row is not None:
+                        break
+                conn.commit()
+                if row is None:
+                    return None
+                recent_writers.wrote(uid)
+                result = AddWordResult(row[1], row[0], row[2])
+                if result.status != WORD_ALREADY_OWNED:
+                    vocabulary.invalidate_user(uid)
+                word_counts.put(uid, result.word_count)
+                return result
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
 
-def find_r_word_links(r_word_id):
+
+@timed('query')
+def delete_words_from_dict(uid, words):
     """
     Function Purpose:
 
-    This function is designed to find the links (IDs) between a Russian
-    word and its associated English words in the e_r_words table.
+    This function is designed to delete custom word pairs from the user's dictionary
+    in a single statement and transaction. A pair is matched if either its English or its
+    Russian word is in the given list, so one call can remove many pairs at once.
 
     Parameters:
 
-    r_word_id: The ID of the Russian word for which the links are to be found.
+    uid: The ID of the user from whose dictionary the pairs are deleted.
+    words: A list of English and/or Russian words to delete.
     Return Value:
 
-    A tuple containing the ID of the English-Russian word link (e_r_word_id)
-    and the ID of the associated English word (e_word_id).
+    A DeleteWordsResult tuple (removed, word_count): the number of pairs removed from the
+    user's dictionary (0 if none matched) and the number of custom pairs left,
+    or None if the statement failed.
     Database Query Explanation:
 
-    Select Statement:
-    Retrieves the ID of the English-Russian word link (e_r_word_id) and the ID
-    of the associated English word (e_word_id).
-    Filters the results based on the provided r_word_id to find the associations
-    specific to that Russian word.
+    Delete Statement (DELETE_WORDS):
+    The target CTE finds the user's user_words rows whose pair matches one of the words.
+    Deletes those user_words rows.
+    Deletes the matched e_r_words pairs that are not linked to any other user.
+    Deletes the e_words and r_words rows of the deleted pairs that are not used
+    by any other pair, so shared words stay in place.
+    Decreases users.custom_words_count by the number of deleted user_words rows.
+    Returns the number of deleted user_words rows and the user's custom word count.
+    Commit:
+    Commits the transaction to persist the changes in the database.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                    select id, e_word_id from e_r_words
-                    where r_word_id = %s
-                    """, (r_word_id,))
-                return cur.fetchone()
+                cur.execute(DELETE_WORDS, {'uid': uid, 'words': list(words)})
+                row = cur.fetchone()
+                conn.commit()
+                recent_writers.wrote(uid)
+                result = DeleteWordsResult(row[0], row[3])
+                if result.removed:
+                    vocabulary.invalidate_user(uid)
+                word_counts.put(uid, result.word_count)
+                return result
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
+                _print_exception(ex)
+
+
+@timed('query')
+def delete_word_from_dict(uid, word_e):
+    """
+    Function Purpose:
+
+    This function is designed to delete the user's custom word pairs matching one word,
+    given in either language. See delete_words_from_dict.
+
+    Parameters:
+
+    uid: The ID of the user from whose dictionary the pair is deleted.
+    word_e: The English or Russian word of the pair.
+    Return Value:
+
+    True if at least one pair was deleted, False if no pair matched (or the statement failed).
+    """
+    result = delete_words_from_dict(uid, [word_e])
+    return bool(result and result.removed)
 
+
+@timed('query')
 def custom_words_user_count(uid):
     """
     Function Purpose:
 
     This function is designed to retrieve the count of custom word pairs associated
-    with a specific user in the user_words table.
+    with a specific user. The count is kept in users.custom_words_count by the add and
+    delete statements and cached in process, so no user_words rows are counted.
 
     Parameters:
 
@@ -554,20 +1175,64 @@ def custom_words_user_count(uid):
     Database Query Explanation:
 
     Select Statement:
-    Retrieves the count of rows in the user_words table where the user_id matches the provided uid.
+    On a cache miss, retrieves custom_words_count from the users row with the provided uid.
     Exception Handling:
     Catches any exceptions that might occur during the execution of the query.
     Prints detailed information about the exception for debugging purposes.
     """
-    with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
+    count = word_counts.get(uid)
+    if count is not None:
+        return str(count)
+    with get_connection(read_only=True, user_id=uid) as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("""
-                    select count(*) from user_words
-                    where user_id = %s
-                    """, (uid,))
-                return str(cur.fetchone()[0])
+                USER_WORD_COUNT_STATEMENT.execute(cur, (uid,))
+                row = cur.fetchone()
+                count = row[0] if row is not None else 0
+                word_counts.put(uid, count)
+                return str(count)
             except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
\ No newline at end of file
+                _print_exception(ex)
+
+
+def warm_up():
+    """
+    Function Purpose:
+
+    This function is designed to prime the process before it takes updates, so the first
+    users after a deploy do not pay for cold caches. It runs once at startup.
+
+    Database Query Explanation:
+
+    Takes the DB_POOL_MIN connections the pool (and the replica pool, if configured)
+    opens at startup and, on each of them,
+    prepares the hot statements (HOT_STATEMENTS) and runs the card sampling ones once,
+    which loads the catalog caches of the session and the index pages they read.
+    Then loads the shared word pairs into the vocabulary cache, which also starts
+    building the distractor index.
+    Exception Handling:
+    A failed step is printed and skipped; the statements are then prepared on first use.
+    """
+    pools = [pool for pool in (get_pool(), get_replica_pool()) if pool is not None]
+    connections = []
+    try:
+        for pool in pools:
+            for _ in range(DB_POOL_MIN):
+                connections.append((pool, pool.getconn()))
+        for _, conn in connections:
+            with conn:
+                with conn.cursor() as cur:
+                    for statement in HOT_STATEMENTS:
+                        statement.prepare(cur)
+                    for eng_rus in (True, False):
+                        SAMPLE_WORDS_STATEMENTS[eng_rus].execute(cur, {'uid': 0, 'avoid': '', 'count': 4,
+                                                                       'probes': 4 * DISTRACTOR_OVERSAMPLING})
+                        cur.fetchall()
+    except Exception as ex:
+        _print_exception(ex)
+    finally:
+        for pool, conn in connections:
+            pool.putconn(conn)
+    rows = shared_word_pairs()
+    if rows is not None:
+        vocabulary.put_shared(rows)
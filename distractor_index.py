@@ -0,0 +1,128 @@
+import heapq
+import random
+import threading
+from collections import defaultdict
+
+# Words drawn from each of the target's buckets as candidates. The candidates are
+# then ranked, so the cost of a lookup depends on this and not on the vocabulary size.
+CANDIDATES_PER_BUCKET = 4
+
+# The distractors are drawn at random from the best count * SPREAD candidates, so the
+# same target does not always get the same distractors.
+SPREAD = 2
+
+# Similarity lost per letter of difference in length.
+LENGTH_PENALTY = 0.05
+
+
+def _trigrams(normalized):
+    """Character trigrams of a lowercased word padded with ^ and $, so prefixes and endings count too."""
+    padded = f'^{normalized}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _bucket_keys(word):
+    normalized = word.lower()
+    if not normalized:
+        return []
+    keys = [('prefix', normalized[:2]), ('first-length', normalized[0], len(normalized) // 3)]
+    keys.extend(('gram', gram) for gram in _trigrams(normalized))
+    return keys
+
+
+class DistractorIndex:
+    """
+    Class Purpose:
+
+    An in-memory index of the words of one language that finds plausible distractors
+    for a card: words that look like the answer. Every word is put into a few buckets:
+    its first two letters, its first letter together with its length band, and each
+    of its character trigrams. A lookup takes a handful of random words from each of
+    the target's buckets, ranks them by trigram similarity (Jaccard) and length, and
+    picks among the best, so it costs the same however many words are indexed. Words are added
+    incrementally; the index is only rebuilt when words disappear.
+    """
+
+    def __init__(self):
+        self._words = set()
+        self._buckets = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._words
+
+    def add(self, word):
+        with self._lock:
+            self._add(word)
+
+    def _add(self, word):
+        if word in self._words:
+            return
+        self._words.add(word)
+        for key in _bucket_keys(word):
+            self._buckets[key].append(word)
+
+    def sync(self, words):
+        """
+        Makes the index hold exactly the given words. New words are added to their
+        buckets; if some indexed words are gone, the buckets are rebuilt.
+        """
+        words = set(words)
+        with self._lock:
+            if self._words - words:
+                buckets = defaultdict(list)
+                for word in words:
+                    for key in _bucket_keys(word):
+                        buckets[key].append(word)
+                self._words, self._buckets = words, buckets
+                return
+            for word in words - self._words:
+                self._add(word)
+
+    def similar(self, target_word, count, exclude=(), extra=()):
+        """
+        Function Purpose:
+
+        Picks up to count distinct words that look like target_word.
+
+        Parameters:
+
+        target_word: The correct answer; it is never returned.
+        count: The number of words to pick.
+        exclude: Words that must not be returned either.
+        extra: Words outside the index that may be picked too (e.g. the user's own
+        words); they are ranked directly, so this should be a short list.
+        Return Value:
+
+        A list of at most count words, fewer if too few candidates were found.
+        """
+        skip = set(exclude)
+        skip.add(target_word)
+        candidates = set()
+        for key in _bucket_keys(target_word):
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            if len(bucket) <= CANDIDATES_PER_BUCKET:
+                candidates.update(bucket)
+            else:
+                candidates.update(bucket[random.randrange(len(bucket))] for _ in range(CANDIDATES_PER_BUCKET))
+        candidates.update(extra)
+        candidates.difference_update(skip)
+        target = target_word.lower()
+        target_grams = _trigrams(target)
+        scored = []
+        for word in candidates:
+            normalized = word.lower()
+            # A spelling variant of the answer would be a second right answer.
+            if normalized == target:
+                continue
+            grams = _trigrams(normalized)
+            score = (len(target_grams & grams) / len(target_grams | grams)
+                     - abs(len(normalized) - len(target)) * LENGTH_PENALTY)
+            scored.append((score, word))
+        best = [word for _, word in heapq.nlargest(count * SPREAD, scored)]
+        return random.sample(best, min(count, len(best)))
@@ -1,53 +1,32 @@
-import psycopg2
+from load_words import load_word_pairs
+from settings import DB_PARAMS
+from settings import STORAGE_BACKEND
 
+# Starter vocabulary. Pairs are resolved by word rather than by id, so the script
+# works on a non-empty database and running it again adds nothing.
+INITIAL_PAIRS = [
+    ('Car', 'Машина'),
+    ('Green', 'Зеленый'),
+    ('White', 'Белый'),
+    ('Peace', 'Мир'),
+    ('Apple', 'Яблоко'),
+    ('Orange', 'Апельсин'),
+    ('Water', 'Вода'),
+    ('Milk', 'Молоко'),
+    ('Banana', 'Банан'),
+    ('Hello', 'Привет'),
+    ('World', 'Мир'),
+]
 
-with psycopg2.connect(database="Telegram_English", user="postgres", password="postgres") as conn:
-    with conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO e_words (word)
-            VALUES 
-            ('Car'),
-            ('Green'),
-            ('White'),
-            ('Peace'),
-            ('Apple'),
-            ('Orange'),
-            ('Water'),
-            ('Milk'),
-            ('Banana'),
-            ('Hello'),
-            ('World')
-            ;
-        """)
-        cur.execute("""
-            INSERT INTO r_words (word)
-            VALUES 
-            ('Машина'),
-            ('Зеленый'),
-            ('Белый'),
-            ('Мир'),
-            ('Яблоко'),
-            ('Апельсин'),
-            ('Вода'),
-            ('Молоко'),
-            ('Банан'),
-            ('Привет')
-            ;
-        """)
-        cur.execute("""
-            INSERT INTO e_r_words (e_word_id, r_word_id)
-            VALUES 
-            (1, 1),
-            (2, 2),
-            (3, 3),
-            (4, 4),
-            (5, 5),
-            (6, 6),
-            (7, 7),
-            (8, 8),
-            (9, 9),
-            (10, 10),
-            (11, 4)
-            ;
-        """)
-        conn.commit()
+
+if __name__ == '__main__':
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_dict_jobs import load_word_pairs as load_sqlite_word_pairs
+        load_sqlite_word_pairs(INITIAL_PAIRS)
+    else:
+        import psycopg2
+        conn = psycopg2.connect(**DB_PARAMS)
+        try:
+            load_word_pairs(conn, INITIAL_PAIRS)
+        finally:
+            conn.close()
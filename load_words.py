@@ -0,0 +1,245 @@
+"""
+Bulk loader for the shared vocabulary.
+
+Streams a CSV, TSV or JSONL word list through COPY into a temporary staging table,
+batch by batch, and resolves it into e_words, r_words and e_r_words with set-based
+statements: words are inserted with ON CONFLICT DO NOTHING, pairs are joined back
+by word and inserted only if they do not exist yet. The file is never held in memory,
+so a list of hundreds of thousands of pairs loads in constant memory, and loading the
+same file twice adds nothing. Loaded pairs are shared (not linked to any user).
+
+    python load_words.py words.csv
+    python load_words.py freq.tsv --english 2 --russian 3
+    python load_words.py words.csv --english english --russian russian  # header names
+    python load_words.py pairs.jsonl --english en --russian ru
+    zcat words.tsv.gz | python load_words.py - --format tsv
+    STORAGE_BACKEND=sqlite python load_words.py words.csv  # into SQLITE_PATH
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from itertools import islice
+
+from settings import DB_PARAMS
+from settings import STORAGE_BACKEND
+
+# Length of e_words.word and r_words.word (VARCHAR(40)).
+MAX_WORD_LENGTH = 40
+DEFAULT_BATCH_ROWS = 50000
+
+LoadStats = namedtuple('LoadStats', ['rows', 'rejected', 'e_words', 'r_words', 'pairs', 'seconds'])
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+STAGE_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS load_pairs(
+        e_word TEXT NOT NULL,
+        r_word TEXT NOT NULL
+    );
+    TRUNCATE load_pairs;
+"""
+
+INSERT_E_WORDS = """
+    insert into e_words (word)
+    select distinct e_word from load_pairs order by 1
+    on conflict (word) do nothing;
+"""
+
+INSERT_R_WORDS = """
+    insert into r_words (word)
+    select distinct r_word from load_pairs order by 1
+    on conflict (word) do nothing;
+"""
+
+# Every word of the batch exists at this point, so the pairs are resolved with one join.
+INSERT_PAIRS = """
+    insert into e_r_words (e_word_id, r_word_id)
+    select distinct ew.id, rw.id
+    from load_pairs lp
+    join e_words ew on ew.word = lp.e_word
+    join r_words rw on rw.word = lp.r_word
+    where not exists (select 1 from e_r_words erw
+                      where erw.e_word_id = ew.id and erw.r_word_id = rw.id);
+"""
+
+
+class _CopyStream:
+    """Read-only file object over an iterator of lines, consumed by COPY in chunks."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def _clean(word):
+    if not isinstance(word, str):
+        return None
+    word = word.strip()
+    if not word or len(word) > MAX_WORD_LENGTH:
+        return None
+    return word
+
+
+def read_delimited(lines, delimiter, english=0, russian=1):
+    """
+    Yields (english, russian) rows of a CSV/TSV file. The columns are either indexes
+    or, if not numeric, names from the header line. Extra columns (frequency, rank,
+    part of speech) are ignored; rows missing a column yield None in its place.
+    """
+    reader = csv.reader(lines, delimiter=delimiter)
+    english, russian = str(english), str(russian)
+    if not (english.isdigit() and russian.isdigit()):
+        header = next(reader, [])
+        for name in (english, russian):
+            if not name.isdigit() and name not in header:
+                raise ValueError(f"column {name!r} is not in the header {header!r}")
+        english = english if english.isdigit() else header.index(english)
+        russian = russian if russian.isdigit() else header.index(russian)
+    english, russian = int(english), int(russian)
+    for row in reader:
+        yield (row[english] if english < len(row) else None,
+               row[russian] if russian < len(row) else None)
+
+
+def read_jsonl(lines, english='english', russian='russian'):
+    """Yields (english, russian) rows of a JSON Lines file with one object per line."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield None, None
+            continue
+        if not isinstance(item, dict):
+            yield None, None
+            continue
+        yield item.get(english), item.get(russian)
+
+
+def load_word_pairs(conn, pairs, batch_rows=DEFAULT_BATCH_ROWS, report=None):
+    """
+    Function Purpose:
+
+    Loads (english, russian) pairs into the shared vocabulary. Each batch is streamed
+    with COPY into the load_pairs staging table, resolved with three set-based inserts
+    and committed, so an interrupted load keeps the finished batches and can simply be
+    restarted. Empty words and words longer than the column are rejected.
+
+    Parameters:
+
+    conn: A psycopg2 connection.
+    pairs: An iterable of (english, russian) tuples; it is consumed lazily.
+    batch_rows: Rows per COPY batch and transaction.
+    report: Optional callable that receives the running LoadStats after every batch.
+    Return Value:
+
+    LoadStats with the number of rows read, rows rejected, new English words,
+    new Russian words, new pairs and the elapsed seconds.
+    """
+    stats = {'rows': 0, 'rejected': 0, 'e_words': 0, 'r_words': 0, 'pairs': 0}
+    started = time.perf_counter()
+
+    def copy_lines(batch):
+        for e_word, r_word in batch:
+            stats['rows'] += 1
+            e_word, r_word = _clean(e_word), _clean(r_word)
+            if e_word is None or r_word is None:
+                stats['rejected'] += 1
+                continue
+            yield f"{e_word.translate(_COPY_ESCAPES)}\t{r_word.translate(_COPY_ESCAPES)}\n"
+
+    pairs = iter(pairs)
+    with conn.cursor() as cur:
+        while True:
+            rows_before = stats['rows']
+            cur.execute(STAGE_TABLE)
+            cur.copy_expert("COPY load_pairs (e_word, r_word) FROM STDIN",
+                            _CopyStream(copy_lines(islice(pairs, batch_rows))))
+            if stats['rows'] == rows_before:
+                conn.commit()
+                break
+            cur.execute("ANALYZE load_pairs")
+            cur.execute(INSERT_E_WORDS)
+            stats['e_words'] += cur.rowcount
+            cur.execute(INSERT_R_WORDS)
+            stats['r_words'] += cur.rowcount
+            cur.execute(INSERT_PAIRS)
+            stats['pairs'] += cur.rowcount
+            conn.commit()
+            if report is not None:
+                report(LoadStats(seconds=time.perf_counter() - started, **stats))
+    return LoadStats(seconds=time.perf_counter() - started, **stats)
+
+
+def _print_progress(stats):
+    rate = stats.rows / stats.seconds if stats.seconds else 0.0
+    print(f"{stats.rows} rows, {stats.pairs} new pairs, {rate:,.0f} rows/s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load word pairs into the shared vocabulary.')
+    parser.add_argument('path', help="CSV, TSV or JSONL file, or '-' for standard input")
+    parser.add_argument('--format', choices=['csv', 'tsv', 'jsonl'],
+                        help='input format (default: from the file extension)')
+    parser.add_argument('--english', help="English word column: index or header name for CSV/TSV "
+                                          "(default 0), key for JSONL (default 'english')")
+    parser.add_argument('--russian', help="Russian word column: index or header name for CSV/TSV "
+                                          "(default 1), key for JSONL (default 'russian')")
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS,
+                        help='rows per COPY batch and transaction')
+    parser.add_argument('--quiet', action='store_true', help='do not report progress after every batch')
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        fmt = os.path.splitext(args.path)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'tsv', 'jsonl'):
+            parser.error('cannot detect the input format, use --format')
+
+    source = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+    conn = None
+    if STORAGE_BACKEND == 'postgres':
+        import psycopg2
+        conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        if fmt == 'jsonl':
+            pairs = read_jsonl(source, args.english or 'english', args.russian or 'russian')
+        else:
+            pairs = read_delimited(source, ',' if fmt == 'csv' else '\t',
+                                   args.english or 0, args.russian or 1)
+        report = None if args.quiet else _print_progress
+        if conn is None:
+            from sqlite_dict_jobs import load_word_pairs as load_sqlite_word_pairs
+            stats = load_sqlite_word_pairs(pairs, args.batch_rows, report=report)
+        else:
+            stats = load_word_pairs(conn, pairs, args.batch_rows, report=report)
+    finally:
+        if conn is not None:
+            conn.close()
+        if source is not sys.stdin:
+            source.close()
+
+    rate = stats.rows / stats.seconds if stats.seconds else 0.0
+    print(f"Read {stats.rows} rows ({stats.rejected} rejected) in {stats.seconds:.1f}s, {rate:,.0f} rows/s")
+    print(f"New words: {stats.e_words} English, {stats.r_words} Russian; "
+          f"new pairs: {stats.pairs}, duplicates skipped: {stats.rows - stats.rejected - stats.pairs}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,62 +1,96 @@
-import random
+import atexit
+import time
 
 from telebot import types, TeleBot, custom_filters
-from telebot.storage import StateMemoryStorage
-from telebot.handler_backends import State, StatesGroup
-
-from dict_jobs import random_word_from_base
-from dict_jobs import random_engl_words
-from dict_jobs import random_rus_words
-from dict_jobs import if_user_not_exist
-from dict_jobs import add_user
-from dict_jobs import add_word_to_dict
-from dict_jobs import delete_word_from_dict
-from dict_jobs import custom_words_user_count
-from credentials import token_bot
-
-print('Start telegram bot...')
-
-state_storage = StateMemoryStorage()
-bot = TeleBot(token_bot, state_storage=state_storage)
-
-known_users = []
-userStep = {}
-buttons = []
-e_word_to_add = {}
-r_word_to_add = {}
-
-
-def show_hint(*lines):
-    return '\n'.join(lines)
-
-
-def show_target(data):
-    return f"{data['target_word']} -> {data['translate_word']}"
 
+from answer_log import AnswerLog
+from backlog import BacklogDrain
+from bot_common import Command, MyStates, show_hint, show_target, card_buttons
+from storage import scheduled_cards
+from storage import release_cards
+from storage import record_review
+from storage import record_answers
+from storage import known_user_ids
+from storage import add_user
+from storage import add_word_to_dict
+from storage import delete_words_from_dict
+from storage import warm_up as warm_up_storage
+from card_deck import CardDeck
+from metrics import start_exporter
+from metrics import timed
+from spaced_repetition import QUALITY_RECALLED, QUALITY_FORGOTTEN
+from storage_types import WORD_ALREADY_OWNED
+from send_queue import OutboundQueue
+from session_store import create_session_store, SessionStateStorage
+from settings import CARD_DECK_SIZE, CARD_DECK_REFILL_AT, CARD_DECK_USERS, CARD_DECK_WORKERS
+from settings import SESSION_STORE, SESSION_CACHE_SIZE, SESSION_CACHE_TTL, SESSION_MAX_USERS, SESSION_IDLE_TTL
+from settings import SESSION_FLUSH_INTERVAL, SESSION_FLUSH_BATCH
+from settings import SEND_WORKERS, SEND_GLOBAL_RATE, SEND_GLOBAL_BURST, SEND_CHAT_RATE, SEND_CHAT_BURST
+from settings import SEND_COALESCE, SEND_QUEUE_SIZE
+from settings import ANSWER_LOG_BATCH, ANSWER_LOG_INTERVAL_MS, ANSWER_LOG_MAX_PENDING
+from settings import DRAIN_BACKLOG, DRAIN_BATCH, DRAIN_WORKERS
+from credentials import token_bot
 
-class Command:
-    ADD_WORD = 'Добавить слово ➕'
-    DELETE_WORD = 'Удалить слово🔙'
-    NEXT = 'Дальше ⏭'
+# Per-user dialog state (step, word being added, card buttons and the telebot state)
+# lives in the session store: bounded in memory, or shared by several bot processes.
+sessions = create_session_store(SESSION_STORE, max_sessions=SESSION_MAX_USERS, idle_ttl=SESSION_IDLE_TTL,
+                                max_cached=SESSION_CACHE_SIZE, cache_ttl=SESSION_CACHE_TTL,
+                                flush_interval=SESSION_FLUSH_INTERVAL, batch_size=SESSION_FLUSH_BATCH)
+atexit.register(sessions.close)
+bot = TeleBot(token_bot, state_storage=SessionStateStorage(sessions))
+# Replies are queued and sent by background threads within Telegram's rate limits,
+# so handlers never wait on the Bot API.
+outbox = OutboundQueue(bot, workers=SEND_WORKERS, global_rate=SEND_GLOBAL_RATE, global_burst=SEND_GLOBAL_BURST,
+                       chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST, coalesce=SEND_COALESCE,
+                       max_pending=SEND_QUEUE_SIZE)
+atexit.register(outbox.close)
+# Card answers are written to the answers table in batches by a background thread.
+answers = AnswerLog(record_answers, batch_size=ANSWER_LOG_BATCH, flush_interval=ANSWER_LOG_INTERVAL_MS / 1000,
+                    max_pending=ANSWER_LOG_MAX_PENDING)
+atexit.register(answers.close)
+
+# IDs of registered users, so existence checks need no database round trip.
+known_users = set()
+deck = CardDeck(lambda uid, count: scheduled_cards(uid, count, eng_rus=True),
+                size=CARD_DECK_SIZE, refill_at=CARD_DECK_REFILL_AT,
+                max_users=CARD_DECK_USERS, workers=CARD_DECK_WORKERS, release=release_cards)
+
+
+def warm_up():
+    """
+    Primes the storage (pooled connections, prepared statements, vocabulary cache),
+    loads the known-user cache and starts the metrics exporter; called once before the
+    bot starts taking updates.
+    """
+    started = time.monotonic()
+    warm_up_storage()
+    known_users.update(known_user_ids() or ())
+    print(f'Warm-up finished in {time.monotonic() - started:.2f}s')
+    start_exporter()
 
 
-class MyStates(StatesGroup):
-    target_word = State()
-    translate_word = State()
-    another_words = State()
+def register_user(uid, user_name):
+    """
+    Adds a user missing from the known-user cache to the database. Returns True if
+    they are new there too; a user registered by another process is just cached.
+    """
+    inserted = add_user(uid, user_name)
+    if inserted is not None:
+        known_users.add(uid)
+    return bool(inserted)
 
 
-def get_user_step(uid):
-    if if_user_not_exist(uid):
-        known_users.append(uid)
-        userStep[uid] = 0
-        print("New user detected, who hasn't used \"/start\" yet")
-        return 0
-    else:
-        return userStep[uid]
+def needs_card(uid):
+    """
+    True if a text message from the user would be taken as an answer to a card, but
+    there is no card to check it against (e.g. it was lost with the session in a restart).
+    """
+    session = sessions.get(uid)
+    return session.get('step', 0) == 0 and session.get('data', {}).get('target_word') is None
 
 
 @bot.message_handler(commands=['cards', 'start'])
+@timed('handler')
 def create_cards(message):
     """
     Function Purpose:
@@ -70,16 +104,19 @@ def create_cards(message):
     Function Flow:
 
     Check User Existence:
-    Checks if the user already exists in the system. If not, adds the user to the database.
-    Initializes user-specific variables (userStep, etc.).
+    Checks the known-user cache; a user missing from it is added to the database (idempotently).
+    Initializes the user's session (dialog step, etc.).
     Create Reply Markup:
     Initializes a reply keyboard markup with buttons for vocabulary card interaction.
-    Retrieves a random English word (target_word) and its translation (translate) from the database.
-    Generates additional words (others) for the multiple-choice options.
+    Takes the next prefetched card from the user's deck: the next word due for review
+    (target_word), its translation (translate) and additional words (others) for the
+    multiple-choice options. The deck is refilled in the background by the spaced
+    repetition scheduler, so this does not wait on the database.
     Shuffle Buttons:
     Shuffles the order of buttons to present the options randomly.
     Send Message with Markup:
-    Sends a message to the user with the translated word and multiple-choice options.
+    Queues a message to the user with the translated word and multiple-choice options
+    (delivered by the outbound queue, merged with the greeting of a new user).
     Sets the user's state to track the ongoing conversation.
     Store Data in Bot's Memory:
     Stores essential data in the bot's memory for tracking user progress.
@@ -88,74 +125,63 @@ def create_cards(message):
     The keyboard layout includes buttons for each word option, a "Next" button, an "Add Word" button, and a "Delete Word" button.
     """
     cid = message.chat.id
-    if if_user_not_exist(cid):
-        known_users.append(cid)
-        add_user(cid, message.from_user.first_name)
-        userStep[cid] = 0
+    uid = message.from_user.id
+    if uid not in known_users and register_user(uid, message.from_user.first_name):
+        sessions.update(uid, step=0)
         user_name = message.from_user.first_name
-        bot.send_message(cid, f"Ну что, {user_name}, поучим Английский?")
+        outbox.send(cid, f"Ну что, {user_name}, поучим Английский?")
     markup = types.ReplyKeyboardMarkup(row_width=2)
 
-    global buttons
-    buttons = []
-    eng_rus = True
-    if eng_rus:
-        words = random_word_from_base(cid)
-        target_word = words[0]
-        translate = words[1]
-        target_word_btn = types.KeyboardButton(target_word)
-        buttons.append(target_word_btn)
-        others = list(random_rus_words(target_word, cid))
-    else:
-        words = random_word_from_base(cid)
-        target_word = words[1]
-        translate = words[0]
-        target_word_btn = types.KeyboardButton(target_word)
-        buttons.append(target_word_btn)
-        others = list(random_engl_words(target_word, cid))
-    other_words_btns = [types.KeyboardButton(word) for word in others]
-    buttons.extend(other_words_btns)
-    random.shuffle(buttons)
-    next_btn = types.KeyboardButton(Command.NEXT)
-    add_word_btn = types.KeyboardButton(Command.ADD_WORD)
-    delete_word_btn = types.KeyboardButton(Command.DELETE_WORD)
-    buttons.extend([next_btn, add_word_btn, delete_word_btn])
+    card = deck.next_card(uid)
+    if card is None:
+        # The database is unavailable or there are no words yet.
+        markup.add(types.KeyboardButton(Command.NEXT), types.KeyboardButton(Command.ADD_WORD))
+        outbox.send(cid, "Не удалось подобрать слово, попробуйте еще раз", reply_markup=markup)
+        return
+    target_word = card.target_word
+    translate = card.translate_word
+    others = card.other_words
+    buttons = card_buttons(target_word, others)
 
     markup.add(*buttons)
 
     greeting = f"Выбери перевод слова:\n {translate}"
-    bot.send_message(message.chat.id, greeting, reply_markup=markup)
-    bot.set_state(message.from_user.id, MyStates.target_word, message.chat.id)
-    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+    outbox.send(cid, greeting, reply_markup=markup)
+    bot.set_state(uid, MyStates.target_word, cid)
+    with bot.retrieve_data(uid, cid) as data:
         data['target_word'] = target_word
         data['translate_word'] = translate
         data['other_words'] = others
+        data['pair_id'] = card.pair_id
+    sessions.update(uid, buttons=[btn.text for btn in buttons], missed=False)
 
 
 @bot.message_handler(func=lambda message: message.text == Command.NEXT)
+@timed('handler')
 def next_cards(message):
     create_cards(message)
 
 
 @bot.message_handler(func=lambda message: message.text == Command.DELETE_WORD)
+@timed('handler')
 def delete_word(message):
-    cid = message.chat.id
-    userStep[cid] = 3
+    sessions.update(message.from_user.id, step=3)
     markup = types.ReplyKeyboardMarkup(row_width=2)
     hint = "Напишите слово, которое надо удалить"
-    bot.send_message(message.chat.id, hint, reply_markup=markup)
+    outbox.send(message.chat.id, hint, reply_markup=markup)
 
 
 @bot.message_handler(func=lambda message: message.text == Command.ADD_WORD)
+@timed('handler')
 def add_word(message):
-    cid = message.chat.id
-    userStep[cid] = 1
+    sessions.update(message.from_user.id, step=1)
     markup = types.ReplyKeyboardMarkup(row_width=2)
     hint = "Напишите новое английское слово"
-    bot.send_message(message.chat.id, hint, reply_markup=markup)
+    outbox.send(message.chat.id, hint, reply_markup=markup)
 
 
 @bot.message_handler(func=lambda message: True, content_types=['text'])
+@timed('handler')
 def message_reply(message):
     """
     Function Purpose:
@@ -171,73 +197,106 @@ def message_reply(message):
     Initialize Variables:
     Initializes necessary variables and reply markup for message handling.
     Check User State:
-    Determines the user's current state (userStep) to understand the context of the message.
+    Determines the user's current dialog step from their session to understand the context of the message.
     Handling State 0 (Answering Vocabulary Card):
+    Shows a new card instead if the user has no card to answer.
     Checks if the provided text matches the target word.
     Provides feedback and a hint based on the correctness of the answer.
+    Records the answer for the spaced repetition schedule: the first mistake on a card
+    counts as forgotten, a right answer without mistakes as recalled.
+    Logs every answer to a card (right or wrong) to the answer log, which writes it to
+    the answers table in the background.
     Handling State 1 (Adding English Word):
     Stores the provided text as the English word to be added.
     Advances the user to the next state.
     Handling State 2 (Adding Russian Translation):
     Stores the provided text as the Russian translation.
     Adds the word to the user's dictionary and provides feedback.
-    Checks for duplicate entries in the dictionary.
+    Reports words the user already has in the dictionary.
     Handling State 3 (Deleting Word):
     Deletes the provided word from the user's dictionary.
     Provides feedback based on the success or failure of the deletion.
     Send Response Message:
-    Sends a response message to the user with the appropriate hint and feedback.
+    Queues a response message to the user with the appropriate hint and feedback;
+    the outbound queue merges it with the next card when both are still waiting.
     Invokes the next_cards function if the answer was correct.
 
     """
     sucsess = False
     text = message.text
+    uid = message.from_user.id
     markup = types.ReplyKeyboardMarkup(row_width=2)
-    if len(userStep) == 0 or userStep.get(message.from_user.id) == 0:
-        if len(userStep) == 0:
-            userStep[message.from_user.id] = 0
-        with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-            target_word = data['target_word']
+    if needs_card(uid):
+        create_cards(message)
+        return
+    step = sessions.get(uid).get('step', 0)
+    if step == 0:
+        with bot.retrieve_data(uid, message.chat.id) as data:
+            target_word = data.get('target_word')
+            pair_id = data.get('pair_id')
             if text == target_word:
                 hint = show_target(data)
                 hint_text = ["Отлично!❤", hint]
                 hint = show_hint(*hint_text)
                 sucsess = True
             else:
-                for btn in buttons:
-                    if btn.text == text:
-                        btn.text = text + '❌'
-                        break
                 hint = show_hint("Допущена ошибка!",
-                                 f"Попробуй ещё раз вспомнить слово {data['translate_word']}")
-    elif userStep[message.from_user.id] == 1:
-        e_word_to_add[message.from_user.id] = text
+                                 f"Попробуй ещё раз вспомнить слово {data.get('translate_word')}")
+        answers.record(uid, pair_id, text, sucsess)
+        session = sessions.get(uid)
+        if sucsess:
+            if pair_id is not None and not session.get('missed'):
+                record_review(uid, pair_id, QUALITY_RECALLED)
+        else:
+            buttons = session.get('buttons', [])
+            if text in buttons:
+                buttons[buttons.index(text)] = text + '❌'
+            if pair_id is not None and not session.get('missed'):
+                record_review(uid, pair_id, QUALITY_FORGOTTEN)
+                session['missed'] = True
+            sessions.set(uid, session)
+    elif step == 1:
         hint = "Отлично, теперь введите значение слова " + text
-        userStep[message.from_user.id] = 2
-    elif userStep[message.from_user.id] == 2:
-        r_word_to_add[message.from_user.id] = text
-        userStep[message.from_user.id] = 0
-        if add_word_to_dict(message.from_user.id, e_word_to_add[message.from_user.id],
-                            r_word_to_add[message.from_user.id]) == 'Duplicate':
+        sessions.update(uid, step=2, e_word=text)
+    elif step == 2:
+        session = sessions.get(uid)
+        e_word = session.pop('e_word', None)
+        session['step'] = 0
+        sessions.set(uid, session)
+        added = add_word_to_dict(uid, e_word, text)
+        deck.invalidate(uid)
+        if added is None:
+            hint = "Не удалось записать слово, попробуйте еще раз"
+        elif added.status == WORD_ALREADY_OWNED:
             hint = "Такое слово уже есть в словаре"
         else:
             hint = "Отлично, запишем слово " + text + ". в словаре уже "
-            hint += custom_words_user_count(message.from_user.id) + " ваших слов"
-        e_word_to_add.pop(message.from_user.id)
-        r_word_to_add.pop(message.from_user.id)
-    elif userStep[message.from_user.id] == 3:
-        if not delete_word_from_dict(message.from_user.id, text):
+            hint += str(added.word_count) + " ваших слов"
+    elif step == 3:
+        deleted = delete_words_from_dict(uid, [text])
+        deck.invalidate(uid)
+        if not deleted or not deleted.removed:
             hint = "Такого слова нет в словаре"
         else:
             hint = "Отлично, вы удалили слово " + text + ". в словаре уже "
-            hint += custom_words_user_count(message.from_user.id) + " ваших слов"
-        userStep[message.from_user.id] = 0
+            hint += str(deleted.word_count) + " ваших слов"
+        sessions.update(uid, step=0)
     # markup.add(*buttons)
-    bot.send_message(message.chat.id, hint, reply_markup=markup)
+    outbox.send(message.chat.id, hint, reply_markup=markup)
     if sucsess:
         next_cards(message)
 
 
 bot.add_custom_filter(custom_filters.StateFilter(bot))
 
-bot.infinity_polling(skip_pending=True)
+if __name__ == '__main__':
+    print('Start telegram bot...')
+    warm_up()
+    if DRAIN_BACKLOG:
+        # Answers sent while the bot was down are handled first; polling continues after them.
+        BacklogDrain(bot, workers=DRAIN_WORKERS, batch_size=DRAIN_BATCH,
+                     needs_card=needs_card, send_card=create_cards).run()
+        bot.infinity_polling()
+    else:
+        bot.infinity_polling(skip_pending=True)
+
@@ -0,0 +1,169 @@
+import asyncio
+
+from telebot import types, asyncio_filters
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_storage import StateMemoryStorage
+
+from bot_common import Command, MyStates, show_hint, show_target, card_buttons
+from async_dict_jobs import open_pool
+from async_dict_jobs import close_pool
+from async_dict_jobs import scheduled_card
+from async_dict_jobs import record_review
+from async_dict_jobs import known_user_ids
+from async_dict_jobs import add_user
+from async_dict_jobs import add_word_to_dict
+from async_dict_jobs import delete_words_from_dict
+from metrics import start_exporter
+from metrics import timed
+from spaced_repetition import QUALITY_RECALLED, QUALITY_FORGOTTEN
+from storage_types import WORD_ALREADY_OWNED
+from credentials import token_bot
+
+state_storage = StateMemoryStorage()
+bot = AsyncTeleBot(token_bot, state_storage=state_storage)
+
+known_users = set()
+userStep = {}
+e_word_to_add = {}
+r_word_to_add = {}
+
+
+@bot.message_handler(commands=['cards', 'start'])
+@timed('handler')
+async def create_cards(message):
+    """
+    Function Purpose:
+
+    Asyncio version of main.create_cards: greets new users and sends the next vocabulary
+    card. Database access is awaited, so other chats are served while it is in flight.
+    """
+    cid = message.chat.id
+    if cid not in known_users:
+        inserted = await add_user(cid, message.from_user.first_name)
+        if inserted is not None:
+            known_users.add(cid)
+    else:
+        inserted = False
+    if inserted:
+        userStep[cid] = 0
+        user_name = message.from_user.first_name
+        await bot.send_message(cid, f"Ну что, {user_name}, поучим Английский?")
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+
+    card = await scheduled_card(cid)
+    if card is None:
+        # The database is unavailable or there are no words yet.
+        markup.add(types.KeyboardButton(Command.NEXT), types.KeyboardButton(Command.ADD_WORD))
+        await bot.send_message(cid, "Не удалось подобрать слово, попробуйте еще раз", reply_markup=markup)
+        return
+    markup.add(*card_buttons(card.target_word, card.other_words))
+
+    greeting = f"Выбери перевод слова:\n {card.translate_word}"
+    await bot.send_message(message.chat.id, greeting, reply_markup=markup)
+    await bot.set_state(message.from_user.id, MyStates.target_word, message.chat.id)
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data['target_word'] = card.target_word
+        data['translate_word'] = card.translate_word
+        data['other_words'] = card.other_words
+        data['pair_id'] = card.pair_id
+        data['missed'] = False
+
+
+@bot.message_handler(func=lambda message: message.text == Command.NEXT)
+@timed('handler')
+async def next_cards(message):
+    await create_cards(message)
+
+
+@bot.message_handler(func=lambda message: message.text == Command.DELETE_WORD)
+@timed('handler')
+async def delete_word(message):
+    userStep[message.chat.id] = 3
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+    hint = "Напишите слово, которое надо удалить"
+    await bot.send_message(message.chat.id, hint, reply_markup=markup)
+
+
+@bot.message_handler(func=lambda message: message.text == Command.ADD_WORD)
+@timed('handler')
+async def add_word(message):
+    userStep[message.chat.id] = 1
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+    hint = "Напишите новое английское слово"
+    await bot.send_message(message.chat.id, hint, reply_markup=markup)
+
+
+@bot.message_handler(func=lambda message: True, content_types=['text'])
+@timed('handler')
+async def message_reply(message):
+    """
+    Function Purpose:
+
+    Asyncio version of main.message_reply: checks answers to vocabulary cards and walks
+    the user through adding (steps 1 and 2) and deleting (step 3) custom words.
+    """
+    sucsess = False
+    text = message.text
+    uid = message.from_user.id
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+    step = userStep.get(uid, 0)
+    if step == 0:
+        async with bot.retrieve_data(uid, message.chat.id) as data:
+            if text == data.get('target_word'):
+                hint = show_hint("Отлично!❤", show_target(data))
+                sucsess = True
+            else:
+                hint = show_hint("Допущена ошибка!",
+                                 f"Попробуй ещё раз вспомнить слово {data.get('translate_word')}")
+            pair_id = data.get('pair_id')
+            first_answer = not data.get('missed')
+            if not sucsess:
+                data['missed'] = True
+        if pair_id is not None and first_answer:
+            await record_review(uid, pair_id, QUALITY_RECALLED if sucsess else QUALITY_FORGOTTEN)
+    elif step == 1:
+        e_word_to_add[uid] = text
+        hint = "Отлично, теперь введите значение слова " + text
+        userStep[uid] = 2
+    elif step == 2:
+        r_word_to_add[uid] = text
+        userStep[uid] = 0
+        added = await add_word_to_dict(uid, e_word_to_add[uid], r_word_to_add[uid])
+        if added is None:
+            hint = "Не удалось записать слово, попробуйте еще раз"
+        elif added.status == WORD_ALREADY_OWNED:
+            hint = "Такое слово уже есть в словаре"
+        else:
+            hint = "Отлично, запишем слово " + text + ". в словаре уже "
+            hint += str(added.word_count) + " ваших слов"
+        e_word_to_add.pop(uid)
+        r_word_to_add.pop(uid)
+    else:
+        deleted = await delete_words_from_dict(uid, [text])
+        if not deleted or not deleted.removed:
+            hint = "Такого слова нет в словаре"
+        else:
+            hint = "Отлично, вы удалили слово " + text + ". в словаре уже "
+            hint += str(deleted.word_count) + " ваших слов"
+        userStep[uid] = 0
+    await bot.send_message(message.chat.id, hint, reply_markup=markup)
+    if sucsess:
+        await next_cards(message)
+
+
+bot.add_custom_filter(asyncio_filters.StateFilter(bot))
+
+
+async def main():
+    await open_pool()
+    known_users.update(await known_user_ids() or ())
+    start_exporter()
+    try:
+        await bot.infinity_polling(skip_pending=True)
+    finally:
+        await close_pool()
+
+
+if __name__ == '__main__':
+    print('Start telegram bot (asyncio)...')
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+Webhook entry point: the same handlers as main.py, fed by an embedded HTTP server
+instead of long polling.
+
+Every POST to WEBHOOK_PATH carries one Telegram update. It is queued on a
+ChatOrderedExecutor, so updates of one chat are handled in order while different
+chats are handled in parallel by WEBHOOK_WORKERS threads. When the queue is full
+the request is answered with 503 and Telegram delivers the update again later.
+
+Local test without Telegram (leave WEBHOOK_URL empty):
+
+    python main_webhook.py
+    curl -X POST localhost:8443/telegram -H 'Content-Type: application/json' \
+         -d '{"update_id": 1, "message": {"message_id": 1, "date": 0, "text": "/start",
+              "chat": {"id": 42, "type": "private"},
+              "from": {"id": 42, "is_bot": false, "first_name": "Test"}}}'
+"""
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from bot_common import update_chat_id
+from chat_executor import ChatOrderedExecutor
+from main import bot, warm_up
+from settings import WEBHOOK_HOST
+from settings import WEBHOOK_PORT
+from settings import WEBHOOK_PATH
+from settings import WEBHOOK_URL
+from settings import WEBHOOK_SECRET
+from settings import WEBHOOK_WORKERS
+from settings import WEBHOOK_QUEUE_SIZE
+from settings import WEBHOOK_QUEUE_TIMEOUT
+
+# Handlers run directly in the executor's workers; TeleBot's own thread pool
+# would hand them to arbitrary threads and lose the per-chat order.
+bot.threaded = False
+
+
+def process_update(update):
+    bot.process_new_updates([update])
+
+
+executor = ChatOrderedExecutor(process_update, workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_QUEUE_SIZE)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path != WEBHOOK_PATH:
+            self._reply(404)
+            return
+        if WEBHOOK_SECRET and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            self._reply(403)
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            update = types.Update.de_json(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            self._reply(400)
+            return
+        if executor.submit(update_chat_id(update), update, timeout=WEBHOOK_QUEUE_TIMEOUT):
+            self._reply(200)
+        else:
+            self._reply(503)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    warm_up()
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                        secret_token=WEBHOOK_SECRET or None,
+                        max_connections=WEBHOOK_WORKERS)
+    server = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT), WebhookHandler)
+    print(f'Start telegram bot webhook on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}...')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+In-process metrics: call counts, error counts and latency histograms per instrumented
+function, a slow-query log, and an exporter in the Prometheus text format.
+
+Functions are instrumented with the timed decorator (dict_jobs functions as kind 'query',
+bot handlers as kind 'handler'). The dict_jobs functions catch their exceptions and only
+print them, so they report errors with record_error, which charges the innermost
+instrumented call. The exporter serves /metrics on METRICS_PORT and/or rewrites
+METRICS_FILE every METRICS_FILE_INTERVAL seconds:
+
+    METRICS_PORT=9108 python main.py
+    curl localhost:9108/metrics
+"""
+import contextvars
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from settings import METRICS_HOST
+from settings import METRICS_PORT
+from settings import METRICS_FILE
+from settings import METRICS_FILE_INTERVAL
+from settings import SLOW_QUERY_LOG
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The instrumented call currently running in this thread or asyncio task.
+_current_call = contextvars.ContextVar('metrics_current_call', default=None)
+
+
+class _Series:
+    __slots__ = ('calls', 'errors', 'buckets', 'total_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total_seconds = 0.0
+
+
+class MetricsRegistry:
+    """
+    Class Purpose:
+
+    Thread-safe store of the metrics of instrumented calls, keyed by (kind, name),
+    plus gauges read from callbacks (e.g. the connection pool stats) at export time.
+    """
+
+    def __init__(self):
+        self._series = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        return series
+
+    def observe(self, kind, name, seconds, failed=False):
+        with self._lock:
+            series = self._get((kind, name))
+            series.calls += 1
+            series.errors += failed
+            series.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            series.total_seconds += seconds
+
+    def record_error(self, kind, name):
+        with self._lock:
+            self._get((kind, name)).errors += 1
+
+    def register_gauges(self, name, callback, help_text=''):
+        """callback returns a dict of numeric values, exported as name{stat="<key>"}."""
+        self._gauges[name] = (callback, help_text)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: (series.calls, series.errors, list(series.buckets), series.total_seconds)
+                    for key, series in self._series.items()}
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        snapshot = sorted(self.snapshot().items())
+        lines = ['# HELP bot_calls_total Calls of instrumented functions.',
+                 '# TYPE bot_calls_total counter']
+        lines += [f'bot_calls_total{{kind="{kind}",name="{name}"}} {calls}'
+                  for (kind, name), (calls, _, _, _) in snapshot]
+        lines += ['# HELP bot_errors_total Failed calls of instrumented functions.',
+                  '# TYPE bot_errors_total counter']
+        lines += [f'bot_errors_total{{kind="{kind}",name="{name}"}} {errors}'
+                  for (kind, name), (_, errors, _, _) in snapshot]
+        lines += ['# HELP bot_latency_seconds Latency of instrumented functions.',
+                  '# TYPE bot_latency_seconds histogram']
+        for (kind, name), (calls, _, buckets, total) in snapshot:
+            labels = f'kind="{kind}",name="{name}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'bot_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'bot_latency_seconds_bucket{{{labels},le="+Inf"}} {calls}')
+            lines.append(f'bot_latency_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'bot_latency_seconds_count{{{labels}}} {calls}')
+        for name, (callback, help_text) in sorted(self._gauges.items()):
+            lines += [f'# HELP {name} {help_text}'.rstrip(), f'# TYPE {name} gauge']
+            lines += [f'{name}{{stat="{stat}"}} {value}' for stat, value in sorted(callback().items())]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def timed(kind):
+    """
+    Decorator recording the calls, errors and latency of a function (or coroutine
+    function) under its name. An exception raised by the function counts as an error.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                token = _current_call.set((kind, name))
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    _current_call.reset(token)
+                    registry.observe(kind, name, time.perf_counter() - started, failed)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _current_call.set((kind, name))
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _current_call.reset(token)
+                registry.observe(kind, name, time.perf_counter() - started, failed)
+        return wrapper
+    return decorator
+
+
+def record_error():
+    """Counts an error that the running instrumented function handled itself."""
+    call = _current_call.get()
+    if call is not None:
+        registry.record_error(*call)
+
+
+_slow_log_lock = threading.Lock()
+
+
+def log_slow_query(sql, params, seconds):
+    call = _current_call.get()
+    caller = call[1] if call is not None else '-'
+    line = (f"{time.strftime('%Y-%m-%d %H:%M:%S')} slow query {seconds * 1000:.1f} ms in {caller}: "
+            f"{' '.join(sql.split())} params={params!r}\n")
+    with _slow_log_lock:
+        if SLOW_QUERY_LOG:
+            with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as log:
+                log.write(line)
+        else:
+            sys.stderr.write(line)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_metrics_file(path):
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as output:
+        output.write(registry.render())
+    os.replace(temporary, path)
+
+
+def _file_writer(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_metrics_file(path)
+        except OSError as ex:
+            print(f"Could not write metrics to {path}: {ex}")
+
+
+_exporter_started = False
+
+
+def start_exporter():
+    """Starts the configured exporters (METRICS_PORT, METRICS_FILE) in daemon threads, once."""
+    global _exporter_started
+    if _exporter_started:
+        return
+    _exporter_started = True
+    if METRICS_PORT:
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f'Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics')
+    if METRICS_FILE:
+        threading.Thread(target=_file_writer, args=(METRICS_FILE, METRICS_FILE_INTERVAL),
+                         name='metrics-file', daemon=True).start()
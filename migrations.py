@@ -0,0 +1,243 @@
+"""
+Versioned, non-destructive schema migrations.
+
+Every migration has a version number and is applied once; applied versions are
+recorded in the schema_migrations table. Migrations marked online run outside of
+a transaction, which CREATE INDEX CONCURRENTLY requires, so indexes are built
+without blocking writes to a live database. New migrations are appended to
+MIGRATIONS with the next version number; applied ones are never edited.
+
+    python migrations.py          # apply pending migrations
+    python migrations.py --status # list applied and pending versions
+"""
+import argparse
+import re
+from collections import namedtuple
+
+import psycopg2
+
+from settings import DB_PARAMS
+
+Migration = namedtuple('Migration', ['version', 'description', 'sql', 'online'])
+
+# Taken for the whole run, so two processes never apply migrations at the same time.
+MIGRATION_LOCK_ID = 4_172_021
+
+_CONCURRENT_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)',
+                               re.IGNORECASE)
+
+MIGRATIONS = [
+    Migration(1, 'initial schema', """
+        CREATE TABLE IF NOT EXISTS e_words(
+            id SERIAL PRIMARY KEY,
+            word VARCHAR(40) NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS r_words(
+            id SERIAL PRIMARY KEY,
+            word VARCHAR(40) NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS e_r_words(
+            id SERIAL PRIMARY KEY,
+            e_word_id INTEGER NOT NULL REFERENCES e_words(id),
+            r_word_id INTEGER NOT NULL REFERENCES r_words(id)
+        );
+        CREATE TABLE IF NOT EXISTS users(
+            user_id INTEGER PRIMARY KEY,
+            user_name VARCHAR(40) NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS user_words(
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(user_id),
+            custom_word_id INTEGER NOT NULL REFERENCES e_r_words(id)
+        );
+        CREATE TABLE IF NOT EXISTS sessions(
+            user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """, False),
+    # Pair lookups by English word (joins from e_words, the ADD_WORD pair check).
+    Migration(2, 'index e_r_words(e_word_id, r_word_id)', """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS e_r_words_e_word_id_r_word_id_idx
+        ON e_r_words (e_word_id, r_word_id)
+        """, True),
+    # Pair lookups by Russian word and the orphan checks of DELETE_WORDS.
+    Migration(3, 'index e_r_words(r_word_id)', """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS e_r_words_r_word_id_idx
+        ON e_r_words (r_word_id)
+        """, True),
+    # A user's own pairs (USER_WORD_PAIRS, DELETE_WORDS, counts) without touching the heap.
+    Migration(4, 'index user_words(user_id, custom_word_id)', """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS user_words_user_id_custom_word_id_idx
+        ON user_words (user_id, custom_word_id)
+        """, True),
+    # The visibility check of every sampled pair: any owner, and is it this user.
+    Migration(5, 'index user_words(custom_word_id, user_id)', """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS user_words_custom_word_id_user_id_idx
+        ON user_words (custom_word_id, user_id)
+        """, True),
+    # Superseded by the composite index of version 5.
+    Migration(6, 'drop index user_words(custom_word_id)', """
+        DROP INDEX CONCURRENTLY IF EXISTS user_words_custom_word_id_idx
+        """, True),
+    # Maintained by ADD_WORD and DELETE_WORDS in dict_jobs; the default needs no table rewrite.
+    Migration(7, 'users.custom_words_count', """
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS custom_words_count INTEGER NOT NULL DEFAULT 0;
+        UPDATE users u SET custom_words_count = c.total
+        FROM (select user_id, count(*) as total from user_words group by user_id) c
+        WHERE u.user_id = c.user_id and u.custom_words_count <> c.total;
+        """, False),
+    # Spaced repetition state per user and pair. The (user_id, due_at) index is the due
+    # queue: the next card is the first entry of the user's range.
+    Migration(8, 'reviews table and due queue index', """
+        CREATE TABLE IF NOT EXISTS reviews(
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            pair_id INTEGER NOT NULL REFERENCES e_r_words(id) ON DELETE CASCADE,
+            repetitions INTEGER NOT NULL DEFAULT 0,
+            interval_days REAL NOT NULL DEFAULT 0,
+            ease REAL NOT NULL DEFAULT 2.5,
+            due_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            reviewed_at TIMESTAMPTZ,
+            shown_at TIMESTAMPTZ,
+            PRIMARY KEY (user_id, pair_id)
+        );
+        CREATE INDEX IF NOT EXISTS reviews_user_id_due_at_idx ON reviews (user_id, due_at);
+        """, False),
+    # Append-only log of card answers, written in batches by answer_log.AnswerLog. No
+    # foreign keys: a batch insert should not check every row, and the statistics of a
+    # deleted pair or user are kept.
+    Migration(9, 'answers table', """
+        CREATE TABLE IF NOT EXISTS answers(
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            pair_id INTEGER,
+            answer TEXT NOT NULL,
+            correct BOOLEAN NOT NULL,
+            answered_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS answers_user_id_answered_at_idx ON answers (user_id, answered_at);
+        """, False),
+    # Telegram user IDs no longer fit in INTEGER. Widening rewrites each table (locking
+    # it meanwhile); a column that already is BIGINT is left as it is.
+    Migration(10, 'BIGINT user_id columns', """
+        ALTER TABLE users ALTER COLUMN user_id TYPE BIGINT;
+        ALTER TABLE user_words ALTER COLUMN user_id TYPE BIGINT;
+        ALTER TABLE reviews ALTER COLUMN user_id TYPE BIGINT;
+        ALTER TABLE answers ALTER COLUMN user_id TYPE BIGINT;
+        """, False),
+]
+
+
+def _ensure_version_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations(
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """)
+
+
+def applied_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("select version from schema_migrations")
+        return {row[0] for row in cur.fetchall()}
+
+
+def _drop_invalid_index(cur, sql):
+    """
+    A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind, which
+    IF NOT EXISTS would then silently accept. Drop it so the build is retried.
+    """
+    match = _CONCURRENT_INDEX.search(sql)
+    if match is None:
+        return
+    cur.execute("""
+        select 1 from pg_class c
+        join pg_index i on i.indexrelid = c.oid
+        where c.relname = %s and not i.indisvalid
+        """, (match.group(1),))
+    if cur.fetchone() is not None:
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+def migrate(conn, verbose=True):
+    """
+    Function Purpose:
+
+    Applies every migration whose version is not recorded in schema_migrations yet,
+    in version order. Regular migrations run in a transaction together with the insert
+    of their version row. Online migrations run in autocommit mode (required by
+    CREATE/DROP INDEX CONCURRENTLY) and their version is recorded afterwards; their
+    statements are idempotent, so a run interrupted between the two is safe to repeat.
+
+    Parameters:
+
+    conn: A psycopg2 connection; it is switched to autocommit mode.
+    verbose: Print every applied migration.
+    Return Value:
+
+    The list of versions applied by this run.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("select pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        _ensure_version_table(conn)
+        done = applied_versions(conn)
+        applied = []
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in done:
+                continue
+            if verbose:
+                print(f"Applying migration {migration.version}: {migration.description}")
+            with conn.cursor() as cur:
+                if migration.online:
+                    _drop_invalid_index(cur, migration.sql)
+                    cur.execute(migration.sql)
+                    cur.execute("""
+                        insert into schema_migrations (version, description)
+                        values (%s, %s)
+                        """, (migration.version, migration.description))
+                else:
+                    cur.execute("BEGIN")
+                    try:
+                        cur.execute(migration.sql)
+                        cur.execute("""
+                            insert into schema_migrations (version, description)
+                            values (%s, %s)
+                            """, (migration.version, migration.description))
+                        cur.execute("COMMIT")
+                    except Exception:
+                        cur.execute("ROLLBACK")
+                        raise
+            applied.append(migration.version)
+        return applied
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("select pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations.')
+    parser.add_argument('--status', action='store_true', help='only list applied and pending versions')
+    args = parser.parse_args()
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        if args.status:
+            conn.autocommit = True
+            _ensure_version_table(conn)
+            done = applied_versions(conn)
+            for migration in MIGRATIONS:
+                mark = 'applied' if migration.version in done else 'pending'
+                print(f"{migration.version:>4} {mark:<8} {migration.description}")
+        else:
+            applied = migrate(conn)
+            print(f"Schema is up to date ({len(applied)} migration(s) applied).")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
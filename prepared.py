@@ -0,0 +1,106 @@
+"""
+Server-side prepared statements for the hot dict_jobs queries.
+
+psycopg2 sends every query as text, which Postgres parses, analyses and plans on every
+call. A PreparedStatement is declared once at import time; the first time it runs on
+a pooled connection it is PREPAREd there, and from then on only EXECUTE name(args) is
+sent, reusing the parsed query and, after a few executions, a cached generic plan.
+Every pooled connection remembers which statements it has prepared (PreparingConnection
+is the pool's connection class). With DB_PREPARED_STATEMENTS=0 the plain query text
+is sent instead, e.g. behind pgbouncer in transaction pooling mode, which does not
+keep a session's prepared statements.
+"""
+import re
+from itertools import count
+
+from psycopg2 import errors
+from psycopg2 import extensions
+
+from settings import DB_PREPARED_STATEMENTS
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s')
+
+# Every PreparedStatement by name, so an EXECUTE can be traced back to its query.
+_statements = {}
+
+
+class PreparingConnection(extensions.connection):
+    """psycopg2 connection that keeps the names of the statements prepared in its session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class PreparedStatement:
+    """
+    Class Purpose:
+
+    A query with psycopg2 placeholders (%s or %(name)s) that is executed as a
+    server-side prepared statement. The placeholders are translated into Postgres'
+    $1, $2, ... once, and a named one used several times becomes a single parameter.
+
+    Parameters:
+
+    name: The statement name, unique within the process.
+    sql: The query text, as it would be passed to cursor.execute.
+    """
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self._keys = []
+        numbers = {}
+        positions = count()
+
+        def number(match):
+            key = match.group(1)
+            if key is None:
+                key = next(positions)
+            if key not in numbers:
+                self._keys.append(key)
+                numbers[key] = len(self._keys)
+            return f'${numbers[key]}'
+
+        self._prepare = f"PREPARE {name} AS " + _PLACEHOLDER.sub(number, sql.strip().rstrip(';'))
+        self._execute = f"EXECUTE {name}"
+        if self._keys:
+            self._execute += f" ({', '.join(['%s'] * len(self._keys))})"
+        _statements[name] = self
+
+    def prepare(self, cur):
+        """Prepares the statement in the session of the cursor's connection, unless it already is."""
+        prepared = getattr(cur.connection, 'prepared', None)
+        if not DB_PREPARED_STATEMENTS or prepared is None or self.name in prepared:
+            return
+        cur.execute(self._prepare)
+        prepared.add(self.name)
+
+    def execute(self, cur, params=()):
+        """Executes the statement like cur.execute(sql, params), preparing it first if needed."""
+        prepared = getattr(cur.connection, 'prepared', None)
+        if not DB_PREPARED_STATEMENTS or prepared is None:
+            return cur.execute(self.sql, params)
+        if self.name not in prepared:
+            self.prepare(cur)
+        try:
+            cur.execute(self._execute, [params[key] for key in self._keys])
+        except errors.InvalidSqlStatementName:
+            # The session lost its statements (e.g. DISCARD ALL); prepare them again next time.
+            prepared.clear()
+            raise
+
+
+def original_query(query, params):
+    """
+    Returns the query text and parameters as the caller passed them: for the EXECUTE
+    of a PreparedStatement, its SQL with the parameters by name (or as a list for
+    %s placeholders); any other query is returned unchanged. Used by the slow-query log.
+    """
+    if query.startswith('EXECUTE '):
+        statement = _statements.get(query.split(None, 2)[1])
+        if statement is not None and params is not None:
+            if all(isinstance(key, str) for key in statement._keys):
+                params = dict(zip(statement._keys, params))
+            return statement.sql, params
+    return query, params
@@ -0,0 +1,256 @@
+import heapq
+import threading
+import time
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+from metrics import registry
+
+# Telegram rejects longer texts, so messages are only merged while they fit.
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """
+    A token bucket: up to capacity tokens, refilled at rate tokens per second.
+    take() returns 0 when a token was taken, or the seconds until one will be available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds):
+        """Empties the bucket so that the next token is available only after seconds."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class _Outgoing:
+    __slots__ = ('text', 'reply_markup', 'queued_at', 'count')
+
+    def __init__(self, text, reply_markup, queued_at, count=1):
+        self.text = text
+        self.reply_markup = reply_markup
+        self.queued_at = queued_at
+        self.count = count
+
+
+class _Chat:
+    __slots__ = ('pending', 'bucket', 'scheduled')
+
+    def __init__(self, bucket):
+        self.pending = deque()
+        self.bucket = bucket
+        self.scheduled = False
+
+
+class OutboundQueue:
+    """
+    Class Purpose:
+
+    Sends bot messages from background threads, so handlers return as soon as their
+    reply is queued. Messages of one chat are delivered in order, one chat at a time,
+    within two token buckets: a global one for Telegram's overall limit and one per
+    chat. A chat over its limit is put aside until it has a token again instead of
+    holding a worker. A 429 answer puts the message back and pauses the chat, and all
+    sending, for the retry_after seconds Telegram asks for. At most max_pending
+    messages wait in the queue; further ones are dropped (and counted) rather than
+    let a flood grow the memory without bound. Consecutive queued messages of a chat are
+    merged into one (the keyboard of the last one wins), which both saves requests
+    and keeps the chat within its limit. Delivery counters are exported as metrics.
+
+    Parameters:
+
+    bot: The TeleBot used for sending.
+    workers: The number of sending threads.
+    global_rate, global_burst: Messages per second over all chats and the allowed burst.
+    chat_rate, chat_burst: Messages per second to one chat and the allowed burst.
+    coalesce: Merge consecutive queued messages of a chat.
+    max_pending: How many messages may wait in the queue.
+    """
+
+    def __init__(self, bot, workers=4, global_rate=30.0, global_burst=30, chat_rate=1.0, chat_burst=3,
+                 coalesce=True, max_pending=10000):
+        self.bot = bot
+        self.max_pending = max_pending
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.coalesce = coalesce
+        self._global = TokenBucket(global_rate, global_burst)
+        self._global_lock = threading.Lock()
+        self._chats = {}
+        self._ready = deque()
+        self._delayed = []
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._timer_wakeup = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._closing = False
+        self._stats = {
+            'queued': 0,
+            'messages_sent': 0,
+            'requests_sent': 0,
+            'coalesced': 0,
+            'throttled': 0,
+            'rate_limited': 0,
+            'failed': 0,
+            'dropped': 0,
+        }
+        self._threads = [threading.Thread(target=self._worker, name=f'send-queue-{number}', daemon=True)
+                         for number in range(workers)]
+        self._threads.append(threading.Thread(target=self._timer, name='send-queue-timer', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        registry.register_gauges('bot_outbound', self.stats, 'Outbound message queue counters.')
+
+    def send(self, chat_id, text, reply_markup=None):
+        """Queues a message for the chat and returns at once: True, or False if the queue is full."""
+        with self._lock:
+            if self._stats['queued'] >= self.max_pending:
+                self._stats['dropped'] += 1
+                return False
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst))
+            chat.pending.append(_Outgoing(text, reply_markup, time.monotonic()))
+            self._stats['queued'] += 1
+            if not chat.scheduled:
+                chat.scheduled = True
+                self._ready.append(chat_id)
+                self._work.notify()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self, timeout=5.0):
+        """Waits up to timeout seconds for the queued messages to be delivered."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._stats['queued'] and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+            self._closing = True
+            self._work.notify_all()
+            self._timer_wakeup.notify_all()
+
+    def _take_batch(self, chat):
+        """Pops the next message of a chat, merged with the following ones if allowed."""
+        first = chat.pending.popleft()
+        batch = _Outgoing(first.text, first.reply_markup, first.queued_at, first.count)
+        while self.coalesce and chat.pending:
+            following = chat.pending[0]
+            if len(batch.text) + 2 + len(following.text) > MAX_MESSAGE_LENGTH:
+                break
+            chat.pending.popleft()
+            batch.text += '\n\n' + following.text
+            if following.reply_markup is not None:
+                batch.reply_markup = following.reply_markup
+            batch.count += following.count
+        return batch
+
+    def _defer(self, chat_id, delay):
+        heapq.heappush(self._delayed, (time.monotonic() + delay, chat_id))
+        self._timer_wakeup.notify()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._ready and not self._closing:
+                    self._work.wait()
+                if not self._ready:
+                    return
+                chat_id = self._ready.popleft()
+                chat = self._chats[chat_id]
+                wait = chat.bucket.take()
+                if wait > 0:
+                    self._stats['throttled'] += 1
+                    self._defer(chat_id, wait)
+                    continue
+                batch = self._take_batch(chat)
+            with self._global_lock:
+                wait = self._global.take()
+                while wait > 0:
+                    time.sleep(wait)
+                    wait = self._global.take()
+            delay = self._deliver(chat_id, batch)
+            with self._lock:
+                if delay is not None:
+                    chat.pending.appendleft(batch)
+                    self._defer(chat_id, delay)
+                    continue
+                self._stats['queued'] -= batch.count
+                if chat.pending:
+                    self._ready.append(chat_id)
+                    self._work.notify()
+                else:
+                    chat.scheduled = False
+                if not self._stats['queued']:
+                    self._idle.notify_all()
+
+    def _deliver(self, chat_id, batch):
+        """Sends a batch; returns the seconds to wait before a retry, or None when done."""
+        try:
+            self.bot.send_message(chat_id, batch.text, reply_markup=batch.reply_markup)
+        except ApiTelegramException as ex:
+            if ex.error_code == 429:
+                retry_after = (ex.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                with self._lock:
+                    self._stats['rate_limited'] += 1
+                # Telegram applies the flood wait to the whole bot, not only to this chat.
+                with self._global_lock:
+                    self._global.pause(float(retry_after))
+                return float(retry_after)
+            print(f"Could not send a message to chat {chat_id}: {ex}")
+            with self._lock:
+                self._stats['failed'] += batch.count
+            return None
+        except Exception as ex:
+            print(f"Could not send a message to chat {chat_id}: {ex}")
+            with self._lock:
+                self._stats['failed'] += batch.count
+            return None
+        registry.observe('outbound', 'send_message', time.monotonic() - batch.queued_at)
+        with self._lock:
+            self._stats['requests_sent'] += 1
+            self._stats['messages_sent'] += batch.count
+            self._stats['coalesced'] += batch.count - 1
+        return None
+
+    def _timer(self):
+        """Moves deferred chats back to the ready queue and forgets idle chats."""
+        last_sweep = time.monotonic()
+        with self._lock:
+            while not self._closing:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, chat_id = heapq.heappop(self._delayed)
+                    self._ready.append(chat_id)
+                    self._work.notify()
+                if now - last_sweep > 60:
+                    last_sweep = now
+                    for chat_id in [chat_id for chat_id, chat in self._chats.items()
+                                    if not chat.scheduled and chat.bucket.full()]:
+                        del self._chats[chat_id]
+                timeout = self._delayed[0][0] - now if self._delayed else 1.0
+                self._timer_wakeup.wait(min(timeout, 1.0))
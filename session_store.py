@@ -0,0 +1,374 @@
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from telebot.storage.base_storage import StateStorageBase, StateContext
+
+from metrics import registry
+
+
+class SessionStore:
+    """
+    Class Purpose:
+
+    Keeps the per-user conversation state of the bot: the dialog step, the word being
+    added, the current card and the telebot state. A session is a JSON-serializable dict;
+    get() always returns a private copy, so changes are only visible after set().
+    """
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def set(self, user_id, session):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def update(self, user_id, **fields):
+        session = self.get(user_id)
+        session.update(fields)
+        self.set(user_id, session)
+        return session
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        self.flush()
+
+
+class Session:
+    """
+    The dialog state of one user as MemorySessionStore keeps it: fixed slots instead of
+    a dict per user, which keeps the memory of an active user small. A slot holding None
+    is not set; keys outside the slots go to extra.
+    """
+    __slots__ = ('step', 'e_word', 'buttons', 'missed', 'state', 'data', 'extra', 'last_seen')
+
+    FIELDS = ('step', 'e_word', 'buttons', 'missed', 'state', 'data')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.extra = None
+        self.last_seen = time.monotonic()
+
+    @classmethod
+    def from_dict(cls, values):
+        session = cls()
+        for key, value in values.items():
+            if key in cls.FIELDS:
+                setattr(session, key, value)
+            else:
+                if session.extra is None:
+                    session.extra = {}
+                session.extra[key] = value
+        return session
+
+    def to_dict(self):
+        values = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+        if self.extra:
+            values.update(self.extra)
+        return values
+
+
+def _deep_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(key) + _deep_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(_deep_size(item) for item in value)
+    elif isinstance(value, Session):
+        size += sum(_deep_size(getattr(value, field)) for field in Session.__slots__)
+    return size
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Class Purpose:
+
+    Sessions in this process, for a single bot process. At most max_sessions are kept;
+    the least recently active one is evicted to make room, and sessions idle for longer
+    than idle_ttl seconds are dropped. An evicted user just starts over at the card step.
+    The number of sessions, the evictions and the memory per session are exported as
+    the bot_sessions gauges.
+
+    Parameters:
+
+    max_sessions: How many sessions are kept in memory.
+    idle_ttl: Seconds without activity after which a session is dropped.
+    """
+
+    # Sessions whose size is measured for the memory per session.
+    SIZE_SAMPLE = 100
+
+    def __init__(self, max_sessions=100000, idle_ttl=86400.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted = {'evicted_lru': 0, 'evicted_idle': 0}
+        registry.register_gauges('bot_sessions', self.stats, 'Dialog sessions kept in memory.')
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return {}
+            if now - session.last_seen > self.idle_ttl:
+                del self._sessions[user_id]
+                self._evicted['evicted_idle'] += 1
+                return {}
+            session.last_seen = now
+            self._sessions.move_to_end(user_id)
+            return copy.deepcopy(session.to_dict())
+
+    def set(self, user_id, session):
+        session = Session.from_dict(copy.deepcopy(session))
+        with self._lock:
+            self._sessions[user_id] = session
+            self._sessions.move_to_end(user_id)
+            self._evict(session.last_seen)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def _evict(self, now):
+        # The sessions are in the order of their last activity, so the idle ones are in front.
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._evicted['evicted_idle'] += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self._evicted['evicted_lru'] += 1
+
+    def stats(self):
+        """
+        The number of sessions, the evictions so far, the memory per session in bytes
+        (measured on the most recently active sessions) and the estimated total,
+        including the store's own table.
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            count = len(self._sessions)
+            sample = [session for session, _ in zip(reversed(self._sessions.values()), range(self.SIZE_SAMPLE))]
+            table = sys.getsizeof(self._sessions)
+            stats = dict(self._evicted)
+        per_session = sum(_deep_size(session) for session in sample) / len(sample) if sample else 0
+        stats.update(sessions=count, bytes_per_session=round(per_session),
+                     bytes_total=round(per_session * count + table))
+        return stats
+
+
+class PostgresSessionStore(SessionStore):
+    """
+    Class Purpose:
+
+    Sessions kept in the sessions table, so several bot processes can serve the same
+    users. Hot sessions are cached in this process for cache_ttl seconds (in LRU order,
+    up to max_cached), and writes are batched: changed sessions are upserted by a
+    background thread every flush_interval seconds, or sooner once batch_size of them
+    are waiting. A session written here is read back from the pending batch until
+    it has been flushed.
+
+    Parameters:
+
+    max_cached: How many sessions are cached in this process.
+    cache_ttl: Seconds a cached session is trusted before it is re-read, which bounds
+    how long a change made by another process may go unnoticed.
+    flush_interval: Seconds between batched writes.
+    batch_size: The number of pending sessions that triggers an early write.
+    """
+
+    def __init__(self, max_cached=10000, cache_ttl=5.0, flush_interval=0.2, batch_size=500):
+        self.max_cached = max_cached
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name='session-flush', daemon=True)
+        self._flusher.start()
+
+    def get(self, user_id):
+        with self._lock:
+            if user_id in self._dirty:
+                session = self._dirty[user_id]
+                return copy.deepcopy(session) if session is not None else {}
+            cached = self._cache.get(user_id)
+            if cached is not None and time.monotonic() - cached[1] <= self.cache_ttl:
+                self._cache.move_to_end(user_id)
+                return copy.deepcopy(cached[0])
+        session = self._load(user_id)
+        if session is None:
+            return {}
+        with self._lock:
+            if user_id not in self._dirty:
+                self._remember(user_id, session)
+        return copy.deepcopy(session)
+
+    def set(self, user_id, session):
+        session = copy.deepcopy(session)
+        with self._lock:
+            self._dirty[user_id] = session
+            self._remember(user_id, session)
+            if len(self._dirty) >= self.batch_size:
+                self._wakeup.set()
+
+    def delete(self, user_id):
+        with self._lock:
+            self._dirty[user_id] = None
+            self._cache.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'cached': len(self._cache), 'pending': len(self._dirty)}
+
+    def _remember(self, user_id, session):
+        self._cache[user_id] = (session, time.monotonic())
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _load(user_id):
+        # psycopg2 and the pool are imported here, so the in-memory store works without them.
+        from db_pool import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute("""
+                        select data from sessions
+                        where user_id = %s
+                        """, (user_id,))
+                    row = cur.fetchone()
+                    return row[0] if row is not None else {}
+                except Exception as ex:
+                    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                    message = template.format(type(ex).__name__, ex.args)
+                    print(message)
+
+    def flush(self):
+        """
+        Function Purpose:
+
+        Writes all pending sessions in one transaction: changed sessions with a single
+        batched upsert and removed ones with a single delete. If the write fails, the
+        pending sessions are put back (unless they were changed again meanwhile) and
+        retried on the next flush.
+        """
+        from psycopg2.extras import Json, execute_values
+        from db_pool import get_connection
+        with self._flush_lock:
+            with self._lock:
+                pending, self._dirty = self._dirty, {}
+            if not pending:
+                return
+            changed = [(user_id, Json(session)) for user_id, session in pending.items() if session is not None]
+            removed = [user_id for user_id, session in pending.items() if session is None]
+            try:
+                with get_connection() as conn:
+                    with conn.cursor() as cur:
+                        if changed:
+                            execute_values(cur, """
+                                insert into sessions (user_id, data)
+                                values %s
+                                on conflict (user_id) do update
+                                set data = excluded.data, updated_at = now()
+                                """, changed)
+                        if removed:
+                            cur.execute("""
+                                delete from sessions
+                                where user_id = any(%s)
+                                """, (removed,))
+            except Exception as ex:
+                with self._lock:
+                    for user_id, session in pending.items():
+                        self._dirty.setdefault(user_id, session)
+                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                message = template.format(type(ex).__name__, ex.args)
+                print(message)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+
+
+def create_session_store(kind, max_sessions=100000, idle_ttl=86400.0, **options):
+    """max_sessions and idle_ttl bound the memory store; options are passed to PostgresSessionStore."""
+    if kind == 'postgres':
+        return PostgresSessionStore(**options)
+    if kind == 'memory':
+        return MemorySessionStore(max_sessions, idle_ttl)
+    raise ValueError(f"unknown session store {kind!r}")
+
+
+class SessionStateStorage(StateStorageBase):
+    """
+    Telebot state storage on top of a SessionStore, so set_state/retrieve_data keep
+    the telebot state in the same per-user session as the rest of the dialog.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def set_state(self, chat_id, user_id, state):
+        if hasattr(state, 'name'):
+            state = state.name
+        self.store.update(user_id, state=state)
+        return True
+
+    def delete_state(self, chat_id, user_id):
+        session = self.store.get(user_id)
+        if 'state' not in session:
+            return False
+        session.pop('state')
+        session.pop('data', None)
+        self.store.set(user_id, session)
+        return True
+
+    def get_state(self, chat_id, user_id):
+        return self.store.get(user_id).get('state')
+
+    def get_data(self, chat_id, user_id):
+        return self.store.get(user_id).get('data', {})
+
+    def set_data(self, chat_id, user_id, key, value):
+        session = self.store.get(user_id)
+        session.setdefault('data', {})[key] = value
+        self.store.set(user_id, session)
+        return True
+
+    def reset_data(self, chat_id, user_id):
+        self.store.update(user_id, data={})
+        return True
+
+    def get_interactive_data(self, chat_id, user_id):
+        return StateContext(self, chat_id, user_id)
+
+    def save(self, chat_id, user_id, data):
+        self.store.update(user_id, data=data)
@@ -0,0 +1,133 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+# Database connection parameters. Defaults match the local development setup.
+DB_PARAMS = {
+    'database': os.environ.get('DB_NAME', 'Telegram_English'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', 'postgres'),
+}
+if os.environ.get('DB_HOST'):
+    DB_PARAMS['host'] = os.environ['DB_HOST']
+if os.environ.get('DB_PORT'):
+    DB_PARAMS['port'] = _env_int('DB_PORT', 5432)
+
+# Storage backend (storage.py): 'postgres' uses dict_jobs on the database above,
+# 'sqlite' uses sqlite_dict_jobs on the local file SQLITE_PATH (':memory:' for a
+# throwaway database). SQLITE_BUSY_TIMEOUT is how many seconds a writer waits for another.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'postgres')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'telegram_english.sqlite3')
+SQLITE_BUSY_TIMEOUT = _env_float('SQLITE_BUSY_TIMEOUT', 5.0)
+
+# Connection pool shared by every dict_jobs function.
+DB_POOL_MIN = _env_int('DB_POOL_MIN', 1)
+DB_POOL_MAX = _env_int('DB_POOL_MAX', 10)
+# Seconds a caller may wait for a free connection before giving up.
+DB_POOL_TIMEOUT = _env_float('DB_POOL_TIMEOUT', 5.0)
+# Connections idle for longer than this are pinged before being handed out.
+DB_HEALTH_CHECK_INTERVAL = _env_float('DB_HEALTH_CHECK_INTERVAL', 30.0)
+# Read/write splitting: with DB_REPLICA_DSN set (a libpq connection string of a streaming
+# replica, e.g. "host=replica port=5433 dbname=Telegram_English user=postgres") the read-only
+# card queries go to the replica and everything else to the primary above. A user who
+# added or deleted words reads from the primary for DB_READ_YOUR_WRITES seconds afterwards,
+# so they see their change even if the replica lags behind.
+DB_REPLICA_DSN = os.environ.get('DB_REPLICA_DSN', '')
+DB_REPLICA_POOL_MAX = _env_int('DB_REPLICA_POOL_MAX', DB_POOL_MAX)
+DB_READ_YOUR_WRITES = _env_float('DB_READ_YOUR_WRITES', 5.0)
+
+# Run the hot queries as server-side prepared statements (prepared.py). Turn off
+# behind a connection pooler that does not keep session state (pgbouncer transaction mode).
+DB_PREPARED_STATEMENTS = bool(_env_int('DB_PREPARED_STATEMENTS', 1))
+
+# In-process vocabulary cache: number of per-user overlays kept and how often
+# (in seconds) the shared word snapshot is reloaded.
+VOCAB_CACHE_USERS = _env_int('VOCAB_CACHE_USERS', 10000)
+VOCAB_CACHE_TTL = _env_float('VOCAB_CACHE_TTL', 300.0)
+# Distractors that look like the answer (same beginning, length, letter combinations)
+# from an in-memory index of the shared words; 0 picks random words instead.
+SIMILAR_DISTRACTORS = bool(_env_int('SIMILAR_DISTRACTORS', 1))
+
+# Prefetched card decks: cards kept ready per user, the level that triggers
+# a background refill, how many decks are kept and the number of refill threads.
+CARD_DECK_SIZE = _env_int('CARD_DECK_SIZE', 5)
+CARD_DECK_REFILL_AT = _env_int('CARD_DECK_REFILL_AT', 2)
+CARD_DECK_USERS = _env_int('CARD_DECK_USERS', 10000)
+CARD_DECK_WORKERS = _env_int('CARD_DECK_WORKERS', 2)
+
+# Spaced repetition: seconds a card handed out by the scheduler is kept out of the
+# due queue while it waits for an answer (it comes back if it is never answered).
+REVIEW_LEASE = _env_float('REVIEW_LEASE', 600.0)
+
+# Answer log (answer_log.py): every card answer is buffered in memory and written to the
+# answers table by a background thread, ANSWER_LOG_BATCH rows per insert, every
+# ANSWER_LOG_INTERVAL_MS milliseconds or as soon as a batch is full. At most
+# ANSWER_LOG_MAX_PENDING answers are kept while the database is unavailable.
+ANSWER_LOG_BATCH = _env_int('ANSWER_LOG_BATCH', 500)
+ANSWER_LOG_INTERVAL_MS = _env_float('ANSWER_LOG_INTERVAL_MS', 200.0)
+ANSWER_LOG_MAX_PENDING = _env_int('ANSWER_LOG_MAX_PENDING', 100000)
+
+# Webhook mode (main_webhook.py). WEBHOOK_URL is the public HTTPS address Telegram
+# should call; when it is empty the webhook is not registered, which is handy for
+# local testing with hand-made updates.
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = _env_int('WEBHOOK_PORT', 8443)
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = _env_int('WEBHOOK_WORKERS', 8)
+WEBHOOK_QUEUE_SIZE = _env_int('WEBHOOK_QUEUE_SIZE', 1000)
+# Seconds a request waits for room in a full queue before answering 503.
+WEBHOOK_QUEUE_TIMEOUT = _env_float('WEBHOOK_QUEUE_TIMEOUT', 1.0)
+
+# Startup of the polling bot (main.py, backlog.py): with DRAIN_BACKLOG the updates that
+# arrived while the bot was down are fetched DRAIN_BATCH (at most 100) per getUpdates call,
+# superseded card requests are dropped and the rest are handled by DRAIN_WORKERS threads,
+# different chats in parallel, before polling starts. With 0 the backlog is skipped.
+DRAIN_BACKLOG = bool(_env_int('DRAIN_BACKLOG', 1))
+DRAIN_BATCH = _env_int('DRAIN_BATCH', 100)
+DRAIN_WORKERS = _env_int('DRAIN_WORKERS', 8)
+
+# Outbound message queue (send_queue.py): sending threads, Telegram's limits as token
+# buckets (messages per second and burst, over all chats and per chat) and whether
+# consecutive messages to one chat are merged into one.
+SEND_WORKERS = _env_int('SEND_WORKERS', 4)
+SEND_GLOBAL_RATE = _env_float('SEND_GLOBAL_RATE', 30.0)
+SEND_GLOBAL_BURST = _env_int('SEND_GLOBAL_BURST', 30)
+SEND_CHAT_RATE = _env_float('SEND_CHAT_RATE', 1.0)
+SEND_CHAT_BURST = _env_int('SEND_CHAT_BURST', 3)
+SEND_COALESCE = bool(_env_int('SEND_COALESCE', 1))
+# Messages waiting to be sent at most; more are dropped.
+SEND_QUEUE_SIZE = _env_int('SEND_QUEUE_SIZE', 10000)
+
+# Metrics (metrics.py): Prometheus text on METRICS_HOST:METRICS_PORT (0 disables) and/or
+# written to METRICS_FILE every METRICS_FILE_INTERVAL seconds. Statements slower than
+# SLOW_QUERY_MS (0 disables) are logged with their parameters to SLOW_QUERY_LOG
+# (standard error when empty).
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = _env_int('METRICS_PORT', 0)
+METRICS_FILE = os.environ.get('METRICS_FILE', '')
+METRICS_FILE_INTERVAL = _env_float('METRICS_FILE_INTERVAL', 15.0)
+SLOW_QUERY_MS = _env_float('SLOW_QUERY_MS', 200.0)
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '')
+
+# Per-user dialog sessions: 'memory' keeps them in this process, 'postgres' shares
+# them between bot processes through the sessions table.
+SESSION_STORE = os.environ.get('SESSION_STORE', 'memory')
+# The memory store keeps at most SESSION_MAX_USERS sessions and drops those idle
+# for SESSION_IDLE_TTL seconds.
+SESSION_MAX_USERS = _env_int('SESSION_MAX_USERS', 100000)
+SESSION_IDLE_TTL = _env_float('SESSION_IDLE_TTL', 86400.0)
+SESSION_CACHE_SIZE = _env_int('SESSION_CACHE_SIZE', 10000)
+SESSION_CACHE_TTL = _env_float('SESSION_CACHE_TTL', 5.0)
+SESSION_FLUSH_INTERVAL = _env_float('SESSION_FLUSH_INTERVAL', 0.2)
+SESSION_FLUSH_BATCH = _env_int('SESSION_FLUSH_BATCH', 500)
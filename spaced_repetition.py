@@ -0,0 +1,54 @@
+"""
+SM-2 spaced repetition: how the review interval of a word pair changes after an answer.
+
+The state of a pair for a user is its number of successful repetitions in a row, the
+current interval in days and the ease factor. Answers are graded 0-5 as in SM-2; the
+bot only knows whether the right button was chosen first, so it uses two grades.
+"""
+from collections import namedtuple
+
+ReviewState = namedtuple('ReviewState', ['repetitions', 'interval_days', 'ease'])
+
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+# Intervals (days) after the first and the second successful repetition.
+FIRST_INTERVAL = 1.0
+SECOND_INTERVAL = 6.0
+
+# Grades used by the bot: the right answer on the first try, or a mistake first.
+QUALITY_RECALLED = 4
+QUALITY_FORGOTTEN = 2
+
+NEW_CARD = ReviewState(0, 0.0, INITIAL_EASE)
+
+
+def next_review(state, quality):
+    """
+    Function Purpose:
+
+    Applies one SM-2 step. A grade of 3 or more is a successful repetition and grows the
+    interval (1 day, 6 days, then the previous interval times the ease factor); a lower
+    grade starts the repetitions over with a one day interval. The ease factor is
+    adjusted by the grade and never drops below MIN_EASE.
+
+    Parameters:
+
+    state: The current ReviewState of the pair, NEW_CARD if it was never reviewed.
+    quality: The grade of the answer, 0 (blackout) to 5 (perfect).
+    Return Value:
+
+    The new ReviewState; the pair is due again interval_days from now.
+    """
+    if quality >= 3:
+        if state.repetitions == 0:
+            interval = FIRST_INTERVAL
+        elif state.repetitions == 1:
+            interval = SECOND_INTERVAL
+        else:
+            interval = round(state.interval_days * state.ease, 2)
+        repetitions = state.repetitions + 1
+    else:
+        interval = FIRST_INTERVAL
+        repetitions = 0
+    ease = state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+    return ReviewState(repetitions, interval, max(MIN_EASE, round(ease, 4)))
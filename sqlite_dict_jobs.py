@@ -0,0 +1,748 @@
+"""
+Embedded SQLite counterpart of dict_jobs for small single-node deployments and tests
+(STORAGE_BACKEND=sqlite, see storage.py).
+
+The functions mirror the dict_jobs API and semantics on a local SQLite file, so no
+database server is needed and a lookup costs no network round trip. The schema is the
+one built by the Postgres migrations (timestamps are stored as Unix seconds) and is
+created on first use. The database runs in WAL mode, so readers never wait for the
+writer. Every thread keeps its own connection, whose statement cache holds the
+compiled form of each query, so the constant SQL below is prepared once per thread
+and then only re-executed. The multi-statement writes that dict_jobs does in one
+Postgres statement run here in one BEGIN IMMEDIATE transaction.
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from load_words import LoadStats
+from load_words import DEFAULT_BATCH_ROWS
+from load_words import _clean
+from metrics import record_error
+from metrics import timed
+from settings import SQLITE_PATH
+from settings import SQLITE_BUSY_TIMEOUT
+from settings import VOCAB_CACHE_USERS
+from settings import VOCAB_CACHE_TTL
+from settings import SIMILAR_DISTRACTORS
+from settings import REVIEW_LEASE
+from spaced_repetition import INITIAL_EASE
+from spaced_repetition import NEW_CARD
+from spaced_repetition import ReviewState
+from spaced_repetition import next_review
+from storage_types import Card
+from storage_types import AddWordResult
+from storage_types import DeleteWordsResult
+from storage_types import WORD_CREATED
+from storage_types import WORD_LINKED_EXISTING
+from storage_types import WORD_ALREADY_OWNED
+from storage_types import DISTRACTOR_OVERSAMPLING
+from vocab_cache import VocabularyCache
+from vocab_cache import WordCountCache
+
+# Compiled statements kept per connection; more than the number of distinct queries below.
+CACHED_STATEMENTS = 256
+
+# The tables and indexes of migrations.py. AUTOINCREMENT keeps ids from being reused
+# after a delete, like Postgres sequences; the CHECKs stand in for VARCHAR(40).
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS e_words(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        word TEXT NOT NULL UNIQUE CHECK (length(word) <= 40)
+    );
+    CREATE TABLE IF NOT EXISTS r_words(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        word TEXT NOT NULL UNIQUE CHECK (length(word) <= 40)
+    );
+    CREATE TABLE IF NOT EXISTS e_r_words(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        e_word_id INTEGER NOT NULL REFERENCES e_words(id),
+        r_word_id INTEGER NOT NULL REFERENCES r_words(id)
+    );
+    CREATE TABLE IF NOT EXISTS users(
+        user_id INTEGER PRIMARY KEY,
+        user_name TEXT NOT NULL CHECK (length(user_name) <= 40),
+        custom_words_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS user_words(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(user_id),
+        custom_word_id INTEGER NOT NULL REFERENCES e_r_words(id)
+    );
+    CREATE TABLE IF NOT EXISTS reviews(
+        user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        pair_id INTEGER NOT NULL REFERENCES e_r_words(id) ON DELETE CASCADE,
+        repetitions INTEGER NOT NULL DEFAULT 0,
+        interval_days REAL NOT NULL DEFAULT 0,
+        ease REAL NOT NULL DEFAULT """ + str(INITIAL_EASE) + """,
+        due_at REAL NOT NULL,
+        reviewed_at REAL,
+        shown_at REAL,
+        PRIMARY KEY (user_id, pair_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS answers(
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        pair_id INTEGER,
+        answer TEXT NOT NULL,
+        correct INTEGER NOT NULL,
+        answered_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS e_r_words_e_word_id_r_word_id_idx ON e_r_words(e_word_id, r_word_id);
+    CREATE INDEX IF NOT EXISTS e_r_words_r_word_id_idx ON e_r_words(r_word_id);
+    CREATE INDEX IF NOT EXISTS user_words_user_id_custom_word_id_idx ON user_words(user_id, custom_word_id);
+    CREATE INDEX IF NOT EXISTS user_words_custom_word_id_user_id_idx ON user_words(custom_word_id, user_id);
+    CREATE INDEX IF NOT EXISTS reviews_user_id_due_at_idx ON reviews(user_id, due_at);
+    CREATE INDEX IF NOT EXISTS answers_user_id_answered_at_idx ON answers(user_id, answered_at);
+"""
+
+VISIBLE_PAIR = """
+    (not exists (select 1 from user_words uw where uw.custom_word_id = erw.id)
+     or exists (select 1 from user_words uw
+                where uw.custom_word_id = erw.id and uw.user_id = :uid))
+"""
+
+PAIR_ID_RANGE = "select min(id), max(id) from e_r_words"
+
+# One id-range probe (see dict_jobs.SAMPLE_PAIRS): the first visible pair at or after
+# a random point of the id range, or failing that the first one before it.
+PAIR_AT_OR_AFTER = """
+    select erw.id, rw.word, ew.word
+    from e_r_words erw
+    join r_words rw on rw.id = erw.r_word_id
+    join e_words ew on ew.id = erw.e_word_id
+    where erw.id >= :start and """ + VISIBLE_PAIR + """
+    order by erw.id limit 1
+"""
+
+PAIR_BEFORE = """
+    select erw.id, rw.word, ew.word
+    from e_r_words erw
+    join r_words rw on rw.id = erw.r_word_id
+    join e_words ew on ew.id = erw.e_word_id
+    where erw.id < :start and """ + VISIBLE_PAIR + """
+    order by erw.id limit 1
+"""
+
+# {word} is rw.word or ew.word.
+FULL_SCAN_WORDS = """
+    select w.word
+    from (select distinct {word} as word
+          from e_r_words erw
+          join r_words rw on rw.id = erw.r_word_id
+          join e_words ew on ew.id = erw.e_word_id
+          where {word} != :avoid and """ + VISIBLE_PAIR + """) w
+    order by random() limit :count
+"""
+
+SHARED_WORD_PAIRS = """
+    select erw.id, ew.word, rw.word
+    from e_r_words erw
+    join e_words ew on ew.id = erw.e_word_id
+    join r_words rw on rw.id = erw.r_word_id
+    where not exists (select 1 from user_words uw
+                      where uw.custom_word_id = erw.id)
+"""
+
+USER_WORD_PAIRS = """
+    select erw.id, ew.word, rw.word
+    from user_words uw
+    join e_r_words erw on erw.id = uw.custom_word_id
+    join e_words ew on ew.id = erw.e_word_id
+    join r_words rw on rw.id = erw.r_word_id
+    where uw.user_id = ?
+"""
+
+INSERT_E_WORD = "insert into e_words (word) values (?) on conflict (word) do nothing"
+INSERT_R_WORD = "insert into r_words (word) values (?) on conflict (word) do nothing"
+E_WORD_ID = "select id from e_words where word = ?"
+R_WORD_ID = "select id from r_words where word = ?"
+
+PAIR_ID = """
+    select id from e_r_words
+    where e_word_id = ? and r_word_id = ?
+    order by id limit 1
+"""
+
+INSERT_PAIR = "insert into e_r_words (e_word_id, r_word_id) values (?, ?)"
+
+PAIR_OWNERS = """
+    select count(*), coalesce(sum(user_id = :uid), 0)
+    from user_words
+    where custom_word_id = :pair
+"""
+
+INSERT_OWNER = "insert into user_words (user_id, custom_word_id) values (?, ?)"
+
+USER_WORD_COUNT = "select custom_words_count from users where user_id = ?"
+
+CHANGE_USER_WORD_COUNT = """
+    update users set custom_words_count = custom_words_count + ?
+    where user_id = ?
+"""
+
+# The user's links to pairs matching one of the words, given as a JSON array.
+DELETE_TARGETS = """
+    select uw.id, erw.id, erw.e_word_id, erw.r_word_id
+    from user_words uw
+    join e_r_words erw on erw.id = uw.custom_word_id
+    join e_words ew on ew.id = erw.e_word_id
+    join r_words rw on rw.id = erw.r_word_id
+    where uw.user_id = :uid
+      and (ew.word in (select value from json_each(:words))
+           or rw.word in (select value from json_each(:words)))
+"""
+
+DELETE_OWNER = "delete from user_words where id = ?"
+
+DELETE_REVIEW = "delete from reviews where user_id = ? and pair_id = ?"
+
+# Reviews of other users go with the pair (ON DELETE CASCADE).
+DELETE_UNUSED_PAIR = """
+    delete from e_r_words
+    where id = :pair
+      and not exists (select 1 from user_words uw where uw.custom_word_id = :pair)
+"""
+
+DELETE_UNUSED_E_WORD = """
+    delete from e_words
+    where id = :id and not exists (select 1 from e_r_words where e_word_id = :id)
+"""
+
+DELETE_UNUSED_R_WORD = """
+    delete from r_words
+    where id = :id and not exists (select 1 from e_r_words where r_word_id = :id)
+"""
+
+LEASE_REVIEWS = """
+    select rv.pair_id, ew.word, rw.word
+    from reviews rv
+    join e_r_words erw on erw.id = rv.pair_id
+    join e_words ew on ew.id = erw.e_word_id
+    join r_words rw on rw.id = erw.r_word_id
+    where rv.user_id = :uid
+      and (:ahead or rv.due_at <= :now)
+      and (rv.shown_at is null or rv.shown_at < :now - :lease)
+    order by rv.due_at
+    limit :count
+"""
+
+MARK_SHOWN = "update reviews set shown_at = :now where user_id = :uid and pair_id = :pair"
+
+INTRODUCE_REVIEW = """
+    insert into reviews (user_id, pair_id, due_at, shown_at)
+    values (:uid, :pair, :now, :now)
+    on conflict (user_id, pair_id) do nothing
+"""
+
+REVIEW_STATE = """
+    select repetitions, interval_days, ease from reviews
+    where user_id = ? and pair_id = ?
+"""
+
+SAVE_REVIEW = """
+    insert into reviews (user_id, pair_id, repetitions, interval_days, ease, due_at, reviewed_at)
+    values (:uid, :pair, :repetitions, :interval, :ease, :now + :interval * 86400, :now)
+    on conflict (user_id, pair_id) do update
+    set repetitions = excluded.repetitions,
+        interval_days = excluded.interval_days,
+        ease = excluded.ease,
+        due_at = excluded.due_at,
+        reviewed_at = excluded.reviewed_at,
+        shown_at = null
+"""
+
+RELEASE_REVIEW = "update reviews set shown_at = null where user_id = ? and pair_id = ? and shown_at is not null"
+
+RECORD_ANSWER = """
+    insert into answers (user_id, pair_id, answer, correct, answered_at)
+    values (?, ?, ?, ?, ?)
+"""
+
+INSERT_USER = "insert into users (user_id, user_name) values (?, ?) on conflict (user_id) do nothing"
+
+STAGE_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS load_pairs(
+        e_word TEXT NOT NULL,
+        r_word TEXT NOT NULL
+    );
+"""
+
+LOAD_E_WORDS = "insert or ignore into e_words (word) select distinct e_word from load_pairs order by 1"
+
+LOAD_R_WORDS = "insert or ignore into r_words (word) select distinct r_word from load_pairs order by 1"
+
+LOAD_PAIRS = """
+    insert into e_r_words (e_word_id, r_word_id)
+    select distinct ew.id, rw.id
+    from load_pairs lp
+    join e_words ew on ew.word = lp.e_word
+    join r_words rw on rw.word = lp.r_word
+    where not exists (select 1 from e_r_words erw
+                      where erw.e_word_id = ew.id and erw.r_word_id = rw.id)
+"""
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _print_exception(ex):
+    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+    message = template.format(type(ex).__name__, ex.args)
+    print(message)
+    record_error()
+
+
+def connect(path=None):
+    """
+    Opens a connection in autocommit mode (transactions are begun explicitly) with WAL
+    journaling and foreign keys on, and creates the schema if it does not exist yet.
+    ':memory:' opens an in-memory database shared by the threads of the process.
+    """
+    path = path or SQLITE_PATH
+    if path == ':memory:':
+        conn = sqlite3.connect('file:dict_jobs?mode=memory&cache=shared', uri=True, isolation_level=None,
+                               timeout=SQLITE_BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=False)
+    else:
+        conn = sqlite3.connect(path, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT,
+                               cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    global _schema_ready
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(SCHEMA)
+                _schema_ready = True
+    return conn
+
+
+def get_connection():
+    """Returns this thread's connection, opening it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+
+@contextmanager
+def transaction(write=False):
+    """
+    Runs a with-block in one transaction on this thread's connection: committed when
+    the block exits normally, rolled back when it raises. A write transaction takes the
+    database write lock up front (BEGIN IMMEDIATE), so it cannot fail half way through
+    on a lock upgrade; a concurrent writer waits up to SQLITE_BUSY_TIMEOUT seconds.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _probe(conn, user_id, lo, hi):
+    params = {'uid': user_id, 'start': random.randint(lo, hi)}
+    return conn.execute(PAIR_AT_OR_AFTER, params).fetchone() or conn.execute(PAIR_BEFORE, params).fetchone()
+
+
+def _sample_pairs(conn, user_id, probes):
+    """Returns the (pair_id, r_word, e_word) rows found by probes random probes, in probe order."""
+    lo, hi = conn.execute(PAIR_ID_RANGE).fetchone()
+    if lo is None:
+        return []
+    rows = (_probe(conn, user_id, lo, hi) for _ in range(probes))
+    return [row for row in rows if row is not None]
+
+
+def _distinct_words(rows, eng_rus, word_to_avoid, count):
+    words = []
+    for row in rows:
+        word = row[1] if eng_rus else row[2]
+        if word != word_to_avoid and word not in words:
+            words.append(word)
+            if len(words) == count:
+                break
+    return words
+
+
+def _sample_words(conn, user_id, eng_rus, word_to_avoid, count):
+    """See dict_jobs._sample_words."""
+    rows = _sample_pairs(conn, user_id, count * DISTRACTOR_OVERSAMPLING)
+    words = _distinct_words(rows, eng_rus, word_to_avoid, count)
+    if len(words) < count:
+        rows = conn.execute(FULL_SCAN_WORDS.format(word='rw.word' if eng_rus else 'ew.word'),
+                            {'uid': user_id, 'avoid': word_to_avoid, 'count': count})
+        words = [row[0] for row in rows]
+    return words
+
+
+@timed('query')
+def random_word_from_base(user_id):
+    """See dict_jobs.random_word_from_base."""
+    try:
+        with transaction() as conn:
+            rows = _sample_pairs(conn, user_id, 1)
+            return (rows[0][1], rows[0][2]) if rows else None
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def random_engl_words(word_to_avoid, user_id):
+    """See dict_jobs.random_engl_words."""
+    try:
+        with transaction() as conn:
+            return _sample_words(conn, user_id, False, word_to_avoid, 4)
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def random_rus_words(word_to_avoid, user_id):
+    """See dict_jobs.random_rus_words."""
+    try:
+        with transaction() as conn:
+            return _sample_words(conn, user_id, True, word_to_avoid, 4)
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def random_cards(user_id, count, eng_rus=True, others_count=4):
+    """See dict_jobs.random_cards."""
+    per_card = others_count * DISTRACTOR_OVERSAMPLING
+    try:
+        with transaction() as conn:
+            cards = []
+            for pair_id, r_w, e_w in _sample_pairs(conn, user_id, count):
+                target_word = r_w if eng_rus else e_w
+                others = _distinct_words(_sample_pairs(conn, user_id, per_card), eng_rus,
+                                         target_word, others_count)
+                if len(others) < others_count:
+                    others = _sample_words(conn, user_id, eng_rus, target_word, others_count)
+                if eng_rus:
+                    cards.append(Card(pair_id, r_w, e_w, others))
+                else:
+                    cards.append(Card(pair_id, e_w, r_w, others))
+            return cards
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def random_card(user_id, eng_rus=True, others_count=4):
+    """See dict_jobs.random_card."""
+    cards = random_cards(user_id, 1, eng_rus, others_count)
+    return cards[0] if cards else None
+
+
+@timed('query')
+def shared_word_pairs():
+    """See dict_jobs.shared_word_pairs."""
+    try:
+        return get_connection().execute(SHARED_WORD_PAIRS).fetchall()
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def user_word_pairs(uid):
+    """See dict_jobs.user_word_pairs."""
+    try:
+        return get_connection().execute(USER_WORD_PAIRS, (uid,)).fetchall()
+    except Exception as ex:
+        _print_exception(ex)
+
+
+vocabulary = VocabularyCache(shared_word_pairs, user_word_pairs,
+                             max_users=VOCAB_CACHE_USERS, shared_ttl=VOCAB_CACHE_TTL,
+                             similar_distractors=SIMILAR_DISTRACTORS)
+word_counts = WordCountCache(max_users=VOCAB_CACHE_USERS)
+
+
+@timed('query')
+def cached_card(user_id, eng_rus=True, others_count=4):
+    """See dict_jobs.cached_card."""
+    card = vocabulary.card(user_id, eng_rus, others_count)
+    if card is None:
+        return random_card(user_id, eng_rus, others_count)
+    return Card(*card)
+
+
+@timed('query')
+def cached_cards(user_id, count, eng_rus=True, others_count=4):
+    """See dict_jobs.cached_cards."""
+    cards = []
+    for _ in range(count):
+        card = vocabulary.card(user_id, eng_rus, others_count)
+        if card is None:
+            return random_cards(user_id, count, eng_rus, others_count)
+        cards.append(Card(*card))
+    return cards
+
+
+@timed('query')
+def _lease_reviews(user_id, count, ahead):
+    try:
+        with transaction(write=True) as conn:
+            now = time.time()
+            rows = conn.execute(LEASE_REVIEWS, {'uid': user_id, 'count': count, 'ahead': ahead,
+                                                'now': now, 'lease': REVIEW_LEASE}).fetchall()
+            conn.executemany(MARK_SHOWN, [{'uid': user_id, 'pair': row[0], 'now': now} for row in rows])
+            return rows
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def _introduce_reviews(user_id, pair_ids, count):
+    try:
+        with transaction(write=True) as conn:
+            now = time.time()
+            introduced = set()
+            for pair_id in pair_ids:
+                if len(introduced) == count:
+                    break
+                if conn.execute(INTRODUCE_REVIEW, {'uid': user_id, 'pair': pair_id, 'now': now}).rowcount:
+                    introduced.add(pair_id)
+            return introduced
+    except Exception as ex:
+        _print_exception(ex)
+
+
+def _review_card(user_id, row, eng_rus, others_count):
+    pair_id, e_word, r_word = row
+    target_word, translate_word = (r_word, e_word) if eng_rus else (e_word, r_word)
+    others = vocabulary.distractors(user_id, target_word, eng_rus, others_count, translate_word)
+    if others is None:
+        others = (random_rus_words if eng_rus else random_engl_words)(target_word, user_id) or []
+    return Card(pair_id, target_word, translate_word, others)
+
+
+@timed('query')
+def scheduled_cards(user_id, count, eng_rus=True, others_count=4):
+    """See dict_jobs.scheduled_cards."""
+    rows = _lease_reviews(user_id, count, ahead=False)
+    if rows is None:
+        return None
+    cards = [_review_card(user_id, row, eng_rus, others_count) for row in rows]
+    missing = count - len(cards)
+    if missing > 0:
+        candidates = cached_cards(user_id, missing * DISTRACTOR_OVERSAMPLING, eng_rus, others_count) or []
+        candidates = list({card.pair_id: card for card in candidates}.values())
+        introduced = _introduce_reviews(user_id, [card.pair_id for card in candidates], missing) or set()
+        cards.extend(card for card in candidates if card.pair_id in introduced)
+        missing = count - len(cards)
+    if missing > 0:
+        rows = _lease_reviews(user_id, missing, ahead=True) or []
+        cards.extend(_review_card(user_id, row, eng_rus, others_count) for row in rows)
+    return cards
+
+
+@timed('query')
+def record_review(uid, pair_id, quality):
+    """See dict_jobs.record_review."""
+    try:
+        with transaction(write=True) as conn:
+            row = conn.execute(REVIEW_STATE, (uid, pair_id)).fetchone()
+            state = next_review(ReviewState(*row) if row is not None else NEW_CARD, quality)
+            conn.execute(SAVE_REVIEW, {'uid': uid, 'pair': pair_id, 'repetitions': state.repetitions,
+                                       'interval': state.interval_days, 'ease': state.ease,
+                                       'now': time.time()})
+            return state
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def release_cards(uid, pair_ids):
+    """See dict_jobs.release_cards."""
+    pair_ids = [pair_id for pair_id in pair_ids if pair_id is not None]
+    if not pair_ids:
+        return 0
+    try:
+        with transaction(write=True) as conn:
+            return conn.executemany(RELEASE_REVIEW, [(uid, pair_id) for pair_id in pair_ids]).rowcount
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def record_answers(rows):
+    """See dict_jobs.record_answers."""
+    try:
+        with transaction(write=True) as conn:
+            conn.executemany(RECORD_ANSWER, rows)
+            return len(rows)
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def if_user_not_exist(user_id):
+    """See dict_jobs.if_user_not_exist."""
+    try:
+        if get_connection().execute("select 1 from users where user_id = ?", (user_id,)).fetchone() is None:
+            return True
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def known_user_ids():
+    """See dict_jobs.known_user_ids."""
+    try:
+        return [row[0] for row in get_connection().execute("select user_id from users")]
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def add_user(user_id, user_name):
+    """See dict_jobs.add_user."""
+    try:
+        with transaction(write=True) as conn:
+            return conn.execute(INSERT_USER, (user_id, user_name)).rowcount > 0
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def add_word_to_dict(uid, word_e, word_r):
+    """
+    See dict_jobs.add_word_to_dict. The steps of ADD_WORD run as separate statements
+    in one write transaction, which no other writer can interleave with, so the retry
+    needed for a concurrent insert in Postgres is not needed here.
+    """
+    try:
+        with transaction(write=True) as conn:
+            conn.execute(INSERT_E_WORD, (word_e,))
+            conn.execute(INSERT_R_WORD, (word_r,))
+            e_id = conn.execute(E_WORD_ID, (word_e,)).fetchone()[0]
+            r_id = conn.execute(R_WORD_ID, (word_r,)).fetchone()[0]
+            row = conn.execute(PAIR_ID, (e_id, r_id)).fetchone()
+            if row is None:
+                pair_id = conn.execute(INSERT_PAIR, (e_id, r_id)).lastrowid
+                status = WORD_CREATED
+            else:
+                pair_id = row[0]
+                total, mine = conn.execute(PAIR_OWNERS, {'uid': uid, 'pair': pair_id}).fetchone()
+                status = WORD_LINKED_EXISTING if total > 0 and mine == 0 else WORD_ALREADY_OWNED
+            if status != WORD_ALREADY_OWNED:
+                conn.execute(INSERT_OWNER, (uid, pair_id))
+                conn.execute(CHANGE_USER_WORD_COUNT, (1, uid))
+            count = conn.execute(USER_WORD_COUNT, (uid,)).fetchone()
+        result = AddWordResult(status, pair_id, count[0] if count is not None else None)
+        if result.status != WORD_ALREADY_OWNED:
+            vocabulary.invalidate_user(uid)
+        word_counts.put(uid, result.word_count)
+        return result
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def delete_words_from_dict(uid, words):
+    """
+    See dict_jobs.delete_words_from_dict. The CTEs of DELETE_WORDS become separate
+    statements of one write transaction: the user's links are removed first, then the
+    matched pairs nobody is linked to any more, then their words if no pair uses them.
+    """
+    try:
+        with transaction(write=True) as conn:
+            targets = conn.execute(DELETE_TARGETS, {'uid': uid, 'words': json.dumps(list(words))}).fetchall()
+            conn.executemany(DELETE_OWNER, [(owner_id,) for owner_id, _, _, _ in targets])
+            pairs = {pair_id: (e_id, r_id) for _, pair_id, e_id, r_id in targets}
+            conn.executemany(DELETE_REVIEW, [(uid, pair_id) for pair_id in pairs])
+            for pair_id, (e_id, r_id) in pairs.items():
+                if conn.execute(DELETE_UNUSED_PAIR, {'pair': pair_id}).rowcount:
+                    conn.execute(DELETE_UNUSED_E_WORD, {'id': e_id})
+                    conn.execute(DELETE_UNUSED_R_WORD, {'id': r_id})
+            if targets:
+                conn.execute(CHANGE_USER_WORD_COUNT, (-len(targets), uid))
+            count = conn.execute(USER_WORD_COUNT, (uid,)).fetchone()
+        result = DeleteWordsResult(len(targets), count[0] if count is not None else None)
+        if result.removed:
+            vocabulary.invalidate_user(uid)
+        word_counts.put(uid, result.word_count)
+        return result
+    except Exception as ex:
+        _print_exception(ex)
+
+
+@timed('query')
+def delete_word_from_dict(uid, word_e):
+    """See dict_jobs.delete_word_from_dict."""
+    result = delete_words_from_dict(uid, [word_e])
+    return bool(result and result.removed)
+
+
+@timed('query')
+def custom_words_user_count(uid):
+    """See dict_jobs.custom_words_user_count."""
+    count = word_counts.get(uid)
+    if count is not None:
+        return str(count)
+    try:
+        row = get_connection().execute(USER_WORD_COUNT, (uid,)).fetchone()
+        count = row[0] if row is not None else 0
+        word_counts.put(uid, count)
+        return str(count)
+    except Exception as ex:
+        _print_exception(ex)
+
+
+def load_word_pairs(pairs, batch_rows=DEFAULT_BATCH_ROWS, report=None):
+    """
+    See load_words.load_word_pairs: the same batches and set-based inserts, with the
+    staging table filled by executemany instead of COPY.
+    """
+    stats = {'rows': 0, 'rejected': 0, 'e_words': 0, 'r_words': 0, 'pairs': 0}
+    started = time.perf_counter()
+    conn = get_connection()
+    conn.executescript(STAGE_TABLE)
+    batch = []
+    pairs = iter(pairs)
+    while True:
+        batch.clear()
+        for e_word, r_word in pairs:
+            stats['rows'] += 1
+            e_word, r_word = _clean(e_word), _clean(r_word)
+            if e_word is None or r_word is None:
+                stats['rejected'] += 1
+                continue
+            batch.append((e_word, r_word))
+            if len(batch) == batch_rows:
+                break
+        if not batch:
+            break
+        with transaction(write=True):
+            conn.execute("DELETE FROM load_pairs")
+            conn.executemany("insert into load_pairs (e_word, r_word) values (?, ?)", batch)
+            stats['e_words'] += conn.execute(LOAD_E_WORDS).rowcount
+            stats['r_words'] += conn.execute(LOAD_R_WORDS).rowcount
+            stats['pairs'] += conn.execute(LOAD_PAIRS).rowcount
+        if report is not None:
+            report(LoadStats(seconds=time.perf_counter() - started, **stats))
+    return LoadStats(seconds=time.perf_counter() - started, **stats)
+
+
+def warm_up():
+    """See dict_jobs.warm_up: opens this thread's connection and loads the vocabulary cache."""
+    try:
+        get_connection()
+    except Exception as ex:
+        _print_exception(ex)
+        return
+    rows = shared_word_pairs()
+    if rows is not None:
+        vocabulary.put_shared(rows)
@@ -0,0 +1,64 @@
+"""
+Storage backend selection.
+
+The bot reaches the database only through the functions listed in STORAGE_API, which
+form the storage interface: dict_jobs implements it on Postgres and sqlite_dict_jobs
+on an embedded SQLite file. STORAGE_BACKEND in settings.py picks the implementation
+once at import time, and this module re-exports its functions under the same names:
+
+    from storage import scheduled_cards
+    STORAGE_BACKEND=sqlite python main.py
+"""
+import importlib
+
+from settings import STORAGE_BACKEND
+
+BACKENDS = {
+    'postgres': 'dict_jobs',
+    'sqlite': 'sqlite_dict_jobs',
+}
+
+STORAGE_API = (
+    'random_word_from_base', 'random_engl_words', 'random_rus_words',
+    'random_cards', 'random_card', 'cached_card', 'cached_cards',
+    'shared_word_pairs', 'user_word_pairs', 'scheduled_cards', 'release_cards', 'record_review', 'record_answers',
+    'if_user_not_exist', 'known_user_ids', 'add_user',
+    'add_word_to_dict', 'delete_words_from_dict', 'delete_word_from_dict',
+    'custom_words_user_count', 'warm_up',
+)
+
+
+def load_backend(name):
+    """Imports the backend module registered under name and checks that it implements STORAGE_API."""
+    if name not in BACKENDS:
+        raise ValueError(f"unknown storage backend {name!r}, expected one of {sorted(BACKENDS)}")
+    module = importlib.import_module(BACKENDS[name])
+    missing = [function for function in STORAGE_API if not callable(getattr(module, function, None))]
+    if missing:
+        raise TypeError(f"storage backend {name!r} does not implement {missing}")
+    return module
+
+
+backend = load_backend(STORAGE_BACKEND)
+
+random_word_from_base = backend.random_word_from_base
+random_engl_words = backend.random_engl_words
+random_rus_words = backend.random_rus_words
+random_cards = backend.random_cards
+random_card = backend.random_card
+cached_card = backend.cached_card
+cached_cards = backend.cached_cards
+shared_word_pairs = backend.shared_word_pairs
+user_word_pairs = backend.user_word_pairs
+scheduled_cards = backend.scheduled_cards
+release_cards = backend.release_cards
+record_review = backend.record_review
+record_answers = backend.record_answers
+if_user_not_exist = backend.if_user_not_exist
+known_user_ids = backend.known_user_ids
+add_user = backend.add_user
+add_word_to_dict = backend.add_word_to_dict
+delete_words_from_dict = backend.delete_words_from_dict
+delete_word_from_dict = backend.delete_word_from_dict
+custom_words_user_count = backend.custom_words_user_count
+warm_up = backend.warm_up
@@ -0,0 +1,19 @@
+"""
+Result types and constants shared by the storage backends (dict_jobs, sqlite_dict_jobs,
+async_dict_jobs) and the bots. Importing them needs no database driver.
+"""
+from collections import namedtuple
+
+Card = namedtuple('Card', ['pair_id', 'target_word', 'translate_word', 'other_words'])
+AddWordResult = namedtuple('AddWordResult', ['status', 'pair_id', 'word_count'])
+DeleteWordsResult = namedtuple('DeleteWordsResult', ['removed', 'word_count'])
+
+# add_word_to_dict statuses: a new pair was created for the user, an existing pair
+# of other users was linked to the user, or the user already sees this pair.
+WORD_CREATED = 'created'
+WORD_LINKED_EXISTING = 'linked-existing'
+WORD_ALREADY_OWNED = 'already-owned'
+
+# How many probes are spent per requested distractor. Probes may land on the same
+# pair or on duplicate words, so a few spare ones are drawn.
+DISTRACTOR_OVERSAMPLING = 3
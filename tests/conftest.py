@@ -0,0 +1,38 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite_dict_jobs  # noqa: E402
+from vocab_cache import VocabularyCache, WordCountCache  # noqa: E402
+
+SHARED_PAIRS = [('apple', 'яблоко'), ('pear', 'груша'), ('plum', 'слива'), ('cherry', 'вишня'),
+                ('grape', 'виноград'), ('lemon', 'лимон'), ('peach', 'персик'), ('melon', 'дыня')]
+
+
+def wait_until(predicate, timeout=2.0):
+    """Polls predicate until it is true; used to wait for the background threads under test."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out waiting for the background threads')
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """The SQLite backend on a fresh database file with the SHARED_PAIRS vocabulary."""
+    monkeypatch.setattr(sqlite_dict_jobs, 'SQLITE_PATH', str(tmp_path / 'bot.db'))
+    monkeypatch.setattr(sqlite_dict_jobs, '_schema_ready', False)
+    monkeypatch.setattr(sqlite_dict_jobs, '_local', threading.local())
+    monkeypatch.setattr(sqlite_dict_jobs, 'vocabulary',
+                        VocabularyCache(sqlite_dict_jobs.shared_word_pairs, sqlite_dict_jobs.user_word_pairs,
+                                        similar_distractors=False))
+    monkeypatch.setattr(sqlite_dict_jobs, 'word_counts', WordCountCache())
+    sqlite_dict_jobs.load_word_pairs(SHARED_PAIRS)
+    yield sqlite_dict_jobs
+    sqlite_dict_jobs.get_connection().close()
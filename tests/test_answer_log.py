@@ -0,0 +1,135 @@
+import threading
+
+from answer_log import AnswerLog
+
+from conftest import wait_until
+
+
+class Writer:
+    """Stores the batches it is given, or fails while failing is set."""
+
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self.lock:
+            if self.failing:
+                return None
+            self.batches.append(list(rows))
+            return len(rows)
+
+    def rows(self):
+        with self.lock:
+            return [row for batch in self.batches for row in batch]
+
+
+def test_events_are_written_in_batches_by_the_background_thread():
+    writer = Writer()
+    log = AnswerLog(writer, batch_size=2, flush_interval=0.01)
+    try:
+        for number in range(5):
+            log.record(1, number, f'answer {number}', number % 2 == 0)
+        wait_until(lambda: len(writer.rows()) == 5)
+    finally:
+        log.close()
+
+    assert [row[:4] for row in writer.rows()] == [(1, n, f'answer {n}', n % 2 == 0) for n in range(5)]
+    assert all(len(batch) <= 2 for batch in writer.batches)
+    stats = log.stats()
+    assert stats['recorded'] == stats['written'] == 5
+    assert stats['pending'] == 0
+
+
+def test_close_writes_what_is_left():
+    writer = Writer()
+    log = AnswerLog(writer, flush_interval=60)
+    log.record(1, 2, 'apple', True)
+    log.close()
+
+    assert [row[:4] for row in writer.rows()] == [(1, 2, 'apple', True)]
+
+
+def test_failed_writes_are_retried_in_order():
+    writer = Writer()
+    writer.failing = True
+    log = AnswerLog(writer, batch_size=2, flush_interval=60)
+    try:
+        for number in range(3):
+            log.record(1, number, 'answer', True)
+        log.flush()
+        assert writer.rows() == []
+        assert log.stats()['failed_batches'] == 1
+        assert log.stats()['pending'] == 3
+
+        log.record(1, 3, 'answer', True)
+        writer.failing = False
+        log.flush()
+    finally:
+        log.close()
+
+    assert [row[1] for row in writer.rows()] == [0, 1, 2, 3]
+    assert log.stats()['written'] == 4
+
+
+def test_a_writer_exception_is_retried_like_a_failed_write():
+    rows = []
+
+    def writer(batch):
+        if not rows:
+            rows.append('failed once')
+            raise ConnectionError('no connection')
+        rows.extend(batch)
+        return len(batch)
+
+    log = AnswerLog(writer, flush_interval=60)
+    try:
+        log.record(1, 2, 'apple', True)
+        log.flush()
+        assert log.stats()['failed_batches'] == 1
+        log.flush()
+    finally:
+        log.close()
+
+    assert [row[:4] for row in rows[1:]] == [(1, 2, 'apple', True)]
+    assert log.stats()['written'] == 1
+
+
+def test_the_oldest_events_are_dropped_while_the_database_is_unavailable():
+    writer = Writer()
+    writer.failing = True
+    log = AnswerLog(writer, batch_size=10, flush_interval=60, max_pending=3)
+    try:
+        for number in range(5):
+            log.record(1, number, 'answer', True)
+        log.flush()
+        writer.failing = False
+        log.flush()
+    finally:
+        log.close()
+
+    assert [row[1] for row in writer.rows()] == [2, 3, 4]
+    stats = log.stats()
+    assert stats['recorded'] == 5
+    assert stats['dropped'] == 2
+    assert stats['written'] == 3
+
+
+def test_events_recorded_while_a_write_fails_count_towards_max_pending():
+    writer = Writer()
+    writer.failing = True
+    log = AnswerLog(writer, batch_size=10, flush_interval=60, max_pending=3)
+    try:
+        log.record(1, 0, 'answer', True)
+        log.record(1, 1, 'answer', True)
+        log.flush()
+        for number in range(2, 4):
+            log.record(1, number, 'answer', True)
+        writer.failing = False
+        log.flush()
+    finally:
+        log.close()
+
+    assert [row[1] for row in writer.rows()] == [1, 2, 3]
+    assert log.stats()['dropped'] == 1
@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+
+pytest.importorskip('telebot')
+
+from telebot import TeleBot, types  # noqa: E402
+
+from backlog import BacklogDrain, collapse, is_answer, requests_card, stale_answers  # noqa: E402
+from bot_common import Command  # noqa: E402
+
+
+def update(update_id, chat_id, text):
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'text': text,
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'}},
+    })
+
+
+def texts(updates):
+    return [(u.message.chat.id, u.message.text) for u in updates]
+
+
+class BacklogBot(TeleBot):
+    """A TeleBot whose getUpdates serves a fixed backlog."""
+
+    def __init__(self, backlog):
+        super().__init__('1:test')
+        self.backlog = backlog
+        self.calls = 0
+
+    def get_updates(self, offset=None, limit=None, *args, **kwargs):
+        self.calls += 1
+        return [u for u in self.backlog if u.update_id >= offset][:limit]
+
+
+def test_requests_card():
+    assert requests_card(update(1, 1, '/start'))
+    assert requests_card(update(2, 1, '/cards'))
+    assert requests_card(update(3, 1, Command.NEXT))
+    assert not requests_card(update(4, 1, 'apple'))
+    assert not requests_card(update(5, 1, Command.ADD_WORD))
+
+
+def test_collapse_drops_card_requests_superseded_by_the_next_one_of_the_chat():
+    updates = [update(1, 1, '/start'), update(2, 2, '/start'), update(3, 1, Command.NEXT),
+               update(4, 1, 'apple'), update(5, 1, Command.NEXT), update(6, 1, Command.NEXT)]
+
+    assert texts(collapse(updates)) == [(2, '/start'), (1, Command.NEXT), (1, 'apple'), (1, Command.NEXT)]
+
+
+def test_is_answer():
+    assert is_answer(update(1, 1, 'apple'))
+    assert not is_answer(update(2, 1, '/start'))
+    assert not is_answer(update(3, 1, Command.NEXT))
+    assert not is_answer(update(4, 1, Command.DELETE_WORD))
+
+
+def test_stale_answers_are_the_leading_answers_of_users_without_a_card():
+    updates = [update(1, 1, 'apple'), update(2, 1, 'pear'), update(3, 1, Command.NEXT), update(4, 1, 'plum'),
+               update(5, 2, 'apple'), update(6, 3, '/start'), update(7, 3, 'apple')]
+
+    assert stale_answers(updates, needs_card=lambda user_id: user_id != 2) == {1, 2}
+
+
+def test_stale_answers_collapse_like_card_requests():
+    updates = [update(1, 1, 'apple'), update(2, 1, 'pear'), update(3, 1, Command.NEXT), update(4, 2, 'apple')]
+
+    assert texts(collapse(updates, stale={1, 2, 4})) == [(1, Command.NEXT), (2, 'apple')]
+
+
+def test_drain_handles_the_backlog_in_chat_order_and_moves_polling_past_it():
+    backlog = []
+    for chat_id in range(1, 6):
+        for text in ['/start', Command.NEXT, 'apple', 'pear', Command.NEXT, '/cards']:
+            backlog.append(update(len(backlog) + 1, chat_id, text))
+    bot = BacklogBot(backlog)
+    seen = {}
+    lock = threading.Lock()
+
+    @bot.message_handler(func=lambda message: True)
+    def handle(message):
+        with lock:
+            seen.setdefault(message.chat.id, []).append(message.text)
+
+    stats = BacklogDrain(bot, workers=3, batch_size=7).run()
+
+    assert bot.last_update_id == len(backlog)
+    assert bot.threaded
+    assert bot.calls == 5
+    assert stats['fetched'] == 30
+    assert stats['superseded'] == 10
+    assert stats['processed'] == 20
+    assert stats['chats'] == 5
+    assert seen == {chat_id: [Command.NEXT, 'apple', 'pear', '/cards'] for chat_id in range(1, 6)}
+
+
+def test_updates_fetched_before_an_error_are_still_handled():
+    class FailingBot(BacklogBot):
+        def get_updates(self, offset=None, limit=None, *args, **kwargs):
+            if self.calls:
+                raise ConnectionError('network down')
+            return super().get_updates(offset, limit)
+
+    bot = FailingBot([update(i, 1, 'apple') for i in range(1, 4)])
+    handled = []
+    bot.message_handler(func=lambda message: True)(handled.append)
+
+    stats = BacklogDrain(bot, batch_size=2).run()
+
+    assert stats['processed'] == 2
+    assert len(handled) == 2
+    assert bot.last_update_id == 2
+
+
+def test_a_stale_answer_gets_a_fresh_card_instead_of_the_handlers():
+    bot = BacklogBot([update(1, 1, 'apple'), update(2, 2, 'pear'), update(3, 2, 'plum')])
+    handled, cards = [], []
+    bot.message_handler(func=lambda message: True)(lambda message: handled.append(message.text))
+
+    stats = BacklogDrain(bot, needs_card=lambda user_id: user_id == 1,
+                         send_card=lambda message: cards.append(message.text)).run()
+
+    assert cards == ['apple']
+    assert handled == ['pear', 'plum']
+    assert stats['stale_answers'] == 1
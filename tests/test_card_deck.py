@@ -0,0 +1,127 @@
+import threading
+from collections import namedtuple
+
+from card_deck import CardDeck
+
+from conftest import wait_until
+
+Card = namedtuple('Card', ['pair_id', 'target_word', 'translate_word', 'other_words'])
+
+
+class CardSource:
+    """Builds numbered cards and records the (user_id, count) of every call; refills wait for gate."""
+
+    def __init__(self):
+        self.calls = []
+        self.built = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, user_id, count):
+        self.calls.append((user_id, count))
+        if count > 1:
+            # Only background refills wait; the first card is built at once.
+            self.gate.wait()
+        cards = []
+        for _ in range(count):
+            self.built += 1
+            cards.append(Card(self.built, f'word{self.built}', f'слово{self.built}', []))
+        return cards
+
+
+def refilled(deck):
+    wait_until(lambda: not deck._pending)
+
+
+def test_first_card_is_built_at_once_and_the_deck_refilled_in_background():
+    source = CardSource()
+    deck = CardDeck(source, size=3, refill_at=1)
+
+    assert deck.next_card(1).pair_id == 1
+    refilled(deck)
+    # The next cards come from the deck, in the order they were built.
+    assert [deck.next_card(1).pair_id for _ in range(2)] == [2, 3]
+    assert source.calls[:2] == [(1, 1), (1, 3)]
+    assert source.calls.count((1, 1)) == 1
+
+
+def test_invalidate_drops_the_prefetched_cards():
+    source = CardSource()
+    deck = CardDeck(source, size=3, refill_at=0)
+    deck.next_card(1)
+    refilled(deck)
+
+    deck.invalidate(1)
+    deck.next_card(1)
+    assert source.calls.count((1, 1)) == 2
+
+
+def test_refill_running_during_an_invalidation_is_discarded():
+    source = CardSource()
+    deck = CardDeck(source, size=3, refill_at=0)
+    source.gate.clear()
+    deck.next_card(1)
+    wait_until(lambda: (1, 3) in source.calls)
+
+    deck.invalidate(1)
+    source.gate.set()
+    refilled(deck)
+    deck.next_card(1)
+    assert source.calls.count((1, 1)) == 2
+
+
+def test_invalidating_another_user_keeps_the_refill():
+    source = CardSource()
+    deck = CardDeck(source, size=3, refill_at=0)
+    source.gate.clear()
+    deck.next_card(1)
+    wait_until(lambda: (1, 3) in source.calls)
+
+    deck.invalidate(2)
+    source.gate.set()
+    refilled(deck)
+    assert deck.next_card(1).pair_id == 2
+    assert source.calls.count((1, 1)) == 1
+
+
+def test_refill_worker_survives_a_failing_card_source():
+    source = CardSource()
+    failures = ['database down']
+
+    def card_source(user_id, count):
+        if count > 1 and failures:
+            raise RuntimeError(failures.pop())
+        return source(user_id, count)
+
+    deck = CardDeck(card_source, size=3, refill_at=0, workers=1)
+    deck.next_card(1)
+    refilled(deck)
+    # The failed refill left no deck; the same worker builds it on the next request.
+    deck.next_card(1)
+    refilled(deck)
+    assert [deck.next_card(1).pair_id for _ in range(2)] == [3, 4]
+
+
+def test_least_recently_used_decks_are_dropped():
+    source = CardSource()
+    deck = CardDeck(source, size=2, refill_at=0, max_users=1)
+    deck.next_card(1)
+    refilled(deck)
+    deck.next_card(2)
+    refilled(deck)
+
+    deck.next_card(1)
+    assert source.calls.count((1, 1)) == 2
+
+
+def test_cards_thrown_away_unseen_are_released():
+    source = CardSource()
+    released = []
+    deck = CardDeck(source, size=3, refill_at=0,
+                    release=lambda user_id, pair_ids: released.append((user_id, pair_ids)))
+    deck.next_card(1)
+    refilled(deck)
+
+    deck.invalidate(1)
+    wait_until(lambda: released)
+    assert released == [(1, [2, 3, 4])]
@@ -0,0 +1,63 @@
+import random
+import threading
+import time
+
+from chat_executor import ChatOrderedExecutor
+
+from conftest import wait_until
+
+
+def test_items_of_a_chat_run_in_order_and_chats_in_parallel():
+    handled = {}
+    running = []
+    overlap = []
+    lock = threading.Lock()
+
+    def handler(item):
+        chat_id, number = item
+        with lock:
+            running.append(chat_id)
+            overlap.append(len(running))
+        time.sleep(random.random() / 1000)
+        with lock:
+            running.remove(chat_id)
+            handled.setdefault(chat_id, []).append(number)
+
+    executor = ChatOrderedExecutor(handler, workers=4)
+    for number in range(20):
+        for chat_id in range(5):
+            executor.submit(chat_id, (chat_id, number))
+    executor.join()
+    executor.shutdown()
+
+    assert handled == {chat_id: list(range(20)) for chat_id in range(5)}
+    assert max(overlap) > 1
+
+
+def test_a_failing_item_does_not_stop_its_chat():
+    handled = []
+
+    def handler(item):
+        if item == 'bad':
+            raise ValueError(item)
+        handled.append(item)
+
+    executor = ChatOrderedExecutor(handler, workers=2)
+    for item in ('first', 'bad', 'last'):
+        executor.submit(1, item)
+    executor.join()
+    executor.shutdown()
+
+    assert handled == ['first', 'last']
+
+
+def test_submit_gives_up_when_max_pending_items_wait():
+    release = threading.Event()
+    executor = ChatOrderedExecutor(lambda item: release.wait(), workers=1, max_pending=1)
+
+    assert executor.submit(1, 'a')
+    assert not executor.submit(2, 'b', timeout=0.01)
+    release.set()
+    wait_until(lambda: executor.submit(2, 'b', timeout=0.01))
+    executor.join()
+    executor.shutdown()
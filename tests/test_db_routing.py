@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import db_pool  # noqa: E402
+from db_pool import ReadYourWrites  # noqa: E402
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    """Placeholder primary and replica pools, fresh routing counters and recent writers."""
+    monkeypatch.setattr(db_pool, '_pool', 'primary')
+    monkeypatch.setattr(db_pool, '_replica_pool', 'replica')
+    monkeypatch.setattr(db_pool, 'recent_writers', ReadYourWrites(60))
+    monkeypatch.setattr(db_pool, '_routing', {'primary_reads': 0, 'replica_reads': 0, 'recent_writer_reads': 0})
+
+
+def test_recent_writers_expire_after_the_window():
+    writers = ReadYourWrites(0.05)
+    writers.wrote(1)
+    assert writers.recent(1)
+    assert not writers.recent(2)
+    time.sleep(0.06)
+    assert not writers.recent(1)
+    assert len(writers) == 0
+
+
+def test_writes_go_to_the_primary_and_reads_to_the_replica(pools):
+    assert db_pool._pool_for(False, 1) == 'primary'
+    assert db_pool._pool_for(True, 1) == 'replica'
+    assert db_pool._pool_for(True, None) == 'replica'
+
+
+def test_reads_of_a_recent_writer_go_to_the_primary(pools):
+    db_pool.recent_writers.wrote(1)
+
+    assert db_pool._pool_for(True, 1) == 'primary'
+    assert db_pool._pool_for(True, 2) == 'replica'
+    assert db_pool.routing_stats() == {'primary_reads': 0, 'replica_reads': 1, 'recent_writer_reads': 1,
+                                       'recent_writers': 1}
+
+
+def test_without_a_replica_every_read_goes_to_the_primary(pools, monkeypatch):
+    monkeypatch.setattr(db_pool, '_replica_pool', None)
+    monkeypatch.setattr(db_pool, 'DB_REPLICA_DSN', '')
+
+    assert db_pool._pool_for(True, 1) == 'primary'
+    assert db_pool.routing_stats()['primary_reads'] == 1
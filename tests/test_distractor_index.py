@@ -0,0 +1,40 @@
+from distractor_index import DistractorIndex
+
+SIMILAR = {'apply', 'applet', 'apples', 'ample'}
+OTHERS = {'zebra', 'kiwi', 'banana', 'orange', 'cherry', 'melon'}
+
+
+def _index(words):
+    index = DistractorIndex()
+    index.sync(words)
+    return index
+
+
+def test_picks_words_that_look_like_the_answer():
+    index = _index(SIMILAR | OTHERS | {'apple'})
+    for _ in range(20):
+        picked = index.similar('apple', 2)
+        assert len(picked) == 2
+        assert set(picked) <= SIMILAR
+
+
+def test_never_returns_the_answer_its_spelling_variants_or_excluded_words():
+    index = _index(SIMILAR | {'apple', 'Apple'})
+    for _ in range(20):
+        picked = index.similar('apple', 4, exclude={'apply'})
+        assert picked
+        assert set(picked) <= SIMILAR - {'apply'}
+
+
+def test_extra_words_outside_the_index_are_candidates():
+    index = _index(OTHERS)
+    assert index.similar('apple', 1, extra=['apples']) == ['apples']
+
+
+def test_sync_adds_new_words_and_drops_removed_ones():
+    index = _index({'apply', 'zebra'})
+    index.sync({'apply', 'ample'})
+
+    assert len(index) == 2
+    assert 'zebra' not in index
+    assert sorted(index.similar('apple', 4)) == ['ample', 'apply']
@@ -0,0 +1,63 @@
+import json
+import os
+import random
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def load_test():
+    pytest.importorskip('psycopg2')
+    pytest.importorskip('telebot')
+    with pytest.MonkeyPatch.context() as patch:
+        # The harness points PGOPTIONS at its own schema when imported; undone afterwards.
+        patch.setenv('PGOPTIONS', os.environ.get('PGOPTIONS', ''))
+        from benchmarks import load_test
+    return load_test
+
+
+def test_percentile_picks_the_sample_at_the_fraction(load_test):
+    samples = list(range(1, 101))
+    assert load_test.percentile(samples, 0.50) == 51
+    assert load_test.percentile(samples, 0.99) == 100
+    assert load_test.percentile([7], 0.95) == 7
+
+
+def test_timed_counts_calls_and_none_results_as_errors(load_test):
+    stats = load_test.LatencyStats()
+    query = load_test.timed(stats, 'query', lambda value: value)
+
+    assert query(1) == 1
+    assert query(None) is None
+    assert stats.total() == 2
+    assert stats._errors == {'query': 1}
+
+
+def test_fake_telegram_remembers_the_last_keyboard_of_a_chat(load_test):
+    telegram = load_test.FakeTelegram()
+    markup = json.dumps({'keyboard': [[{'text': 'apple'}, {'text': 'pear'}], [{'text': 'Next'}]]})
+
+    response = telegram('post', 'https://api.telegram.org/bot1:x/sendMessage',
+                        params={'chat_id': '5', 'text': 'card', 'reply_markup': markup})
+
+    assert response.json()['result']['chat']['id'] == 5
+    assert telegram.keyboards[5] == ['apple', 'pear', 'Next']
+    assert telegram.calls['sendMessage'] == 1
+
+
+def test_learner_starts_with_start_and_answers_from_the_keyboard(load_test):
+    class States:
+        def get_data(self, chat_id, user_id):
+            return {'target_word': 'apple'}
+
+    class Bot:
+        current_states = States()
+
+    telegram = load_test.FakeTelegram()
+    telegram.keyboards[7] = ['apple', 'pear', load_test.Command.NEXT]
+    learner = load_test.Learner(7, random.Random(1), accuracy=1.0)
+
+    assert learner.next_step(Bot(), telegram) == ('create_cards', '/start')
+    steps = {learner.next_step(Bot(), telegram) for _ in range(200)}
+    assert ('message_reply', 'apple') in steps
+    assert ('next_cards', load_test.Command.NEXT) in steps
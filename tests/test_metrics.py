@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import metrics
+from metrics import MetricsRegistry, record_error, registry, timed
+
+
+def _series(kind, name):
+    calls, errors, buckets, total = registry.snapshot()[(kind, name)]
+    return calls, errors, buckets
+
+
+def test_timed_counts_calls_errors_and_latency_buckets():
+    @timed('test')
+    def work(fail):
+        if fail:
+            raise ValueError('failed')
+        return 'done'
+
+    assert work(False) == 'done'
+    with pytest.raises(ValueError):
+        work(True)
+
+    calls, errors, buckets = _series('test', 'work')
+    assert (calls, errors, sum(buckets)) == (2, 1, 2)
+    assert 'bot_calls_total{kind="test",name="work"} 2' in registry.render()
+
+
+def test_timed_coroutine_function():
+    @timed('test')
+    async def async_work():
+        return 'done'
+
+    assert asyncio.run(async_work()) == 'done'
+    assert _series('test', 'async_work')[:2] == (1, 0)
+
+
+def test_record_error_charges_the_innermost_instrumented_call():
+    @timed('test')
+    def inner():
+        record_error()
+
+    @timed('test')
+    def outer():
+        inner()
+
+    outer()
+    assert _series('test', 'inner')[1] == 1
+    assert _series('test', 'outer')[1] == 0
+
+
+def test_render_exports_histograms_and_gauges():
+    metrics_registry = MetricsRegistry()
+    metrics_registry.observe('query', 'q', 0.003)
+    metrics_registry.observe('query', 'q', 20.0, failed=True)
+    metrics_registry.register_gauges('bot_pool', lambda: {'in_use': 2}, 'Pool stats.')
+
+    text = metrics_registry.render()
+
+    assert 'bot_latency_seconds_bucket{kind="query",name="q",le="0.0025"} 0' in text
+    assert 'bot_latency_seconds_bucket{kind="query",name="q",le="0.005"} 1' in text
+    assert 'bot_latency_seconds_bucket{kind="query",name="q",le="+Inf"} 2' in text
+    assert 'bot_errors_total{kind="query",name="q"} 1' in text
+    assert 'bot_pool{stat="in_use"} 2' in text
+
+
+def test_slow_query_log_names_the_calling_function(tmp_path, monkeypatch):
+    log = tmp_path / 'slow.log'
+    monkeypatch.setattr(metrics, 'SLOW_QUERY_LOG', str(log))
+
+    @timed('query')
+    def slow_function():
+        metrics.log_slow_query('select  1\n from users', (5,), 0.25)
+
+    slow_function()
+    assert 'slow query 250.0 ms in slow_function: select 1 from users params=(5,)' in log.read_text()
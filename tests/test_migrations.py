@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from migrations import MIGRATIONS, migrate  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append(' '.join(sql.split()))
+        self.result = [(version,) for version in self.conn.applied] if 'from schema_migrations' in sql else []
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+
+class FakeConnection:
+    """Records the statements of migrate(); schema_migrations holds the applied versions."""
+
+    def __init__(self, applied=()):
+        self.applied = set(applied)
+        self.executed = []
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def test_versions_are_unique_and_consecutive():
+    assert [migration.version for migration in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_online_migrations_are_single_statements():
+    # CONCURRENTLY cannot run inside the implicit transaction of a multi-statement query.
+    for migration in MIGRATIONS:
+        if migration.online:
+            assert migration.sql.strip().rstrip(';').count(';') == 0, migration.version
+            assert 'CONCURRENTLY' in migration.sql, migration.version
+
+
+def test_migrate_applies_only_the_pending_versions_in_order():
+    conn = FakeConnection(applied=[1, 2])
+
+    applied = migrate(conn, verbose=False)
+
+    assert applied == [migration.version for migration in MIGRATIONS if migration.version > 2]
+    assert conn.autocommit
+    assert conn.executed[0].startswith('select pg_advisory_lock')
+    assert conn.executed[-1].startswith('select pg_advisory_unlock')
+    first_applied = ' '.join(MIGRATIONS[2].sql.split())
+    assert first_applied in conn.executed
+    assert ' '.join(MIGRATIONS[0].sql.split()) not in conn.executed
+
+
+def test_migrate_on_an_up_to_date_schema_applies_nothing():
+    conn = FakeConnection(applied=[migration.version for migration in MIGRATIONS])
+    assert migrate(conn, verbose=False) == []
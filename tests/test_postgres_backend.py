@@ -0,0 +1,94 @@
+"""
+Runs the PostgreSQL storage functions of dict_jobs against a real server (DB_PARAMS), in
+a scratch schema that is dropped afterwards. Skipped without psycopg2 or a server.
+"""
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+import db_pool  # noqa: E402
+import dict_jobs  # noqa: E402
+from load_words import load_word_pairs  # noqa: E402
+from migrations import migrate  # noqa: E402
+from settings import DB_PARAMS  # noqa: E402
+from spaced_repetition import QUALITY_RECALLED  # noqa: E402
+from vocab_cache import VocabularyCache, WordCountCache  # noqa: E402
+
+from conftest import SHARED_PAIRS  # noqa: E402
+
+SCHEMA = 'bot_tests'
+USER = 1001
+
+
+def _execute(sql):
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """dict_jobs on a freshly migrated schema with the SHARED_PAIRS vocabulary."""
+    try:
+        _execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA};")
+    except psycopg2.OperationalError as ex:
+        pytest.skip(f'no PostgreSQL server: {ex}')
+    # Every connection, the pooled ones included, works in the scratch schema.
+    monkeypatch.setenv('PGOPTIONS', f'-c search_path={SCHEMA}')
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        migrate(conn, verbose=False)
+        conn.autocommit = False
+        load_word_pairs(conn, SHARED_PAIRS)
+    finally:
+        conn.close()
+    monkeypatch.setattr(db_pool, 'DB_REPLICA_DSN', '')
+    monkeypatch.setattr(db_pool, '_pool', None)
+    monkeypatch.setattr(dict_jobs, 'vocabulary',
+                        VocabularyCache(dict_jobs.shared_word_pairs, dict_jobs.user_word_pairs,
+                                        similar_distractors=False))
+    monkeypatch.setattr(dict_jobs, 'word_counts', WordCountCache())
+    yield dict_jobs
+    db_pool.close_pool()
+    _execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+
+def _count(sql, params=()):
+    with db_pool.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()[0]
+
+
+def test_add_user_is_idempotent(backend):
+    assert backend.add_user(USER, 'Tester') is True
+    assert backend.add_user(USER, 'Renamed') is False
+    assert _count("select count(*) from users where user_name = 'Tester'") == 1
+    assert backend.known_user_ids() == [USER]
+
+
+def test_scheduled_cards_introduce_new_pairs(backend):
+    backend.add_user(USER, 'Tester')
+
+    cards = backend.scheduled_cards(USER, 3)
+    assert len(cards) == 3
+    translations = dict(SHARED_PAIRS)
+    for card in cards:
+        assert translations[card.translate_word] == card.target_word
+    # The new pairs are scheduled and leased, so they are not handed out again.
+    assert _count("select count(*) from reviews where user_id = %s and shown_at is not null", (USER,)) == 3
+    more = backend.scheduled_cards(USER, 3)
+    assert not {card.pair_id for card in more} & {card.pair_id for card in cards}
+
+
+def test_record_review_and_release_cards(backend):
+    backend.add_user(USER, 'Tester')
+    first, second = backend.scheduled_cards(USER, 2)
+
+    assert backend.record_review(USER, first.pair_id, QUALITY_RECALLED).repetitions == 1
+    assert backend.release_cards(USER, [second.pair_id]) == 1
+    assert backend.scheduled_cards(USER, 1)[0].pair_id == second.pair_id
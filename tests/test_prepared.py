@@ -0,0 +1,86 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import prepared  # noqa: E402
+from prepared import PreparedStatement  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self, pooled=True):
+        if pooled:
+            self.prepared = set()
+
+
+class FakeCursor:
+    """Records (sql, params) of every execute; raises the queued errors first."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.executed = []
+        self.errors = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def test_placeholders_become_numbered_parameters():
+    positional = PreparedStatement('positional', 'select %s, %s;')
+    named = PreparedStatement('named', 'select %(uid)s, %(count)s where user_id = %(uid)s')
+
+    assert positional._prepare == 'PREPARE positional AS select $1, $2'
+    assert positional._execute == 'EXECUTE positional (%s, %s)'
+    # A named placeholder used twice is one parameter.
+    assert named._prepare == 'PREPARE named AS select $1, $2 where user_id = $1'
+    assert named._execute == 'EXECUTE named (%s, %s)'
+
+
+def test_statement_is_prepared_once_per_connection():
+    statement = PreparedStatement('lookup', 'select %(uid)s, %(count)s where user_id = %(uid)s')
+    cur = FakeCursor(FakeConnection())
+
+    statement.execute(cur, {'count': 5, 'uid': 7})
+    statement.execute(cur, {'count': 6, 'uid': 8})
+
+    assert cur.executed == [
+        (statement._prepare, None),
+        ('EXECUTE lookup (%s, %s)', [7, 5]),
+        ('EXECUTE lookup (%s, %s)', [8, 6]),
+    ]
+
+
+def test_plain_query_without_a_pooled_connection_or_when_disabled(monkeypatch):
+    statement = PreparedStatement('plain', 'select %s')
+    cur = FakeCursor(FakeConnection(pooled=False))
+    statement.execute(cur, (1,))
+
+    monkeypatch.setattr(prepared, 'DB_PREPARED_STATEMENTS', False)
+    pooled = FakeCursor(FakeConnection())
+    statement.execute(pooled, (2,))
+
+    assert cur.executed == [('select %s', (1,))]
+    assert pooled.executed == [('select %s', (2,))]
+
+
+def test_lost_statements_are_prepared_again():
+    statement = PreparedStatement('lost', 'select %s')
+    cur = FakeCursor(FakeConnection())
+    statement.execute(cur, (1,))
+
+    cur.errors.append(prepared.errors.InvalidSqlStatementName('prepared statement "lost" does not exist'))
+    with pytest.raises(prepared.errors.InvalidSqlStatementName):
+        statement.execute(cur, (2,))
+    statement.execute(cur, (3,))
+
+    assert [sql for sql, _ in cur.executed].count(statement._prepare) == 2
+
+
+def test_original_query_maps_an_execute_back_to_the_statement():
+    named = PreparedStatement('logged_named', 'select %(uid)s, %(count)s where user_id = %(uid)s')
+    positional = PreparedStatement('logged_positional', 'select %s, %s')
+
+    assert prepared.original_query('EXECUTE logged_named (%s, %s)', (5, 3)) == (named.sql, {'uid': 5, 'count': 3})
+    assert prepared.original_query('EXECUTE logged_positional (%s, %s)', (5, 3)) == (positional.sql, (5, 3))
+    assert prepared.original_query('select 1', None) == ('select 1', None)
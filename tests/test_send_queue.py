@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('telebot')
+
+from telebot.apihelper import ApiTelegramException  # noqa: E402
+
+from send_queue import OutboundQueue, TokenBucket  # noqa: E402
+
+from conftest import wait_until  # noqa: E402
+
+
+def rate_limited(retry_after):
+    return ApiTelegramException('sendMessage', None, {
+        'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+        'parameters': {'retry_after': retry_after}})
+
+
+class FakeBot:
+    """Records sent messages; raises the queued errors first, and holds sending while gate is clear."""
+
+    def __init__(self):
+        self.sent = []
+        self.errors = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.sending = threading.Event()
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        self.sending.set()
+        self.gate.wait()
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text, reply_markup, time.monotonic()))
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=10.0, capacity=2)
+    assert bucket.take() == 0.0
+    assert bucket.take() == 0.0
+    assert 0.0 < bucket.take() <= 0.1
+
+
+def test_messages_queued_while_sending_are_merged_with_the_last_keyboard():
+    bot = FakeBot()
+    bot.gate.clear()
+    outbox = OutboundQueue(bot, workers=1, global_rate=1000, global_burst=100, chat_rate=1000, chat_burst=100)
+    outbox.send(1, 'first')
+    wait_until(bot.sending.is_set)
+    outbox.send(1, 'second', reply_markup='keyboard 1')
+    outbox.send(1, 'third', reply_markup='keyboard 2')
+    bot.gate.set()
+    outbox.close()
+
+    assert [(text, markup) for _, text, markup, _ in bot.sent] == [
+        ('first', None), ('second\n\nthird', 'keyboard 2')]
+    stats = outbox.stats()
+    assert (stats['messages_sent'], stats['requests_sent'], stats['coalesced']) == (3, 2, 1)
+
+
+def test_a_chat_over_its_limit_is_delivered_in_order_later():
+    bot = FakeBot()
+    outbox = OutboundQueue(bot, workers=2, global_rate=1000, global_burst=100, chat_rate=50, chat_burst=1,
+                           coalesce=False)
+    for number in range(4):
+        outbox.send(1, str(number))
+    outbox.close()
+
+    assert [text for _, text, _, _ in bot.sent] == ['0', '1', '2', '3']
+    assert outbox.stats()['throttled'] > 0
+
+
+def test_rate_limited_message_is_retried_after_retry_after():
+    bot = FakeBot()
+    bot.errors.append(rate_limited(0.1))
+    outbox = OutboundQueue(bot, workers=1, global_rate=1000, global_burst=100, chat_rate=1000, chat_burst=100)
+    started = time.monotonic()
+    outbox.send(1, 'hello')
+    outbox.close()
+
+    assert [text for _, text, _, _ in bot.sent] == ['hello']
+    assert bot.sent[0][3] - started >= 0.1
+    assert outbox.stats()['rate_limited'] == 1
+
+
+def test_rate_limit_pauses_the_other_chats_too():
+    bot = FakeBot()
+    bot.errors.append(rate_limited(0.1))
+    outbox = OutboundQueue(bot, workers=1, global_rate=1000, global_burst=100, chat_rate=1000, chat_burst=100)
+    started = time.monotonic()
+    outbox.send(1, 'limited')
+    outbox.send(2, 'other chat')
+    outbox.close()
+
+    sent_at = {text: at for _, text, _, at in bot.sent}
+    assert sent_at['other chat'] - started >= 0.1
+
+
+def test_messages_beyond_max_pending_are_dropped():
+    bot = FakeBot()
+    bot.gate.clear()
+    outbox = OutboundQueue(bot, workers=1, global_rate=1000, global_burst=100, chat_rate=1000, chat_burst=100,
+                           coalesce=False, max_pending=2)
+    assert outbox.send(1, 'first')
+    wait_until(bot.sending.is_set)
+    assert outbox.send(1, 'second')
+    assert not outbox.send(1, 'third')
+    bot.gate.set()
+    outbox.close()
+
+    assert [text for _, text, _, _ in bot.sent] == ['first', 'second']
+    assert outbox.stats()['dropped'] == 1
+
+
+def test_other_errors_drop_the_message():
+    bot = FakeBot()
+    bot.errors.append(ApiTelegramException('sendMessage', None, {
+        'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}))
+    outbox = OutboundQueue(bot, workers=1, global_rate=1000, global_burst=100, chat_rate=1000, chat_burst=100)
+    outbox.send(1, 'lost')
+    outbox.send(2, 'delivered')
+    outbox.close()
+
+    assert [text for _, text, _, _ in bot.sent] == ['delivered']
+    assert outbox.stats()['failed'] == 1
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+base_storage = pytest.importorskip('telebot.storage.base_storage')
+if not hasattr(base_storage, 'StateContext'):
+    pytest.skip('needs the pyTelegramBotAPI version pinned in requirements.txt', allow_module_level=True)
+
+from session_store import MemorySessionStore, Session, SessionStateStorage  # noqa: E402
+
+
+def test_get_returns_a_copy():
+    store = MemorySessionStore()
+    assert store.get(1) == {}
+    store.set(1, {'step': 0, 'buttons': ['apple']})
+
+    session = store.get(1)
+    session['buttons'].append('pear')
+    assert store.get(1) == {'step': 0, 'buttons': ['apple']}
+    assert store.update(1, step=2) == {'step': 2, 'buttons': ['apple']}
+
+
+def test_session_slots_keep_unknown_keys_in_extra():
+    values = {'step': 1, 'e_word': 'kiwi', 'state': 'target_word',
+              'data': {'target_word': 'kiwi'}, 'missed': False, 'buttons': [], 'custom': 5}
+    session = Session.from_dict(values)
+
+    assert session.extra == {'custom': 5}
+    assert session.to_dict() == values
+
+
+def test_least_recently_active_session_is_evicted():
+    store = MemorySessionStore(max_sessions=2)
+    store.set(1, {'step': 1})
+    store.set(2, {'step': 2})
+    store.get(1)
+    store.set(3, {'step': 3})
+
+    assert store.get(2) == {}
+    assert store.get(1) == {'step': 1}
+    assert store.stats()['evicted_lru'] == 1
+
+
+def test_idle_session_is_dropped():
+    store = MemorySessionStore(idle_ttl=0.05)
+    store.set(1, {'step': 1})
+    time.sleep(0.06)
+
+    assert store.get(1) == {}
+    stats = store.stats()
+    assert (stats['sessions'], stats['evicted_idle']) == (0, 1)
+
+
+def test_stats_estimate_the_memory_per_session():
+    store = MemorySessionStore()
+    for user_id in range(10):
+        store.set(user_id, {'step': 0, 'buttons': ['apple', 'pear']})
+
+    stats = store.stats()
+    assert stats['sessions'] == 10
+    assert stats['bytes_per_session'] > 0
+    assert stats['bytes_total'] > stats['bytes_per_session'] * 10
+
+
+def test_telebot_state_lives_in_the_session():
+    store = MemorySessionStore()
+    storage = SessionStateStorage(store)
+    store.set(1, {'step': 0})
+
+    storage.set_state(1, 1, 'target_word')
+    storage.set_data(1, 1, 'target_word', 'apple')
+
+    assert storage.get_state(1, 1) == 'target_word'
+    assert store.get(1) == {'step': 0, 'state': 'target_word', 'data': {'target_word': 'apple'}}
+    assert storage.delete_state(1, 1)
+    assert store.get(1) == {'step': 0}
@@ -0,0 +1,35 @@
+import pytest
+
+from spaced_repetition import MIN_EASE, NEW_CARD, QUALITY_FORGOTTEN, QUALITY_RECALLED, ReviewState, next_review
+
+
+def test_recalled_intervals_grow_from_one_to_six_days_then_by_the_ease():
+    state = NEW_CARD
+    intervals = []
+    for _ in range(4):
+        state = next_review(state, QUALITY_RECALLED)
+        intervals.append(state.interval_days)
+
+    assert intervals == [1.0, 6.0, 15.0, 37.5]
+    assert state.repetitions == 4
+    # A grade of 4 leaves the ease factor unchanged.
+    assert state.ease == NEW_CARD.ease
+
+
+def test_perfect_answer_raises_the_ease():
+    assert next_review(NEW_CARD, 5).ease == pytest.approx(NEW_CARD.ease + 0.1)
+
+
+def test_forgotten_card_starts_over_with_a_lower_ease():
+    state = next_review(ReviewState(3, 15.0, 2.5), QUALITY_FORGOTTEN)
+
+    assert state.repetitions == 0
+    assert state.interval_days == 1.0
+    assert state.ease == pytest.approx(2.18)
+
+
+def test_ease_never_drops_below_the_minimum():
+    state = NEW_CARD
+    for _ in range(10):
+        state = next_review(state, 0)
+    assert state.ease == MIN_EASE
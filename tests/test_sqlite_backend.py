@@ -0,0 +1,112 @@
+from spaced_repetition import QUALITY_FORGOTTEN, QUALITY_RECALLED
+from storage_types import WORD_ALREADY_OWNED, WORD_CREATED, WORD_LINKED_EXISTING
+
+from conftest import SHARED_PAIRS
+
+USER = 1001
+OTHER_USER = 1002
+
+
+def _count(backend, sql, params=()):
+    return backend.get_connection().execute(sql, params).fetchone()[0]
+
+
+def test_users(backend):
+    assert backend.if_user_not_exist(USER)
+    assert backend.add_user(USER, 'Tester') is True
+    assert backend.add_user(USER, 'Renamed') is False
+    assert _count(backend, "select count(*) from users where user_name = 'Tester'") == 1
+    assert not backend.if_user_not_exist(USER)
+    assert backend.known_user_ids() == [USER]
+
+
+def test_add_word_statuses(backend):
+    backend.add_user(USER, 'Tester')
+    backend.add_user(OTHER_USER, 'Other')
+
+    created = backend.add_word_to_dict(USER, 'kiwi', 'киви')
+    assert created.status == WORD_CREATED
+    assert created.word_count == 1
+
+    assert backend.add_word_to_dict(USER, 'kiwi', 'киви').status == WORD_ALREADY_OWNED
+    # A shared pair is already visible to everybody.
+    assert backend.add_word_to_dict(USER, 'apple', 'яблоко').status == WORD_ALREADY_OWNED
+
+    linked = backend.add_word_to_dict(OTHER_USER, 'kiwi', 'киви')
+    assert linked.status == WORD_LINKED_EXISTING
+    assert linked.pair_id == created.pair_id
+    assert linked.word_count == 1
+
+
+def test_delete_words(backend):
+    backend.add_user(USER, 'Tester')
+    backend.add_user(OTHER_USER, 'Other')
+    backend.add_word_to_dict(USER, 'kiwi', 'киви')
+    backend.add_word_to_dict(USER, 'lime', 'лайм')
+    backend.add_word_to_dict(OTHER_USER, 'kiwi', 'киви')
+
+    deleted = backend.delete_words_from_dict(USER, ['kiwi', 'mango'])
+    assert deleted.removed == 1
+    assert deleted.word_count == 1
+    # The other user still has the pair, so it is kept.
+    assert [e_word for _, e_word, _ in backend.user_word_pairs(OTHER_USER)] == ['kiwi']
+
+    assert backend.delete_word_from_dict(USER, 'лайм')
+    assert _count(backend, "select count(*) from e_words where word = 'lime'") == 0
+    assert not backend.delete_word_from_dict(USER, 'lime')
+
+
+def test_custom_words_user_count(backend):
+    backend.add_user(USER, 'Tester')
+    assert backend.custom_words_user_count(USER) == '0'
+    backend.add_word_to_dict(USER, 'kiwi', 'киви')
+    backend.add_word_to_dict(USER, 'lime', 'лайм')
+    assert backend.custom_words_user_count(USER) == '2'
+
+    # A cold cache reads the count kept in the users row.
+    backend.word_counts._counts.clear()
+    assert backend.custom_words_user_count(USER) == '2'
+
+
+def test_scheduled_cards_and_record_review(backend):
+    backend.add_user(USER, 'Tester')
+
+    cards = backend.scheduled_cards(USER, 2)
+    assert len(cards) == 2
+    assert len({card.pair_id for card in cards}) == 2
+    translations = dict(SHARED_PAIRS)
+    for card in cards:
+        assert translations[card.translate_word] == card.target_word
+        assert card.target_word not in card.other_words
+        assert len(card.other_words) == 4
+    # Handed-out cards are leased and not handed out again.
+    more = backend.scheduled_cards(USER, 2)
+    assert not {card.pair_id for card in more} & {card.pair_id for card in cards}
+
+    recalled = backend.record_review(USER, cards[0].pair_id, QUALITY_RECALLED)
+    assert recalled.repetitions == 1
+    assert recalled.interval_days > 0
+    forgotten = backend.record_review(USER, cards[1].pair_id, QUALITY_FORGOTTEN)
+    assert forgotten.repetitions == 0
+    assert _count(backend, "select count(*) from reviews where user_id = ? and shown_at is null", (USER,)) == 2
+
+
+def test_release_cards(backend):
+    backend.add_user(USER, 'Tester')
+    cards = backend.scheduled_cards(USER, 2)
+
+    assert backend.release_cards(USER, [cards[0].pair_id, None]) == 1
+    # The released card is due again and handed out before unseen ones.
+    assert backend.scheduled_cards(USER, 1)[0].pair_id == cards[0].pair_id
+
+
+def test_record_answers(backend):
+    backend.add_user(USER, 'Tester')
+    card = backend.scheduled_cards(USER, 1)[0]
+    rows = [(USER, card.pair_id, card.target_word, True, 1700000000.0),
+            (USER, card.pair_id, 'wrong', False, 1700000001.5),
+            (OTHER_USER, None, 'skipped', False, 1700000002.0)]
+
+    assert backend.record_answers(rows) == 3
+    assert _count(backend, "select count(*) from answers where user_id = ?", (USER,)) == 2
+    assert _count(backend, "select sum(correct) from answers where user_id = ?", (USER,)) == 1
@@ -0,0 +1,24 @@
+import pytest
+
+from vocab_cache import VocabularyCache
+
+from conftest import SHARED_PAIRS, wait_until
+
+USER = 1001
+# apple has two more right translations: a shared one and one of the user's own.
+SHARED_ROWS = [(number, e_word, r_word) for number, (e_word, r_word) in enumerate(SHARED_PAIRS, 1)]
+SHARED_ROWS.append((len(SHARED_ROWS) + 1, 'apple', 'яблоки'))
+USER_ROWS = [(100, 'apple', 'яблочко'), (101, 'kiwi', 'киви')]
+
+
+@pytest.mark.parametrize('similar', [False, True])
+def test_distractors_are_never_other_translations_of_the_shown_word(similar):
+    cache = VocabularyCache(lambda: SHARED_ROWS, lambda user_id: USER_ROWS, similar_distractors=similar)
+    if similar:
+        cache.distractors(USER, 'яблоко')
+        wait_until(lambda: len(cache._indexes[True]) > 0)
+
+    for _ in range(50):
+        others = cache.distractors(USER, 'яблоко', eng_rus=True, count=4, translate_word='apple')
+        assert len(others) == 4
+        assert not {'яблоко', 'яблоки', 'яблочко'} & set(others)
@@ -0,0 +1,293 @@
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+from itertools import chain
+
+from distractor_index import DistractorIndex
+
+# Random picks spent per requested distractor before falling back to a full scan.
+DISTRACTOR_ATTEMPTS = 10
+
+# At most this many of the user's own words are ranked as similar distractors per card.
+SIMILAR_USER_WORDS = 64
+
+
+class _WordPairs:
+    """
+    Array-backed list of word pairs: the pair ids live in a compact integer array and
+    the English and Russian words in two parallel lists with the same indexes.
+    """
+    __slots__ = ('pair_ids', 'e_words', 'r_words', 'loaded_at', '_answers')
+
+    def __init__(self, rows):
+        self.pair_ids = array('l')
+        self.e_words = []
+        self.r_words = []
+        for pair_id, e_word, r_word in rows:
+            self.pair_ids.append(pair_id)
+            self.e_words.append(e_word)
+            self.r_words.append(r_word)
+        self.loaded_at = time.monotonic()
+        self._answers = None
+
+    def __len__(self):
+        return len(self.pair_ids)
+
+    def answers(self, shown_word, eng_rus):
+        """
+        All words paired here with shown_word: its Russian translations for eng_rus,
+        else its English ones. The lookup is built on first use.
+        """
+        if self._answers is None:
+            by_e_word, by_r_word = defaultdict(list), defaultdict(list)
+            for e_word, r_word in zip(self.e_words, self.r_words):
+                by_e_word[e_word].append(r_word)
+                by_r_word[r_word].append(e_word)
+            self._answers = {True: dict(by_e_word), False: dict(by_r_word)}
+        return self._answers[eng_rus].get(shown_word, ())
+
+
+class VocabularyCache:
+    """
+    Class Purpose:
+
+    An in-process copy of the vocabulary that lets cards be built without touching
+    the database. It keeps one snapshot of the shared word pairs (pairs not linked
+    to any user), which is the same for everybody, plus a small overlay with the
+    custom pairs of each recently active user. Overlays are evicted in LRU order.
+
+    Parameters:
+
+    shared_loader: A callable returning (pair_id, e_word, r_word) rows of the shared pairs,
+    or None if they could not be loaded.
+    user_loader: A callable taking a user ID and returning that user's pairs in the same form.
+    max_users: How many user overlays are kept in memory.
+    shared_ttl: Seconds after which the shared snapshot is reloaded, so words
+    loaded into the database by other processes show up eventually.
+    similar_distractors: Pick distractors that look like the answer (see DistractorIndex)
+    instead of random words. The shared words of both languages are then indexed, and
+    each reload of the snapshot only adds the new words to the index.
+    """
+
+    def __init__(self, shared_loader, user_loader, max_users=10000, shared_ttl=300.0,
+                 similar_distractors=True):
+        self.shared_loader = shared_loader
+        self.user_loader = user_loader
+        self.max_users = max_users
+        self.shared_ttl = shared_ttl
+        self._indexes = {True: DistractorIndex(), False: DistractorIndex()} if similar_distractors else None
+        self._shared = None
+        self._overlays = OrderedDict()
+        # Per-user invalidations: the value of a counter taken at each user's last change,
+        # kept for max_users users; older ones are only remembered as a floor.
+        self._invalidations = 0
+        self._invalidated = OrderedDict()
+        self._invalidated_floor = 0
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def needs_shared(self):
+        shared = self._shared
+        return shared is None or time.monotonic() - shared.loaded_at > self.shared_ttl
+
+    def needs_user(self, user_id):
+        with self._lock:
+            return user_id not in self._overlays
+
+    def put_shared(self, rows):
+        """Replaces the shared snapshot with rows loaded by the caller."""
+        shared = _WordPairs(rows)
+        if self._indexes is not None:
+            threading.Thread(target=self._index_shared, args=(shared,), name='distractor-index',
+                             daemon=True).start()
+        self._shared = shared
+        return shared
+
+    def _index_shared(self, shared):
+        # Indexing a large vocabulary for the first time takes seconds, so it is done in
+        # the background; until then distractors are picked at random.
+        self._indexes[True].sync(shared.r_words)
+        self._indexes[False].sync(shared.e_words)
+
+    def put_user(self, user_id, rows, invalidations=None):
+        """
+        Stores a user overlay loaded by the caller. If the user's words were changed
+        after invalidations (the value of invalidation_count() taken before loading),
+        the overlay is returned but not kept.
+        """
+        overlay = _WordPairs(rows)
+        with self._lock:
+            if invalidations is not None and self._invalidated_since(user_id, invalidations):
+                return overlay
+            self._overlays[user_id] = overlay
+            self._overlays.move_to_end(user_id)
+            while len(self._overlays) > self.max_users:
+                self._overlays.popitem(last=False)
+        return overlay
+
+    def invalidation_count(self):
+        return self._invalidations
+
+    def _invalidated_since(self, user_id, invalidations):
+        return self._invalidated.get(user_id, self._invalidated_floor) > invalidations
+
+    def _shared_pairs(self):
+        if not self.needs_shared():
+            return self._shared
+        stale = self._shared
+        # One caller reloads the snapshot while the others keep using the stale one;
+        # only the very first load is waited for.
+        if not self._reload_lock.acquire(blocking=stale is None):
+            return stale
+        try:
+            if self.needs_shared():
+                rows = self.shared_loader()
+                if rows is not None:
+                    return self.put_shared(rows)
+            return self._shared
+        finally:
+            self._reload_lock.release()
+
+    def _user_pairs(self, user_id):
+        with self._lock:
+            overlay = self._overlays.get(user_id)
+            if overlay is not None:
+                self._overlays.move_to_end(user_id)
+                return overlay
+            invalidations = self._invalidations
+        rows = self.user_loader(user_id)
+        if rows is None:
+            return None
+        return self.put_user(user_id, rows, invalidations)
+
+    def card(self, user_id, eng_rus=True, others_count=4):
+        """
+        Function Purpose:
+
+        Builds a vocabulary card from memory: a random pair visible to the user
+        (shared or their own) and distractor words of the answer language.
+
+        Return Value:
+
+        A tuple (pair_id, target_word, translate_word, other_words) like dict_jobs.Card,
+        or None if the vocabulary could not be loaded or is empty.
+        """
+        shared = self._shared_pairs()
+        overlay = self._user_pairs(user_id)
+        if shared is None or overlay is None:
+            return None
+        shared_count = len(shared)
+        total = shared_count + len(overlay)
+        if total == 0:
+            return None
+        index = random.randrange(total)
+        pairs = shared if index < shared_count else overlay
+        if pairs is overlay:
+            index -= shared_count
+        if eng_rus:
+            target_word, translate_word = pairs.r_words[index], pairs.e_words[index]
+            shared_words, user_words = shared.r_words, overlay.r_words
+        else:
+            target_word, translate_word = pairs.e_words[index], pairs.r_words[index]
+            shared_words, user_words = shared.e_words, overlay.e_words
+        answers = self._answers(shared, overlay, translate_word, eng_rus)
+        others = self._distractors(shared_words, user_words, target_word, others_count, eng_rus, answers)
+        return pairs.pair_ids[index], target_word, translate_word, others
+
+    def distractors(self, user_id, target_word, eng_rus=True, count=4, translate_word=None):
+        """
+        Picks distractor words for a card whose pair was chosen elsewhere (e.g. by the
+        review scheduler); other translations of translate_word, the shown word, are
+        never picked. Returns None if the vocabulary could not be loaded.
+        """
+        shared = self._shared_pairs()
+        overlay = self._user_pairs(user_id)
+        if shared is None or overlay is None:
+            return None
+        answers = self._answers(shared, overlay, translate_word, eng_rus) if translate_word is not None else ()
+        if eng_rus:
+            return self._distractors(shared.r_words, overlay.r_words, target_word, count, eng_rus, answers)
+        return self._distractors(shared.e_words, overlay.e_words, target_word, count, eng_rus, answers)
+
+    @staticmethod
+    def _answers(shared, overlay, shown_word, eng_rus):
+        # Every right answer to the shown word; none of them may be offered as a wrong option.
+        return {*shared.answers(shown_word, eng_rus), *overlay.answers(shown_word, eng_rus)}
+
+    def _distractors(self, shared_words, user_words, target_word, count, eng_rus, answers=()):
+        chosen = []
+        if self._indexes is not None:
+            extra = user_words
+            if len(extra) > SIMILAR_USER_WORDS:
+                extra = random.sample(extra, SIMILAR_USER_WORDS)
+            chosen = self._indexes[eng_rus].similar(target_word, count, exclude=answers, extra=extra)
+            if len(chosen) == count:
+                return chosen
+        # Too few similar words: fill up with random ones.
+        shared_count = len(shared_words)
+        total = shared_count + len(user_words)
+        if total == 0:
+            return chosen
+        seen = {target_word, *chosen, *answers}
+        for _ in range(count * DISTRACTOR_ATTEMPTS):
+            if len(chosen) == count:
+                return chosen
+            index = random.randrange(total)
+            word = shared_words[index] if index < shared_count else user_words[index - shared_count]
+            if word not in seen:
+                seen.add(word)
+                chosen.append(word)
+        if len(chosen) < count:
+            # A small vocabulary: pick from all remaining distinct words instead.
+            rest = list(dict.fromkeys(w for w in chain(shared_words, user_words) if w not in seen))
+            chosen.extend(random.sample(rest, min(count - len(chosen), len(rest))))
+        return chosen
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._invalidations += 1
+            self._invalidated[user_id] = self._invalidations
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > self.max_users:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._invalidated_floor = max(self._invalidated_floor, forgotten)
+            self._overlays.pop(user_id, None)
+
+    def invalidate_shared(self):
+        self._shared = None
+
+
+class WordCountCache:
+    """
+    Class Purpose:
+
+    An LRU map from user ID to the number of the user's custom word pairs. It is filled
+    with the counts returned by the add and delete statements, so showing the count
+    after a change needs no query. Counts changed by another bot process are only
+    picked up after this process changes them itself or evicts the entry.
+
+    Parameters:
+
+    max_users: How many counts are kept in memory.
+    """
+
+    def __init__(self, max_users=10000):
+        self.max_users = max_users
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            count = self._counts.get(user_id)
+            if count is not None:
+                self._counts.move_to_end(user_id)
+            return count
+
+    def put(self, user_id, count):
+        with self._lock:
+            self._counts[user_id] = count
+            self._counts.move_to_end(user_id)
+            while len(self._counts) > self.max_users:
+                self._counts.popitem(last=False)